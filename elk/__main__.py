@@ -6,6 +6,7 @@ from simple_parsing import ArgumentParser
 
 from elk.evaluation.evaluate import Eval
 from elk.plotting.command import Plot
+from elk.training.refit import Refit
 from elk.training.sweep import Sweep
 from elk.training.train import Elicit
 
@@ -14,7 +15,7 @@ from elk.training.train import Elicit
 class Command:
     """Some top-level command"""
 
-    command: Elicit | Eval | Sweep | Plot
+    command: Elicit | Eval | Sweep | Plot | Refit
 
     def execute(self):
         return self.command.execute()
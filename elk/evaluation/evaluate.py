@@ -4,6 +4,7 @@ from pathlib import Path
 
 import pandas as pd
 import torch
+import yaml
 from simple_parsing.helpers import field
 
 from ..files import elk_reporter_dir
@@ -25,6 +26,30 @@ class Eval(Run):
             root = elk_reporter_dir() / self.source
             self.out_dir = root / "transfer" / "+".join(self.data.datasets)
 
+        # Evaluate the reporters on the token location they were trained on
+        source_loc = self.source_token_loc()
+        if source_loc is None:
+            return
+        if self.use_token_loc is None and source_loc != self.data.token_loc:
+            self.use_token_loc = source_loc
+        elif (self.use_token_loc or self.data.token_loc) != source_loc:
+            raise ValueError(
+                f"The reporters in {self.source} were trained on the '{source_loc}' "
+                f"token location, but use_token_loc is '{self.use_token_loc}'"
+            )
+
+    def source_token_loc(self) -> str | None:
+        """The token location the source run was trained on, read from its saved
+        config, or `None` if there isn't one."""
+        path = elk_reporter_dir() / self.source / "cfg.yaml"
+        if not path.exists():
+            return None
+
+        with open(path) as f:
+            cfg = yaml.safe_load(f)
+
+        return cfg.get("use_token_loc") or cfg["data"]["token_loc"]
+
     def execute(self, highlight_color: Color = "cyan"):
         return super().execute(highlight_color, split_type="val")
 
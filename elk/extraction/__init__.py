@@ -1,6 +1,7 @@
 from .balanced_sampler import BalancedSampler, FewShotSampler
 from .extraction import Extract, extract, extract_hiddens
 from .generator import _GeneratorBuilder, _GeneratorConfig
+from .memo import ForwardMemo
 from .prompt_loading import load_prompts
 
 __all__ = [
@@ -9,6 +10,7 @@ __all__ = [
     "Extract",
     "extract_hiddens",
     "extract",
+    "ForwardMemo",
     "_GeneratorConfig",
     "_GeneratorBuilder",
     "load_prompts",
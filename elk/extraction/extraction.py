@@ -2,6 +2,7 @@
 import logging
 import os
 from contextlib import nullcontext, redirect_stdout
+from copy import deepcopy
 from dataclasses import InitVar, dataclass, replace
 from itertools import zip_longest
 from typing import Any, Iterable, Literal
@@ -25,12 +26,14 @@ from simple_parsing import Serializable, field
 from torch import Tensor
 from transformers import AutoConfig, PreTrainedModel
 
+from ..files import memo_dir
 from ..promptsource import DatasetTemplates
 from ..utils import (
     Color,
     assert_type,
     colorize,
     float_to_int16,
+    hidden_column,
     infer_label_column,
     infer_num_classes,
     instantiate_model,
@@ -46,6 +49,7 @@ from .dataset_name import (
     parse_dataset_string,
 )
 from .generator import _GeneratorBuilder
+from .memo import ForwardMemo
 from .prompt_loading import load_prompts
 
 
@@ -68,12 +72,29 @@ class Extract(Serializable):
     int8: bool = False
     """Whether to perform inference in mixed int8 precision with `bitsandbytes`."""
 
+    memoize: bool = False
+    """Whether to memoize forward passes on disk, keyed by the exact token ids fed to
+    the model. Duplicate prompts are then only run once across datasets, splits and
+    runs using the same model, tokenizer, `token_loc` and layers."""
+
     max_examples: tuple[int, int] = (1000, 1000)
     """Maximum number of examples to use from each split of the dataset."""
 
     num_shots: int = 0
     """Number of examples for few-shot prompts. If zero, prompts are zero-shot."""
 
+    fewshot_sharing: Literal["none", "example", "run"] = "none"
+    """How to share few-shot demonstrations between prompts. "none" draws fresh
+    demonstrations for every template and pseudo-label. "example" and "run" draw them
+    once per example or once per run and use them as a common prefix, whose key-value
+    cache is computed once and reused for every variant and choice."""
+
+    pack_sequences: bool = False
+    """Whether to pack the (variant, choice) sequences of each example into as few rows
+    as possible, using position id resets and a block-diagonal causal attention mask,
+    instead of running one forward pass per sequence. Only supported for decoder-only
+    models whose attention implementation accepts 4D attention masks."""
+
     num_variants: int = -1
     """The number of prompt templates to use for each example. If -1, all available
     templates are used."""
@@ -94,6 +115,11 @@ class Extract(Serializable):
     token_loc: Literal["first", "last", "mean"] = "last"
     """The location of the token to extract hidden states from."""
 
+    extra_token_locs: tuple[Literal["first", "last", "mean"], ...] = ()
+    """Additional token locations to extract hidden states from in the same forward
+    pass. These are stored in `hidden_{layer}_{token_loc}` columns, while `token_loc`
+    is stored in `hidden_{layer}` as usual."""
+
     use_encoder_states: bool = False
     """Whether to extract hidden states from the encoder instead of the decoder in the
     case of encoder-decoder models."""
@@ -105,6 +131,13 @@ class Extract(Serializable):
             raise ValueError(
                 "Must specify at least one dataset to extract hiddens from."
             )
+        if len(set(self.token_locs)) != len(self.token_locs):
+            raise ValueError("extra_token_locs must be unique and exclude token_loc")
+        if self.pack_sequences and self.fewshot_sharing != "none":
+            raise ValueError(
+                "Cannot use both --pack_sequences and --fewshot_sharing. Please use "
+                "only one."
+            )
 
         if len(self.max_examples) > 2:
             raise ValueError(
@@ -137,6 +170,11 @@ class Extract(Serializable):
             layer_range = range(1, config.num_hidden_layers, layer_stride)
             self.layers = tuple(layer_range)
 
+    @property
+    def token_locs(self) -> tuple[Literal["first", "last", "mean"], ...]:
+        """All the token locations to extract, starting with the primary one."""
+        return (self.token_loc, *self.extra_token_locs)
+
     def explode(self) -> list["Extract"]:
         """Explode this config into a list of configs, one for each layer."""
         return [
@@ -183,34 +221,77 @@ def extract_hiddens(
     if has_lm_preds and rank == 0:
         print("Model has language model head, will store predictions.")
 
+    global_max_examples = cfg.max_examples[0 if split_type == "train" else 1]
+
+    # break `max_examples` among the processes roughly equally
+    max_examples = global_max_examples // world_size
+
+    # the last process gets the remainder (which is usually small)
+    if rank == world_size - 1:
+        max_examples += global_max_examples % world_size
+
     prompt_ds = load_prompts(
         ds_names[0],
         binarize=cfg.binarize,
         num_shots=cfg.num_shots,
+        fewshot_sharing=cfg.fewshot_sharing,
         split_type=split_type,
         template_path=cfg.template_path,
         rank=rank,
         world_size=world_size,
         seed=cfg.seed,
+        max_examples=max_examples,
     )
 
     layer_indices = cfg.layers or tuple(range(1, model.config.num_hidden_layers))
-
-    global_max_examples = cfg.max_examples[0 if split_type == "train" else 1]
-
-    # break `max_examples` among the processes roughly equally
-    max_examples = global_max_examples // world_size
     max_length = assert_type(int, tokenizer.model_max_length)
 
+    # We can only reuse the key-value cache of a shared few-shot prefix, or pack several
+    # sequences into one row, if the model is causal.
+    is_decoder_only = has_lm_preds and not is_enc_dec
+    if cfg.pack_sequences and not is_decoder_only:
+        raise ValueError("Sequence packing is only supported for decoder-only models")
+    cached_prefix = ""
+    prefix_cache: _PrefixCache | None = None
+
+    # Names of the columns for each hidden state vector we extract from a forward pass
+    columns = [
+        hidden_column(layer_idx, None if loc == cfg.token_loc else loc)
+        for loc in cfg.token_locs
+        for layer_idx in layer_indices
+    ]
+
+    memo = None
+    if cfg.memoize:
+        namespace = "\n".join(
+            map(
+                str,
+                [
+                    model.config._name_or_path,
+                    getattr(model.config, "_commit_hash", None),
+                    model.dtype,
+                    cfg.int8,
+                    cfg.use_encoder_states,
+                    type(tokenizer).__name__,
+                    tokenizer.name_or_path,
+                    len(tokenizer),
+                    cfg.token_locs,
+                    layer_indices,
+                ],
+            )
+        )
+        memo = ForwardMemo(
+            memo_dir() / "hiddens.sqlite",
+            namespace,
+            num_vectors=len(columns),
+            hidden_size=model.config.hidden_size,
+        )
+
     # Keep track of the number of examples we've yielded so far. We can't do something
     # clean like `islice` the dataset, because we skip examples that are too long, and
     # we can't predict how many of those there will be.
     num_yielded = 0
 
-    # the last process gets the remainder (which is usually small)
-    if rank == world_size - 1:
-        max_examples += global_max_examples % world_size
-
     for example in prompt_ds:
         # Check if we've yielded enough examples
         if num_yielded >= max_examples:
@@ -220,14 +301,14 @@ def extract_hiddens(
         num_choices = len(example["prompts"][0])
 
         hidden_dict = {
-            f"hidden_{layer_idx}": torch.empty(
+            col: torch.empty(
                 num_variants,
                 num_choices,
                 model.config.hidden_size,
                 device=device,
                 dtype=torch.int16,
             )
-            for layer_idx in layer_indices
+            for col in columns
         }
         lm_logits = torch.empty(
             num_variants,
@@ -237,13 +318,41 @@ def extract_hiddens(
         )
         text_questions = []
 
+        # Sequences waiting to be packed together, along with their memo keys
+        pending: list[tuple[int, int, Tensor, Tensor | None, str | None]] = []
+
+        # Shared few-shot demonstrations, if any
+        prefix = example.get("fewshot_prefix", "")
+        use_prefix_cache = bool(prefix) and is_decoder_only
+        if use_prefix_cache and prefix != cached_prefix:
+            # Tokenizers can merge the end of the prefix with the start of the text
+            # that follows, like GPT-2 does with the trailing "\n\n", so we only cache
+            # the tokens that the prefix has in common with a full prompt
+            prefix_ids = tokenizer(prefix, return_tensors="pt").input_ids[0]
+            prompt_ids = tokenizer(
+                prefix + example["prompts"][0][0]["question"], return_tensors="pt"
+            ).input_ids[0]
+
+            n = min(len(prefix_ids), len(prompt_ids))
+            mismatches = (prefix_ids[:n] != prompt_ids[:n]).nonzero()
+            n = int(mismatches[0]) if len(mismatches) else n
+
+            prefix_cache = (
+                _PrefixCache.build(
+                    model, prefix_ids[None, :n].to(device), layer_indices
+                )
+                if n
+                else None
+            )
+            cached_prefix = prefix
+
         # Iterate over variants
         for i, record in enumerate(example["prompts"]):
             variant_questions = []
 
             # Iterate over answers
             for j, choice in enumerate(record):
-                text = choice["question"]
+                text = prefix + choice["question"]
 
                 # Only feed question, not the answer, to the encoder for enc-dec models
                 target = choice["answer"] if is_enc_dec else None
@@ -256,6 +365,15 @@ def extract_hiddens(
                 ).to(device)
 
                 ids = assert_type(Tensor, encoding.input_ids)
+
+                # Continue from the cached prefix if the prompt starts with exactly its
+                # tokens, and otherwise run the model on the full sequence
+                cache = None
+                if use_prefix_cache and prefix_cache is not None:
+                    rest = prefix_cache.strip(ids)
+                    if rest is not None:
+                        ids, cache = rest, prefix_cache
+
                 if is_enc_dec:
                     answer = labels = assert_type(Tensor, encoding.labels)
                 else:
@@ -276,39 +394,78 @@ def extract_hiddens(
                     ids = torch.cat([ids, answer], -1)
 
                 # If this input is too long, skip it
-                if ids.shape[-1] > max_length:
+                if ids.shape[-1] + (cache.length if cache else 0) > max_length:
                     break
                 else:
                     # Record the EXACT question we fed to the model
                     variant_questions.append(text)
 
-                inputs: dict[str, Tensor | None] = dict(input_ids=ids.long())
-                if is_enc_dec or has_lm_preds:
-                    inputs["labels"] = labels
-                outputs = model(**inputs, output_hidden_states=True)
-
-                # Compute the log probability of the answer tokens if available
-                if has_lm_preds:
-                    lm_logits[i, j] = -assert_type(Tensor, outputs.loss)
-
-                hiddens = (
-                    outputs.get("decoder_hidden_states") or outputs["hidden_states"]
-                )
-                # Throw out layers we don't care about
-                hiddens = [hiddens[i] for i in layer_indices]
-
-                # Current shape of each element: (batch_size, seq_len, hidden_size)
-                if cfg.token_loc == "first":
-                    hiddens = [h[..., 0, :] for h in hiddens]
-                elif cfg.token_loc == "last":
-                    hiddens = [h[..., -1, :] for h in hiddens]
-                elif cfg.token_loc == "mean":
-                    hiddens = [h.mean(dim=-2) for h in hiddens]
+                memo_key = None
+                if memo is not None:
+                    # The key must cover the full sequence, including any cached prefix
+                    full_ids = ids
+                    if cache is not None:
+                        full_ids = torch.cat([cache.ids, ids], dim=-1)
+
+                    memo_key = memo.key(full_ids, labels)
+                    cached = memo.get(memo_key)
+                    if cached is not None:
+                        memo_hiddens, memo_logit = cached
+                        for col, hidden in zip(columns, memo_hiddens):
+                            hidden_dict[col][i, j] = hidden
+                        if has_lm_preds:
+                            lm_logits[i, j] = assert_type(float, memo_logit)
+                        continue
+
+                if cfg.pack_sequences:
+                    pending.append((i, j, ids, labels, memo_key))
+                    continue
+
+                if cache is not None:
+                    hidden_vecs, lm_logits[i, j] = cache.forward(
+                        model,
+                        ids,
+                        assert_type(Tensor, labels),
+                        layer_indices=layer_indices,
+                        token_locs=cfg.token_locs,
+                    )
                 else:
-                    raise ValueError(f"Invalid token_loc: {cfg.token_loc}")
+                    inputs: dict[str, Tensor | None] = dict(input_ids=ids.long())
+                    if is_enc_dec or has_lm_preds:
+                        inputs["labels"] = labels
+                    outputs = model(**inputs, output_hidden_states=True)
 
-                for layer_idx, hidden in zip(layer_indices, hiddens):
-                    hidden_dict[f"hidden_{layer_idx}"][i, j] = float_to_int16(hidden)
+                    # Compute the log probability of the answer tokens if available
+                    if has_lm_preds:
+                        lm_logits[i, j] = -assert_type(Tensor, outputs.loss)
+
+                    hiddens = (
+                        outputs.get("decoder_hidden_states") or outputs["hidden_states"]
+                    )
+                    # Throw out layers we don't care about
+                    hiddens = [hiddens[i] for i in layer_indices]
+
+                    # Current shape of each element: (batch_size, seq_len, hidden_size)
+                    pooled = []
+                    for loc in cfg.token_locs:
+                        if loc == "first":
+                            pooled += [h[..., 0, :] for h in hiddens]
+                        elif loc == "last":
+                            pooled += [h[..., -1, :] for h in hiddens]
+                        elif loc == "mean":
+                            pooled += [h.mean(dim=-2) for h in hiddens]
+                        else:
+                            raise ValueError(f"Invalid token_loc: {loc}")
+
+                    hidden_vecs = torch.cat(pooled)
+
+                pooled = float_to_int16(hidden_vecs)
+                for col, hidden in zip(columns, pooled):
+                    hidden_dict[col][i, j] = hidden
+
+                if memo is not None and memo_key is not None:
+                    lm_logit = float(lm_logits[i, j]) if has_lm_preds else None
+                    memo.put(memo_key, pooled, lm_logit)
 
             # We skipped a pseudolabel because it was too long; break out of this whole
             # example and move on to the next one
@@ -322,6 +479,23 @@ def extract_hiddens(
         if len(text_questions) != num_variants:
             continue
 
+        if pending:
+            results = _packed_forward(
+                model,
+                [(ids, labels) for _, _, ids, labels, _ in pending],
+                layer_indices=layer_indices,
+                token_locs=cfg.token_locs,
+                max_length=max_length,
+            )
+            for (i, j, _, _, memo_key), (hiddens, lm_logit) in zip(pending, results):
+                pooled = float_to_int16(hiddens)
+                for col, hidden in zip(columns, pooled):
+                    hidden_dict[col][i, j] = hidden
+
+                lm_logits[i, j] = lm_logit
+                if memo is not None and memo_key is not None:
+                    memo.put(memo_key, pooled, float(lm_logit))
+
         out_record: dict[str, Any] = dict(
             label=example["label"],
             variant_ids=example["template_names"],
@@ -331,9 +505,215 @@ def extract_hiddens(
         if has_lm_preds:
             out_record["model_logits"] = lm_logits.log_softmax(dim=-1)
 
+        if memo is not None:
+            memo.commit()
+
         num_yielded += 1
         yield out_record
 
+    if memo is not None:
+        total = memo.hits + memo.misses
+        print(
+            f"Forward-pass memo hit rate on rank {rank}: "
+            f"{memo.hit_rate:.1%} ({memo.hits} of {total} prompts)"
+        )
+        memo.close()
+
+
+@dataclass
+class _PrefixCache:
+    """Key-value cache of a prefix shared by many sequences, such as few-shot
+    demonstrations, along with what's needed to pool hidden states over the full
+    sequences while only running the model on the rest of their tokens."""
+
+    ids: Tensor
+    """Token ids of the prefix, of shape `[1, length]`."""
+
+    past_key_values: Any
+    """The key-value cache of the prefix."""
+
+    first: list[Tensor]
+    """Hidden states of the first token of the prefix, for each layer."""
+
+    sums: list[Tensor]
+    """Sum of the hidden states over the prefix, for each layer."""
+
+    @property
+    def length(self) -> int:
+        return self.ids.shape[-1]
+
+    @classmethod
+    def build(
+        cls, model: PreTrainedModel, ids: Tensor, layer_indices: tuple[int, ...]
+    ) -> "_PrefixCache":
+        """Run a causal model on the prefix `ids` and cache the result."""
+        outputs = model(input_ids=ids, output_hidden_states=True, use_cache=True)
+        hiddens = [outputs["hidden_states"][i] for i in layer_indices]
+        return cls(
+            ids,
+            outputs.past_key_values,
+            first=[h[..., 0, :] for h in hiddens],
+            sums=[h.sum(dim=-2) for h in hiddens],
+        )
+
+    def strip(self, ids: Tensor) -> Tensor | None:
+        """Return the tokens of `ids` after the prefix, or `None` if `ids` doesn't
+        start with the prefix followed by at least one more token."""
+        if ids.shape[-1] <= self.length or not torch.equal(
+            ids[..., : self.length], self.ids
+        ):
+            return None
+
+        return ids[..., self.length :]
+
+    def forward(
+        self,
+        model: PreTrainedModel,
+        ids: Tensor,
+        labels: Tensor,
+        *,
+        layer_indices: tuple[int, ...],
+        token_locs: tuple[Literal["first", "last", "mean"], ...],
+    ) -> tuple[Tensor, Tensor]:
+        """Run the model on the tokens `ids` following the prefix.
+
+        Args:
+            model: The causal model the prefix was cached with.
+            ids: Input ids of shape `[1, seq_len]`, excluding the prefix.
+            labels: Labels of the same shape, where -100 marks tokens that don't
+                contribute to the loss. The first one must be -100, since predicting
+                it would need the logits of the prefix.
+            layer_indices: Indices of the hidden states to return.
+            token_locs: The locations of the tokens to extract hidden states from.
+
+        Returns:
+            Hidden states of shape `[len(token_locs) * len(layer_indices),
+            hidden_size]`, pooled over the full sequence including the prefix and
+            ordered by token location and then by layer, and the mean log probability
+            of the labeled tokens.
+        """
+        # Newer versions of transformers update the cache in-place, so we hand a copy
+        # to the model to keep the prefix cache pristine
+        outputs = model(
+            input_ids=ids.long(),
+            labels=labels,
+            past_key_values=deepcopy(self.past_key_values),
+            use_cache=True,
+            output_hidden_states=True,
+        )
+        hiddens = [outputs["hidden_states"][i] for i in layer_indices]
+
+        pooled = []
+        for loc in token_locs:
+            if loc == "first":
+                pooled += self.first
+            elif loc == "last":
+                pooled += [h[..., -1, :] for h in hiddens]
+            elif loc == "mean":
+                pooled += [
+                    (h.sum(dim=-2) + h0) / (h.shape[-2] + self.length)
+                    for h, h0 in zip(hiddens, self.sums)
+                ]
+            else:
+                raise ValueError(f"Invalid token_loc: {loc}")
+
+        return torch.cat(pooled), -assert_type(Tensor, outputs.loss)
+
+
+def _packed_forward(
+    model: PreTrainedModel,
+    sequences: list[tuple[Tensor, Tensor | None]],
+    *,
+    layer_indices: tuple[int, ...],
+    token_locs: tuple[Literal["first", "last", "mean"], ...],
+    max_length: int,
+) -> list[tuple[Tensor, Tensor]]:
+    """Run sequences through a decoder-only model, packing several into each row.
+
+    Sequences are greedily concatenated into rows of at most `max_length` tokens. Each
+    sequence gets its own position ids starting from zero, and a block-diagonal causal
+    attention mask prevents tokens from attending to other sequences in the same row,
+    so the result is the same as running each sequence on its own, up to differences
+    in floating point summation order between matmuls of different shapes.
+
+    Args:
+        model: The decoder-only model.
+        sequences: Input ids of shape `[1, seq_len]` and optional labels of the same
+            shape, where -100 marks tokens that don't contribute to the loss.
+        layer_indices: Indices of the hidden states to return.
+        token_locs: The locations of the tokens to extract hidden states from.
+        max_length: The maximum number of tokens in a packed row.
+
+    Returns:
+        For each sequence, hidden states of shape
+        `[len(token_locs) * len(layer_indices), hidden_size]`, ordered by token
+        location and then by layer, and the mean log probability of the labeled tokens.
+    """
+    rows, row, row_len = [], [], 0
+    for idx, (ids, _) in enumerate(sequences):
+        if row and row_len + ids.shape[-1] > max_length:
+            rows.append(row)
+            row, row_len = [], 0
+
+        row.append(idx)
+        row_len += ids.shape[-1]
+
+    if row:
+        rows.append(row)
+
+    results = []
+    for row in rows:
+        lengths = [sequences[idx][0].shape[-1] for idx in row]
+        ids = torch.cat([sequences[idx][0] for idx in row], dim=-1).long()
+        device = ids.device
+
+        # Reset the position ids at the start of each sequence
+        position_ids = torch.cat([torch.arange(n, device=device) for n in lengths])
+
+        # Tokens may only attend to earlier tokens from the same sequence
+        segment_ids = torch.repeat_interleave(
+            torch.arange(len(row), device=device), torch.tensor(lengths, device=device)
+        )
+        allowed = segment_ids[:, None] == segment_ids[None]
+        allowed &= torch.ones_like(allowed).tril()
+        mask = torch.zeros(allowed.shape, device=device, dtype=model.dtype)
+        mask.masked_fill_(~allowed, torch.finfo(model.dtype).min)
+
+        outputs = model(
+            input_ids=ids,
+            attention_mask=mask[None, None],
+            position_ids=position_ids[None],
+            output_hidden_states=True,
+        )
+        hiddens = [outputs["hidden_states"][i][0] for i in layer_indices]
+        logits = outputs["logits"][0]
+
+        start = 0
+        for idx, n in zip(row, lengths):
+            end = start + n
+            pooled = []
+            for loc in token_locs:
+                if loc == "first":
+                    pooled += [h[start] for h in hiddens]
+                elif loc == "last":
+                    pooled += [h[end - 1] for h in hiddens]
+                elif loc == "mean":
+                    pooled += [h[start:end].mean(dim=0) for h in hiddens]
+                else:
+                    raise ValueError(f"Invalid token_loc: {loc}")
+
+            # Same as the causal LM loss computed by HF: tokens predict the next label
+            labels = sequences[idx][1]
+            assert labels is not None, "Packed sequences must have labels"
+            lm_logit = -torch.nn.functional.cross_entropy(
+                logits[start : end - 1].float(), labels[0, 1:]
+            )
+
+            results.append((torch.stack(pooled), lm_logit))
+            start = end
+
+    return results
+
 
 # Dataset.from_generator wraps all the arguments in lists, so we unpack them here
 def _extraction_worker(**kwargs):
@@ -368,10 +748,11 @@ def hidden_features(cfg: Extract) -> tuple[DatasetInfo, Features]:
 
     layer_indices = cfg.layers or tuple(range(1, model_cfg.num_hidden_layers))
     layer_cols = {
-        f"hidden_{layer}": Array3D(
+        hidden_column(layer, None if loc == cfg.token_loc else loc): Array3D(
             dtype="int16",
             shape=(num_variants, num_classes, model_cfg.hidden_size),
         )
+        for loc in cfg.token_locs
         for layer in layer_indices
     }
     other_cols = {
@@ -406,8 +787,16 @@ def extract(
     num_gpus: int = -1,
     min_gpu_mem: int | None = None,
     split_type: Literal["train", "val", None] = None,
+    max_bytes_per_flush: int | None = None,
+    max_shard_size: int | None = None,
 ) -> DatasetDictWithName:
-    """Extract hidden states from a model and return a `DatasetDict` containing them."""
+    """Extract hidden states from a model and return a `DatasetDict` containing them.
+
+    Each device writes its own shard files in parallel. `max_bytes_per_flush` caps the
+    number of bytes of hidden states each process buffers before writing them to disk,
+    and `max_shard_size` caps the size in bytes of each shard file, so that a process
+    may write several of them.
+    """
     info, features = hidden_features(cfg)
 
     devices = select_usable_devices(num_gpus, min_memory=min_gpu_mem)
@@ -444,6 +833,7 @@ def extract(
                 num_examples=min(limit, v.num_examples) * len(cfg.datasets),
                 dataset_name=v.dataset_name,
             ),
+            max_bytes_per_flush=max_bytes_per_flush,
             gen_kwargs=dict(
                 cfg=[cfg] * len(devices),
                 device=devices,
@@ -462,6 +852,7 @@ def extract(
     for split, builder in builders.items():
         builder.download_and_prepare(
             download_mode=DownloadMode.FORCE_REDOWNLOAD if disable_cache else None,
+            max_shard_size=max_shard_size,
             num_proc=len(devices),
         )
         ds[split] = builder.as_dataset(split=split)
@@ -1,14 +1,21 @@
+import math
 from copy import deepcopy
 from dataclasses import dataclass, field
 from typing import Any, Callable
 
+import numpy as np
 from datasets import (
+    Array2D,
+    Array3D,
+    Array4D,
+    Array5D,
     BuilderConfig,
     DatasetInfo,
     Features,
     GeneratorBasedBuilder,
     SplitInfo,
 )
+from datasets import config as ds_config
 from datasets.splits import NamedSplit
 
 
@@ -51,7 +58,13 @@ class _SplitGenerator:
 
 
 class _GeneratorBuilder(GeneratorBasedBuilder):
-    """Patched version of `datasets.Generator` allowing for splits besides `train`"""
+    """Patched version of `datasets.Generator` allowing for splits besides `train`
+
+    The default `datasets` writer buffers a fixed number of rows before flushing them
+    to disk. Our rows can be tens of megabytes each, since they contain the hiddens of
+    every layer, so passing `max_bytes_per_flush` instead sizes the writer batches
+    such that each process buffers at most that many bytes of array data.
+    """
 
     BUILDER_CONFIG_CLASS = _GeneratorConfig
     config: _GeneratorConfig
@@ -60,11 +73,20 @@ class _GeneratorBuilder(GeneratorBasedBuilder):
         self,
         split_name: str,
         split_info: SplitInfo,
+        max_bytes_per_flush: int | None = None,
         **kwargs,
     ):
         self.split_name = split_name
         self.split_info = split_info
 
+        features = kwargs.get("features")
+        if max_bytes_per_flush is not None and features is not None:
+            rows_per_flush = max_bytes_per_flush // _row_nbytes(features)
+            kwargs.setdefault(
+                "writer_batch_size",
+                max(1, min(rows_per_flush, ds_config.DEFAULT_MAX_BATCH_SIZE)),
+            )
+
         super().__init__(**kwargs)
 
     def _info(self):
@@ -85,3 +107,13 @@ class _GeneratorBuilder(GeneratorBasedBuilder):
 
         for idx, ex in enumerate(self.config.generator(**gen_kwargs)):
             yield idx, ex
+
+
+def _row_nbytes(features: Features) -> int:
+    """Number of bytes taken up by the fixed-size array columns of a single row."""
+    nbytes = 0
+    for feature in features.values():
+        if isinstance(feature, (Array2D, Array3D, Array4D, Array5D)):
+            nbytes += math.prod(feature.shape) * np.dtype(feature.dtype).itemsize
+
+    return max(nbytes, 1)
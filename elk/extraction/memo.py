@@ -0,0 +1,96 @@
+"""Persistent memoization of forward passes, keyed by the exact model inputs."""
+import hashlib
+import sqlite3
+from pathlib import Path
+
+import torch
+from torch import Tensor
+
+
+class ForwardMemo:
+    """On-disk store of pooled hidden states for previously seen model inputs.
+
+    Each entry holds the `int16`-encoded hidden states of every requested layer at each
+    requested token location, plus the log probability of the answer if the model has
+    a language model head. Entries are keyed by a hash of the exact token ids fed to the
+    model together with a `namespace` string identifying everything else that affects
+    the output: the model and its revision, the tokenizer, the token locations and the
+    layers. Since the key only depends on the inputs, duplicate prompts are free across
+    datasets, splits and runs that share the same namespace.
+
+    The store is a SQLite database, so it can safely be shared by several extraction
+    processes at once.
+
+    Args:
+        path: Path to the SQLite database. Created if it doesn't exist.
+        namespace: String identifying the model, tokenizer and pooling settings.
+        num_vectors: The number of hidden state vectors stored per entry, i.e. the
+            number of layers times the number of token locations.
+        hidden_size: The hidden size of the model.
+    """
+
+    def __init__(self, path: Path, namespace: str, num_vectors: int, hidden_size: int):
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.namespace = namespace
+        self.shape = (num_vectors, hidden_size)
+        self.hits = 0
+        self.misses = 0
+
+        # Other processes may be writing at the same time, so wait for their locks
+        self.conn = sqlite3.connect(path, timeout=600)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS hiddens "
+            "(key TEXT PRIMARY KEY, hiddens BLOB NOT NULL, lm_logit REAL)"
+        )
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups so far that were found in the store."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def key(self, input_ids: Tensor, labels: Tensor | None = None) -> str:
+        """Return the key for the given model inputs."""
+        digest = hashlib.sha256(self.namespace.encode())
+        digest.update(input_ids.long().cpu().numpy().tobytes())
+
+        if labels is not None:
+            digest.update(b"labels")
+            digest.update(labels.long().cpu().numpy().tobytes())
+
+        return digest.hexdigest()
+
+    def get(self, key: str) -> tuple[Tensor, float | None] | None:
+        """Look up an entry, returning `int16` hiddens of shape `[vectors, hidden_size]`
+        and the answer log probability, or `None` if it isn't in the store."""
+        row = self.conn.execute(
+            "SELECT hiddens, lm_logit FROM hiddens WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        blob, lm_logit = row
+        hiddens = torch.frombuffer(bytearray(blob), dtype=torch.int16)
+        return hiddens.view(self.shape), lm_logit
+
+    def put(self, key: str, hiddens: Tensor, lm_logit: float | None = None) -> None:
+        """Add an entry with `int16` hiddens of shape `[vectors, hidden_size]`."""
+        assert hiddens.shape == self.shape, f"Expected shape {self.shape}"
+        assert hiddens.dtype == torch.int16, "Hiddens must be int16-encoded"
+
+        blob = hiddens.cpu().numpy().tobytes()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO hiddens VALUES (?, ?, ?)", (key, blob, lm_logit)
+        )
+
+    def commit(self) -> None:
+        """Make the entries added so far visible to other processes."""
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
@@ -1,10 +1,12 @@
+import math
 from collections import Counter
+from itertools import islice
 from random import Random
 from typing import Any, Iterator, Literal
 
 from datasets import ClassLabel, Dataset, Value, load_dataset
 
-from ..promptsource import DatasetTemplates
+from ..promptsource import DatasetTemplates, Template
 from ..utils import (
     assert_type,
     infer_label_column,
@@ -18,11 +20,14 @@ def load_prompts(
     *,
     binarize: bool = False,
     num_shots: int = 0,
+    fewshot_sharing: Literal["none", "example", "run"] = "none",
     seed: int = 42,
     split_type: Literal["train", "val"] = "train",
     template_path: str | None = None,
     rank: int = 0,
     world_size: int = 1,
+    max_examples: int | None = None,
+    oversample: float = 0.1,
 ) -> Iterator[dict]:
     """Load a dataset full of prompts generated from the specified dataset.
 
@@ -31,11 +36,23 @@ def load_prompts(
         binarize: Whether to binarize the dataset labels for multi-class datasets.
         num_shots: The number of examples to use in few-shot prompts. If zero, prompts
             are zero-shot.
+        fewshot_sharing: How few-shot demonstrations are shared between prompts.
+            With "none", fresh demonstrations are drawn for every template and
+            pseudo-label. With "example" or "run", demonstrations are drawn once per
+            example or once for the whole run, rendered with a single randomly chosen
+            template, and returned separately under the `fewshot_prefix` key so that
+            they form a common prefix of every variant and choice.
         seed: The seed to use for prompt randomization.
         split_type: Whether to use the train or val split of the dataset.
         template_path: Path to feed into `DatasetTemplates` for loading templates.
         rank: The rank of the current process. Defaults to 0.
         world_size: The number of processes. Defaults to 1.
+        max_examples: The number of examples this process expects to consume. If
+            given, we sample row ids up front and only read those rows from disk,
+            instead of shuffling the whole split. More rows are drawn lazily if the
+            consumer needs them (e.g. because some prompts were too long).
+        oversample: Fraction of extra rows to draw on top of `max_examples`, to
+            account for examples which get skipped or dropped during balancing.
 
     Returns:
         An iterable of prompt dictionaries.
@@ -45,7 +62,9 @@ def load_prompts(
     ds_dict = assert_type(dict, load_dataset(ds_name, config_name or None))
     split_name = select_split(ds_dict, split_type)
 
-    ds = assert_type(Dataset, ds_dict[split_name].shuffle(seed=seed))
+    ds = assert_type(Dataset, ds_dict[split_name])
+    if max_examples is None:
+        ds = ds.shuffle(seed=seed)
     if world_size > 1:
         ds = ds.shard(world_size, rank)
 
@@ -89,27 +108,103 @@ def load_prompts(
     else:
         fewshot_iter = None
 
+    templates = list(prompter.templates.values())
+    fewshot_prefix = None
+    if fewshot_iter is not None and fewshot_sharing == "run":
+        fewshot_prefix = _render_fewshot(rng.choice(templates), next(fewshot_iter))
+
+    if max_examples is not None:
+        # Only read the rows we're actually going to use. This way the cost of loading
+        # prompts scales with `max_examples` rather than with the size of the split.
+        batch_size = math.ceil(max_examples * (1 + oversample))
+        rows = _sample_rows(ds, batch_size, Random(seed))
+    else:
+        rows = ds.to_iterable_dataset()
+
     if label_column in ds.features:
-        ds = BalancedSampler(
-            ds.to_iterable_dataset(),
+        rows = BalancedSampler(
+            rows,
             set(label_choices),
             label_col=label_column,
         )
-    else:
-        if rank == 0:
-            print("No label column found, not balancing")
-        ds = ds.to_iterable_dataset()
+    elif rank == 0:
+        print("No label column found, not balancing")
+
+    for example in rows:
+        if fewshot_iter is not None and fewshot_sharing == "example":
+            fewshot_prefix = _render_fewshot(rng.choice(templates), next(fewshot_iter))
 
-    for example in ds:
-        yield _convert_to_prompts(
+        record = _convert_to_prompts(
             example,
             binarize=binarize,
             label_column=label_column,
             label_choices=label_choices,  # type: ignore[arg-type]
             prompter=prompter,
             rng=rng,
-            fewshot_iter=fewshot_iter,
+            fewshot_iter=fewshot_iter if fewshot_sharing == "none" else None,
         )
+        if fewshot_prefix is not None:
+            record["fewshot_prefix"] = fewshot_prefix
+
+        yield record
+
+
+def _sample_rows(
+    ds: Dataset, num_rows: int, rng: Random, read_size: int = 1000
+) -> Iterator[dict]:
+    """Yield rows of `ds` in random order without shuffling the whole dataset.
+
+    We draw `num_rows` row ids at a time without replacement, read them from disk in
+    sorted order so that Arrow can gather them sequentially, and then yield them in
+    the order they were drawn. Another batch of ids is only drawn once the previous
+    one is exhausted, so consumers that stop early never touch the rest of the data.
+    """
+    permutation = _lazy_permutation(len(ds), rng)
+
+    while ids := list(islice(permutation, num_rows)):
+        rows = {}
+        sorted_ids = sorted(ids)
+        for start in range(0, len(sorted_ids), read_size):
+            chunk = sorted_ids[start : start + read_size]
+            batch = ds[chunk]
+            for i, values in zip(chunk, zip(*batch.values())):
+                rows[i] = dict(zip(batch.keys(), values))
+
+        for i in ids:
+            yield rows.pop(i)
+
+
+def _lazy_permutation(n: int, rng: Random) -> Iterator[int]:
+    """Yield a random permutation of `range(n)`, one id at a time.
+
+    This is a Fisher-Yates shuffle of a virtual `list(range(n))`, where we only store
+    the positions that have been swapped. Each id costs O(1) time and memory no matter
+    how many have already been drawn, and nothing is allocated for the rest.
+    """
+    swapped: dict[int, int] = {}
+
+    for t in range(n):
+        j = rng.randrange(t, n)
+        drawn = swapped.get(j, j)
+
+        # Move the id at position t into the slot we just drew from
+        current = swapped.pop(t, t)
+        if j != t:
+            swapped[j] = current
+
+        yield drawn
+
+
+def _qa_cat(q: str, a: str) -> str:
+    # if the jinja template already adds whitespace, don't add more
+    sep = "" if not q or q[-1].isspace() or not a or a[0].isspace() else " "
+    return f"{q}{sep}{a}" if a and not a.isspace() else q
+
+
+def _render_fewshot(template: Template, examples: list[dict]) -> str:
+    """Render few-shot demonstrations with `template` as a prefix for a question."""
+    fewshot_texts = [_qa_cat(q, a) for q, a in map(template.apply, examples)]
+    return "\n\n".join(fewshot_texts) + "\n\n"
 
 
 def _convert_to_prompts(
@@ -125,11 +220,6 @@ def _convert_to_prompts(
     prompts = []
     templates = list(prompter.templates.values())
 
-    def qa_cat(q: str, a: str) -> str:
-        # if the jinja template already adds whitespace, don't add more
-        sep = "" if not q or q[-1].isspace() or not a or a[0].isspace() else " "
-        return f"{q}{sep}{a}" if a and not a.isspace() else q
-
     # For sanity checking that prompts are unique
     prompt_counter = Counter()
     label = example[label_column]
@@ -156,11 +246,7 @@ def _convert_to_prompts(
 
             if fewshot_iter is not None:
                 # Infinite iterator so we don't need to worry about StopIteration
-                fewshot_examples = next(fewshot_iter)
-                fewshot_texts = [
-                    qa_cat(q, a) for q, a in map(template.apply, fewshot_examples)
-                ]
-                q = "\n\n".join(fewshot_texts) + "\n\n" + q
+                q = _render_fewshot(template, next(fewshot_iter)) + q
 
             choices.append(
                 dict(
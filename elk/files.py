@@ -11,6 +11,11 @@ def sweeps_dir() -> Path:
     return elk_reporter_dir() / "sweeps"
 
 
+def memo_dir() -> Path:
+    """Return the directory where memoized forward passes are stored."""
+    return elk_reporter_dir() / "memo"
+
+
 def elk_reporter_dir() -> Path:
     """Return the directory where reporter checkpoints and logs are stored."""
     env_dir = os.environ.get("ELK_DIR", None)
@@ -25,6 +25,7 @@ from .utils import (
     Color,
     assert_type,
     get_layer_indices,
+    hidden_column,
     int16_to_float32,
     select_split,
     select_usable_devices,
@@ -46,10 +47,23 @@ class Run(ABC, Serializable):
     prompt_indices: tuple[int, ...] = ()
     """The indices of the prompt templates to use. If empty, all prompts are used."""
 
+    use_token_loc: Literal["first", "last", "mean"] | None = None
+    """Which of the extracted token locations to use. Must be either `data.token_loc`
+    or one of `data.extra_token_locs`. Defaults to `data.token_loc`."""
+
     concatenated_layer_offset: int = 0
     debug: bool = False
     min_gpu_mem: int | None = None  # in bytes
     num_gpus: int = -1
+
+    max_bytes_per_flush: int = 256 * 1024**2
+    """Maximum number of bytes of hidden states each extraction process buffers before
+    writing them to disk. This keeps extraction RAM flat no matter how many layers or
+    prompt templates are extracted."""
+
+    max_shard_size: int | None = None
+    """Maximum size in bytes of each shard file written by an extraction process. If
+    None, each process writes a single shard per split."""
     out_dir: Path | None = None
     disable_cache: bool = field(default=False, to_dict=False)
 
@@ -66,6 +80,8 @@ class Run(ABC, Serializable):
                 num_gpus=self.num_gpus,
                 min_gpu_mem=self.min_gpu_mem,
                 split_type=split_type,
+                max_bytes_per_flush=self.max_bytes_per_flush,
+                max_shard_size=self.max_shard_size,
             )
             for cfg in self.data.explode()
         ]
@@ -123,29 +139,58 @@ class Run(ABC, Serializable):
         device = devices[rank]
         return device
 
+    def layer_column(self, layer: int) -> str:
+        """Name of the dataset column with the hidden states to use for `layer`."""
+        loc = self.use_token_loc
+        if loc is None or loc == self.data.token_loc:
+            return hidden_column(layer)
+        elif loc in self.data.extra_token_locs:
+            return hidden_column(layer, loc)
+        else:
+            raise ValueError(
+                f"Token location '{loc}' was not extracted; add it to extra_token_locs"
+            )
+
     def prepare_data(
         self, device: str, layer: int, split_type: Literal["train", "val"]
     ) -> dict[str, tuple[Tensor, Tensor, Tensor | None]]:
         """Prepare data for the specified layer and split type."""
         out = {}
+        column = self.layer_column(layer)
 
         for ds_name, ds in self.datasets:
             key = select_split(ds, split_type)
 
             split = ds[key].with_format("torch", device=device, dtype=torch.int16)
-            labels = assert_type(Tensor, split["label"])
-            hiddens = int16_to_float32(assert_type(Tensor, split[f"hidden_{layer}"]))
+            # Newer versions of datasets return lazy columns, which [:] materializes
+            labels = assert_type(Tensor, split["label"][:])
+            hiddens = int16_to_float32(assert_type(Tensor, split[column][:]))
             if self.prompt_indices:
                 hiddens = hiddens[:, self.prompt_indices]
 
             with split.formatted_as("torch", device=device):
                 has_preds = "model_logits" in split.features
-                lm_preds = split["model_logits"] if has_preds else None
+                lm_preds = split["model_logits"][:] if has_preds else None
 
             out[ds_name] = (hiddens, labels.to(hiddens.device), lm_preds)
 
         return out
 
+    def prepare_labels(
+        self, device: str, split_type: Literal["train", "val"]
+    ) -> dict[str, tuple[Tensor, Tensor | None]]:
+        """Load the labels and model predictions of the specified split, without any
+        hidden states."""
+        out = {}
+        for ds_name, ds in self.datasets:
+            split = ds[select_split(ds, split_type)].with_format("torch", device=device)
+            labels = assert_type(Tensor, split["label"][:])
+
+            has_preds = "model_logits" in split.features
+            out[ds_name] = (labels, split["model_logits"][:] if has_preds else None)
+
+        return out
+
     def concatenate(self, layers):
         """Concatenate hidden states from a previous layer."""
         for layer in range(self.concatenated_layer_offset, len(layers)):
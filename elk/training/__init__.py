@@ -1,8 +1,9 @@
 from .ccs_reporter import CcsConfig, CcsReporter
-from .classifier import Classifier
+from .classifier import Classifier, RidgeFitter
 from .common import FitterConfig
-from .eigen_reporter import EigenFitter, EigenFitterConfig
+from .eigen_reporter import EigenFitter, EigenFitterConfig, MultiLayerEigenFitter
 from .platt_scaling import PlattMixin
+from .sketch import SketchedEigenFitter
 
 __all__ = [
     "CcsReporter",
@@ -11,5 +12,8 @@ __all__ = [
     "EigenFitter",
     "EigenFitterConfig",
     "FitterConfig",
+    "MultiLayerEigenFitter",
     "PlattMixin",
+    "RidgeFitter",
+    "SketchedEigenFitter",
 ]
@@ -34,3 +34,67 @@ class BurnsNorm(nn.Module):
             avg_norm = std.mean(dim=dims, keepdim=True)
 
             return x_normalized / avg_norm
+
+
+class BurnsNormFitter:
+    """Streaming estimate of the statistics used by `BurnsNorm`.
+
+    This lets data which doesn't fit in memory be normalized in batches. The resulting
+    `FittedBurnsNorm` is equivalent to applying `BurnsNorm` to all of the data at once,
+    separately for each index of the dimensions between the batch dimension and the
+    feature dimension. For contrast pairs of shape `[n, v, 2, d]`, that means each
+    template and each side of the pair is normalized separately, as in
+    `CcsReporter.fit`.
+
+    Args:
+        shape: The shape of each example, excluding the batch dimension.
+        scale: Whether to divide by the average standard deviation.
+    """
+
+    def __init__(
+        self,
+        shape: tuple[int, ...],
+        scale: bool = True,
+        *,
+        device: str | torch.device | None = None,
+        dtype: torch.dtype | None = None,
+    ):
+        self.scale = scale
+        self.n = 0
+        self.mean = torch.zeros(shape, device=device, dtype=dtype)
+        self.M2 = torch.zeros(shape, device=device, dtype=dtype)
+
+    @torch.no_grad()
+    def update(self, x: Tensor) -> None:
+        """Update the statistics with a batch of examples."""
+        n = len(x)
+        mean = x.mean(dim=0)
+        delta = mean - self.mean
+
+        # Chan et al. parallel update of the mean and sum of squared deviations
+        total = self.n + n
+        self.M2 += (x - mean).square().sum(dim=0) + delta.square() * self.n * n / total
+        self.mean += delta * n / total
+        self.n = total
+
+    def normalizer(self) -> "FittedBurnsNorm":
+        """Return a module which normalizes inputs with the current statistics."""
+        assert self.n > 0, "Call update() before normalizer()"
+        std = (self.M2 / self.n).sqrt()
+        avg_norm = std.mean(dim=-1, keepdim=True) if self.scale else std.new_ones(1)
+        return FittedBurnsNorm(self.mean, avg_norm)
+
+
+class FittedBurnsNorm(nn.Module):
+    """Burns et al. style normalization with fixed statistics from `BurnsNormFitter`."""
+
+    mean: Tensor
+    avg_norm: Tensor
+
+    def __init__(self, mean: Tensor, avg_norm: Tensor):
+        super().__init__()
+        self.register_buffer("mean", mean)
+        self.register_buffer("avg_norm", avg_norm)
+
+    def forward(self, x: Tensor) -> Tensor:
+        return (x - self.mean) / self.avg_norm
@@ -1,23 +1,26 @@
 """An ELK reporter network."""
 
 import math
-from copy import deepcopy
 from dataclasses import dataclass, field
-from typing import Literal, Optional, cast
+from typing import Callable, Iterable, Literal, Optional, ParamSpec, TypeVar, cast
 
 import torch
 import torch.nn as nn
 from concept_erasure import LeaceFitter
 from torch import Tensor
+from torch.func import functional_call, vmap
 from typing_extensions import override
 
 from ..parsing import parse_loss
-from ..utils.typing import assert_type
-from .burns_norm import BurnsNorm
+from .burns_norm import BurnsNorm, BurnsNormFitter, FittedBurnsNorm
+from .classifier import _lbfgs_batch
 from .common import FitterConfig
-from .losses import LOSSES
+from .losses import fused_loss
 from .platt_scaling import PlattMixin
 
+P = ParamSpec("P")
+R = TypeVar("R")
+
 
 @dataclass
 class CcsConfig(FitterConfig):
@@ -57,12 +60,39 @@ class CcsConfig(FitterConfig):
     """The number of epochs to train for."""
     num_tries: int = 10
     """The number of times to try training the reporter."""
-    optimizer: Literal["adam", "lbfgs"] = "lbfgs"
-    """The optimizer to use."""
+    successive_halving: bool = False
+    """Whether to prune the restarts with successive halving. Training runs in
+    rounds whose lengths double each time; after each round the worse half of the
+    restarts is discarded, until a single restart is left. The last survivor is
+    trained for `num_epochs` in total, but the total work is a small multiple of a
+    single restart rather than `num_tries` times it."""
+    optimizer: Literal["adam", "lbfgs", "newton"] = "lbfgs"
+    """The optimizer to use. "newton" is a trust-region Newton method using exact
+    Hessian-vector products, which only supports linear probes (`num_layers=1`) and
+    usually converges in a few dozen iterations."""
+    compile: bool = False
+    """Whether to compile the loss computation with `torch.compile`. Compilation
+    takes a while for each reporter, but makes each optimizer step faster, which
+    pays off for long training runs."""
     weight_decay: float = 0.01
     """The weight decay or L2 penalty to use."""
+    batch_size: Optional[int] = None
+    """If set, train with minibatch Adam on batches of this many examples, read
+    lazily from the extracted hidden states. Memory usage for training then doesn't
+    grow with the size of the training set, and several datasets can be pooled.
+    Each epoch is one pass over the data. Requires `optimizer="adam"`."""
 
     def __post_init__(self):
+        if self.optimizer == "newton" and self.num_layers != 1:
+            raise ValueError("The newton optimizer only supports num_layers=1")
+        if self.batch_size is not None:
+            if self.batch_size <= 0:
+                raise ValueError("batch_size must be positive")
+            if self.optimizer != "adam":
+                raise ValueError("batch_size is only supported with optimizer=adam")
+            if self.successive_halving:
+                raise ValueError("successive_halving is not supported with batch_size")
+
         self.loss_dict = parse_loss(self.loss)
 
         # standardize the loss field
@@ -93,6 +123,9 @@ class CcsReporter(nn.Module, PlattMixin):
         self.config = cfg
         self.in_features = in_features
         self.num_variants = num_variants
+        self.num_iters = 0
+        """The number of optimizer iterations used by the last call to `fit()` or
+        `fit_streaming()`, summed over the training rounds."""
 
         # Learnable Platt scaling parameters
         self.bias = nn.Parameter(torch.zeros(1, device=device, dtype=dtype))
@@ -189,28 +222,203 @@ class CcsReporter(nn.Module, PlattMixin):
         Returns:
             loss: The loss of the reporter on the contrast pair (x0, x1).
         """
-        loss = sum(
-            LOSSES[name](logit0, logit1, coef)
-            for name, coef in self.config.loss_dict.items()
-        )
-        return assert_type(Tensor, loss)
+        return fused_loss(logit0, logit1, self.config.loss_dict)
 
-    def fit(self, hiddens: Tensor) -> float:
+    def fit(self, hiddens: Tensor, warm_start: "CcsReporter | None" = None) -> float:
         """Fit the probe to the contrast pair `hiddens`.
 
+        The probe is trained from `num_tries` initializations at once, keeping the
+        one with the lowest loss. With `successive_halving`, the worse half of the
+        initializations is dropped after each training round.
+
+        Args:
+            hiddens: The contrast pairs, of shape [batch, variants, 2, dim].
+            warm_start: A reporter fit on other hidden states of the same size, such
+                as the previous layer. If given, the first initialization is its
+                solution, mapped through its normalizer and this one.
+
         Returns:
             best_loss: The best loss obtained.
         """
+        self.num_iters = 0
+        if self.config.norm == "burns":
+            self.norm = BurnsNorm()
+        else:
+            self.fit_norm([hiddens])
+
         x_neg, x_pos = hiddens.unbind(2)
+        x_neg, x_pos = self.norm(x_neg), self.norm(x_pos)
+
+        # Train all the restarts at once, stacking their parameters along a new
+        # leading dimension of size `num_tries`
+        params = self.init_restarts(x_neg, x_pos, warm_start)
+
+        if self.config.successive_halving:
+            params, losses = self.train_successive_halving(params, x_neg, x_pos)
+        else:
+            losses = self.train_restarts(params, x_neg, x_pos)
+
+        return self.load_best_restart(params, losses)
+
+    def train_restarts(
+        self,
+        params: dict[str, Tensor],
+        x_neg: Tensor,
+        x_pos: Tensor,
+        num_epochs: int | None = None,
+        adam_state: dict[str, dict] | None = None,
+    ) -> Tensor:
+        """Train the restarts with the configured optimizer, returning the final loss
+        of each restart. Modifies `params` in-place.
+
+        Args:
+            num_epochs: Number of epochs or iterations to train for. Defaults to
+                `num_epochs` in the config.
+            adam_state: Optimizer state to resume Adam from, which is updated in-place;
+                see `train_loop_adam`. Ignored by the other optimizers.
+        """
+        num_epochs = num_epochs or self.config.num_epochs
+
+        if self.config.optimizer == "lbfgs":
+            return self.train_loop_lbfgs(params, x_neg, x_pos, num_epochs)
+        elif self.config.optimizer == "adam":
+            return self.train_loop_adam(params, x_neg, x_pos, num_epochs, adam_state)
+        elif self.config.optimizer == "newton":
+            return self.train_loop_newton(params, x_neg, x_pos, num_epochs)
+        else:
+            raise ValueError(f"Optimizer {self.config.optimizer} is not supported")
 
-        # One-hot indicators for each prompt template
-        n, v, d = x_neg.shape
-        prompt_ids = torch.eye(v, device=x_neg.device).expand(n, -1, -1)
+    def train_successive_halving(
+        self, params: dict[str, Tensor], x_neg: Tensor, x_pos: Tensor
+    ) -> tuple[dict[str, Tensor], Tensor]:
+        """Train the restarts with successive halving.
 
+        There are `ceil(log2(num_tries)) + 1` rounds, and round `i` trains every
+        surviving restart for a share of `num_epochs` proportional to `2 ** i`. After
+        each round but the last, the restarts with the higher half of the losses are
+        dropped. Adam keeps its moment estimates across rounds, so the surviving
+        restarts follow the same trajectories as without pruning. LBFGS and Newton
+        start each round afresh from the current parameters.
+
+        Returns:
+            The parameters and final loss of the surviving restart, as new tensors with
+            a leading dimension of size 1.
+        """
+        num_tries = len(next(iter(params.values())))
+        num_rounds = math.ceil(math.log2(num_tries)) + 1
+
+        # Round lengths double each time and add up to num_epochs
+        total = 2**num_rounds - 1
+        budgets = [self.config.num_epochs * 2**i // total for i in range(num_rounds)]
+        budgets[-1] = self.config.num_epochs - sum(budgets[:-1])
+        budgets = [max(budget, 1) for budget in budgets]
+
+        adam_state: dict[str, dict] = {}
+        losses = torch.full([num_tries], torch.inf)
+        for i, num_epochs in enumerate(budgets):
+            losses = self.train_restarts(params, x_neg, x_pos, num_epochs, adam_state)
+            if i == num_rounds - 1:
+                break
+
+            # Keep the better half of the restarts, treating NaNs as infinite
+            keep = losses.nan_to_num(torch.inf).argsort()[: math.ceil(len(losses) / 2)]
+            losses = losses[keep]
+            params = {k: p.detach()[keep].requires_grad_() for k, p in params.items()}
+            adam_state = {
+                name: {k: v[keep] if v.ndim else v for k, v in state.items()}
+                for name, state in adam_state.items()
+            }
+
+        return params, losses
+
+    def fit_streaming(
+        self,
+        batches: Callable[[], Iterable[Tensor]],
+        warm_start: "CcsReporter | None" = None,
+    ) -> float:
+        """Fit the probe with minibatch Adam, without holding all of the data in
+        memory at once.
+
+        The normalizer is fit with one pass over the data, then each epoch is one
+        pass over the data with an optimizer step per batch. All the restarts are
+        trained at once, keeping the one with the lowest loss in the last epoch.
+
+        Args:
+            batches: Function returning an iterable over batches of contrast pairs,
+                of shape [batch, variants, 2, dim]. It's called once per pass over
+                the data, so it should shuffle the batches if needed.
+            warm_start: A reporter to initialize the first restart from, as in
+                `fit()`.
+
+        Returns:
+            best_loss: The best mean loss over the last epoch.
+        """
+        self.fit_norm(batches())
+        assert self.norm is not None
+        self.num_iters = 0
+
+        params = {}
+        optimizer = None
+        losses = torch.full([self.config.num_tries], torch.inf)
+        restart_losses = self.compiled(self.restart_losses)
+
+        for _ in range(self.config.num_epochs):
+            total, count = 0.0, 0
+            for x in batches():
+                x_neg, x_pos = self.norm(x).unbind(2)
+
+                # Initialize the restarts using the first batch if needed for PCA
+                if optimizer is None:
+                    params = self.init_restarts(x_neg, x_pos, warm_start)
+                    optimizer = torch.optim.AdamW(
+                        params.values(),
+                        lr=self.config.lr,
+                        weight_decay=self.config.weight_decay,
+                    )
+
+                optimizer.zero_grad()
+                batch_losses = restart_losses(params, x_neg, x_pos)
+                batch_losses.sum().backward()
+                optimizer.step()
+                self.num_iters += 1
+
+                total += batch_losses.detach() * len(x)
+                count += len(x)
+
+            losses = total / count
+
+        # Like `fit()`, normalize new data with its own statistics from now on, so the
+        # reporter works on hidden states with any number of templates
         if self.config.norm == "burns":
             self.norm = BurnsNorm()
-        else:
-            fitter = LeaceFitter(d, 2 * v, dtype=x_neg.dtype, device=x_neg.device)
+
+        return self.load_best_restart(params, losses)
+
+    def fit_norm(self, batches: Iterable[Tensor]) -> None:
+        """Fit the LEACE eraser or Burns normalizer in one pass over batches of
+        contrast pairs, of shape [batch, variants, 2, dim]."""
+        fitter = None
+
+        for hiddens in batches:
+            x_neg, x_pos = hiddens.unbind(2)
+            n, v, d = x_neg.shape
+
+            if self.config.norm == "burns":
+                if fitter is None:
+                    fitter = BurnsNormFitter(
+                        hiddens.shape[1:], device=x_neg.device, dtype=x_neg.dtype
+                    )
+                assert isinstance(fitter, BurnsNormFitter)
+                fitter.update(hiddens)
+                continue
+
+            if fitter is None:
+                fitter = LeaceFitter(d, 2 * v, dtype=x_neg.dtype, device=x_neg.device)
+            assert isinstance(fitter, LeaceFitter)
+
+            # One-hot indicators for each prompt template
+            prompt_ids = torch.eye(v, device=x_neg.device).expand(n, -1, -1)
+
             fitter.update(
                 x=x_neg,
                 # Independent indicator for each (template, pseudo-label) pair
@@ -221,89 +429,371 @@ class CcsReporter(nn.Module, PlattMixin):
                 # Independent indicator for each (template, pseudo-label) pair
                 z=torch.cat([prompt_ids, torch.zeros_like(prompt_ids)], dim=-1),
             )
+
+        assert fitter is not None, "No training data"
+        if isinstance(fitter, BurnsNormFitter):
+            self.norm = fitter.normalizer()
+        else:
             self.norm = fitter.eraser
 
-        x_neg, x_pos = self.norm(x_neg), self.norm(x_pos)
+    def load_best_restart(self, params: dict[str, Tensor], losses: Tensor) -> float:
+        """Copy the parameters of the restart with the lowest loss into the probe,
+        returning its loss."""
+        losses = losses.nan_to_num(torch.inf)
+        best = int(losses.argmin())
+        best_loss = float(losses[best])
+        if not math.isfinite(best_loss):
+            raise RuntimeError("Got NaN/infinite loss during training")
+
+        with torch.no_grad():
+            for name, param in self.probe.named_parameters():
+                param.copy_(params[name][best])
+
+        return best_loss
+
+    def init_restarts(
+        self, x_neg: Tensor, x_pos: Tensor, warm_start: "CcsReporter | None" = None
+    ) -> dict[str, Tensor]:
+        """Initialize the probe parameters of every restart.
 
-        # Record the best acc, loss, and params found so far
-        best_loss = torch.inf
-        best_state: dict[str, Tensor] = {}  # State dict of the best run
+        If `warm_start` is given, the first restart is initialized with its
+        parameters, mapped with `warm_start_params()`.
 
-        for i in range(self.config.num_tries):
+        Returns:
+            A dictionary mapping the name of each parameter of `self.probe` to a leaf
+            tensor of shape `[num_tries, *param.shape]`.
+        """
+        inits = []
+        for _ in range(self.config.num_tries):
             self.reset_parameters()
+            inits.append(
+                {k: p.detach().clone() for k, p in self.probe.named_parameters()}
+            )
 
-            # This is sort of inefficient but whatever
-            if self.config.init == "pca":
-                diffs = torch.flatten(x_pos - x_neg, 0, 1)
-                _, __, V = torch.pca_lowrank(diffs, q=i + 1)
-                self.probe[0].weight.data = V[:, -1, None].T
+        params = {k: torch.stack([init[k] for init in inits]) for k in inits[0]}
 
-            if self.config.optimizer == "lbfgs":
-                loss = self.train_loop_lbfgs(x_neg, x_pos)
-            elif self.config.optimizer == "adam":
-                loss = self.train_loop_adam(x_neg, x_pos)
-            else:
-                raise ValueError(f"Optimizer {self.config.optimizer} is not supported")
+        # Restart i is initialized with the i-th principal component of the differences
+        if self.config.init == "pca":
+            diffs = torch.flatten(x_pos - x_neg, 0, 1)
+            _, __, V = torch.pca_lowrank(diffs, q=self.config.num_tries)
+            params["0.weight"] = V.mT.unsqueeze(1).contiguous().to(params["0.weight"])
 
-            if loss < best_loss:
-                best_loss = loss
-                best_state = deepcopy(self.state_dict())
+        if warm_start is not None:
+            for k, p in self.warm_start_params(warm_start).items():
+                params[k][0] = p
 
-        if not math.isfinite(best_loss):
-            raise RuntimeError("Got NaN/infinite loss during training")
+        return {k: p.requires_grad_() for k, p in params.items()}
 
-        self.load_state_dict(best_state)
+    @torch.no_grad()
+    def warm_start_params(self, other: "CcsReporter") -> dict[str, Tensor]:
+        """Map the probe parameters of `other`, which was fit on different hidden
+        states of the same size, into the normalized coordinates of this reporter.
 
-        return best_loss
+        With LEACE normalization, both erasers are affine maps `x @ A + c`. The first
+        linear layer is changed so it computes the same function of the raw hidden
+        states as in `other`, up to the directions erased by this reporter. Other
+        normalizers and LayerNorm put the inputs on a similar scale, so the
+        parameters are copied as they are.
+        """
+        assert self.norm is not None and other.norm is not None, "Call fit_norm() first"
+        params = {k: p.detach().clone() for k, p in other.probe.named_parameters()}
+
+        burns = (BurnsNorm, FittedBurnsNorm)
+        if (
+            self.config.pre_ln
+            or isinstance(self.norm, burns)
+            or isinstance(other.norm, burns)
+        ):
+            return params
+
+        W = params["0.weight"]
+        eye = torch.eye(W.shape[-1], device=W.device, dtype=W.dtype)
+        c_old, c_new = other.norm(eye[0] * 0), self.norm(eye[0] * 0)
+        A_old = other.norm(eye) - c_old
+
+        # The first layer computes W @ (A_old.T @ x + c_old) + b
+        params["0.weight"] = W @ A_old.mT
+        if "0.bias" in params:
+            params["0.bias"] += W @ c_old - params["0.weight"] @ c_new
+
+        return params
+
+    def restart_losses(
+        self, params: dict[str, Tensor], x_neg: Tensor, x_pos: Tensor
+    ) -> Tensor:
+        """Return the unregularized loss of each restart, of shape `[num_tries]`."""
+
+        def loss(p: dict[str, Tensor]) -> Tensor:
+            logit0, logit1 = (
+                functional_call(self.probe, p, (x,))
+                .squeeze(-1)
+                .mul(self.scale)
+                .add(self.bias)
+                for x in (x_neg, x_pos)
+            )
+            return self.loss(logit0, logit1)
+
+        return vmap(loss)(params)
+
+    def compiled(self, fn: Callable[P, R]) -> Callable[P, R]:
+        """Return `fn` compiled with `torch.compile` if `compile` is set."""
+        return torch.compile(fn) if self.config.compile else fn
 
-    def train_loop_adam(self, x_neg: Tensor, x_pos: Tensor) -> float:
-        """Adam train loop, returning the final loss. Modifies params in-place."""
+    def train_loop_adam(
+        self,
+        params: dict[str, Tensor],
+        x_neg: Tensor,
+        x_pos: Tensor,
+        num_epochs: int | None = None,
+        state: dict[str, dict] | None = None,
+    ) -> Tensor:
+        """Adam train loop, returning the final loss of each restart. Modifies
+        `params` in-place.
+
+        Since Adam updates each parameter independently, this is equivalent to
+        training each restart on its own.
+
+        Args:
+            num_epochs: Number of epochs to train for. Defaults to `num_epochs` in
+                the config.
+            state: If given, the optimizer state of each parameter is loaded from
+                this dictionary, keyed by parameter name, and written back to it
+                after training, so that training can be resumed later.
+        """
 
         optimizer = torch.optim.AdamW(
-            self.parameters(), lr=self.config.lr, weight_decay=self.config.weight_decay
+            params.values(), lr=self.config.lr, weight_decay=self.config.weight_decay
         )
+        if state is not None:
+            for name, param in params.items():
+                optimizer.state[param].update(state.get(name, {}))
 
-        loss = torch.inf
-        for _ in range(self.config.num_epochs):
+        restart_losses = self.compiled(self.restart_losses)
+
+        losses = torch.full([len(next(iter(params.values())))], torch.inf)
+        for _ in range(num_epochs or self.config.num_epochs):
             optimizer.zero_grad()
 
             # We already normalized in fit()
-            loss = self.loss(self(x_neg), self(x_pos))
-            loss.backward()
+            losses = restart_losses(params, x_neg, x_pos)
+            losses.sum().backward()
             optimizer.step()
+            self.num_iters += 1
 
-        return float(loss)
+        if state is not None:
+            state.update({name: optimizer.state[p] for name, p in params.items()})
 
-    def train_loop_lbfgs(self, x_neg: Tensor, x_pos: Tensor) -> float:
-        """LBFGS train loop, returning the final loss. Modifies params in-place."""
+        return losses.detach()
 
-        optimizer = torch.optim.LBFGS(
-            self.parameters(),
-            line_search_fn="strong_wolfe",
-            max_iter=self.config.num_epochs,
-            tolerance_change=torch.finfo(x_pos.dtype).eps,
-            tolerance_grad=torch.finfo(x_pos.dtype).eps,
+    def train_loop_lbfgs(
+        self,
+        params: dict[str, Tensor],
+        x_neg: Tensor,
+        x_pos: Tensor,
+        num_epochs: int | None = None,
+    ) -> Tensor:
+        """LBFGS train loop, returning the final loss of each restart. Modifies
+        `params` in-place.
+
+        Each restart is minimized with its own curvature history and line search,
+        as if it were trained on its own, but the losses of all the restarts that
+        haven't converged yet are evaluated together.
+        """
+        # Flattened parameters of every restart, one row each
+        shapes = {name: param.shape[1:] for name, param in params.items()}
+        flat = torch.cat([param.detach().flatten(1) for param in params.values()], 1)
+
+        def unflatten(rows: Tensor) -> dict[str, Tensor]:
+            chunks = rows.split([shape.numel() for shape in shapes.values()], dim=1)
+            return {
+                name: chunk.view(-1, *shape)
+                for (name, shape), chunk in zip(shapes.items(), chunks)
+            }
+
+        restart_losses = self.compiled(self.restart_losses)
+
+        def objective(rows: Tensor, index: Tensor) -> Tensor:
+            # Every restart sees the same data, so only the parameters are indexed.
+            # We explicitly add L2 regularization to the loss, since LBFGS doesn't
+            # have a weight_decay parameter. We already normalized in fit().
+            losses = restart_losses(unflatten(rows), x_neg, x_pos)
+            return losses + self.config.weight_decay * rows.square().sum(-1) / 2
+
+        eps = torch.finfo(x_pos.dtype).eps
+        self.num_iters += _lbfgs_batch(
+            objective,
+            flat,
+            max_iter=num_epochs or self.config.num_epochs,
+            tolerance_grad=eps,
+            tolerance_change=eps,
         )
-        # Raw unsupervised loss, WITHOUT regularization
-        loss = torch.inf
+        with torch.no_grad():
+            for name, param in unflatten(flat).items():
+                params[name].copy_(param)
 
-        def closure():
-            nonlocal loss
-            optimizer.zero_grad()
+            # Raw unsupervised loss of each restart, WITHOUT regularization
+            return restart_losses(params, x_neg, x_pos)
 
-            # We already normalized in fit()
-            loss = self.loss(self(x_neg), self(x_pos))
-            regularizer = 0.0
+    def train_loop_newton(
+        self,
+        params: dict[str, Tensor],
+        x_neg: Tensor,
+        x_pos: Tensor,
+        num_epochs: int | None = None,
+    ) -> Tensor:
+        """Trust-region Newton train loop for linear probes, returning the final loss
+        of each restart. Modifies `params` in-place.
+
+        Each iteration approximately minimizes a quadratic model of the regularized
+        loss of every restart within its trust region, with the Steihaug conjugate
+        gradient method. Since the probe is linear, Hessian-vector products only
+        need two matrix multiplications with the hidden states, plus second
+        derivatives of the loss with respect to the logits. The restarts are solved
+        independently, but in parallel, and training stops once all of them have
+        converged or `num_epochs` iterations have been run.
+        """
+        # Everything before the linear layer is parameter-free, e.g. a LayerNorm
+        *prefix, linear = self.probe
+        x_neg, x_pos = nn.Sequential(*prefix)(x_neg), nn.Sequential(*prefix)(x_pos)
+        key = str(len(prefix))
+        d = x_neg.shape[-1]
+
+        # Parameters of each restart as a row vector [weight, bias]
+        theta = params[f"{key}.weight"].detach().flatten(1)
+        if linear.bias is not None:
+            theta = torch.cat([theta, params[f"{key}.bias"].detach()], 1)
+
+        def jvp(v: Tensor) -> tuple[Tensor, Tensor]:
+            """Change in the `[tries, n, v]` logits for a change `v` in theta."""
+            return tuple(
+                torch.einsum("nvd,td->tnv", x, v[:, :d])
+                .add(v[:, d:, None] if linear.bias is not None else 0.0)
+                .mul(self.scale)
+                for x in (x_neg, x_pos)
+            )
 
-            # We explicitly add L2 regularization to the loss, since LBFGS
-            # doesn't have a weight_decay parameter
-            for param in self.parameters():
-                regularizer += self.config.weight_decay * param.norm() ** 2 / 2
+        def vjp(h0: Tensor, h1: Tensor) -> Tensor:
+            """Gradient with respect to theta for gradients `h0, h1` of the logits."""
+            grad_w = torch.einsum("tnv,nvd->td", h0, x_neg)
+            grad_w += torch.einsum("tnv,nvd->td", h1, x_pos)
+            if linear.bias is not None:
+                grad_b = (h0 + h1).sum((1, 2))[:, None]
+                grad_w = torch.cat([grad_w, grad_b], 1)
+            return grad_w * self.scale.detach()
+
+        wd = self.config.weight_decay
+        eps = torch.finfo(theta.dtype).eps
+        radius = theta.new_ones(len(theta))
+        done = torch.zeros(len(theta), dtype=torch.bool, device=theta.device)
+
+        with torch.no_grad():
+            z0, z1 = (z + self.bias for z in jvp(theta))
+            losses = vmap(self.loss)(z0, z1)
+            f = losses + wd * theta.square().sum(-1) / 2
+
+        for _ in range(num_epochs or self.config.num_epochs):
+            z0, z1 = z0.requires_grad_(), z1.requires_grad_()
+            gz0, gz1 = torch.autograd.grad(
+                vmap(self.loss)(z0, z1).sum(), (z0, z1), create_graph=True
+            )
+            g = vjp(gz0.detach(), gz1.detach()) + wd * theta
 
-            regularized = loss + regularizer
-            regularized.backward()
+            done |= g.norm(dim=-1) <= eps ** (2 / 3) * f.clamp_min(1)
+            if done.all():
+                break
 
-            return float(regularized)
+            self.num_iters += 1
 
-        optimizer.step(closure)
-        return float(loss)
+            def hvp(v: Tensor) -> Tensor:
+                h0, h1 = torch.autograd.grad(
+                    (gz0, gz1), (z0, z1), jvp(v), retain_graph=True
+                )
+                return vjp(h0, h1) + wd * v
+
+            step = _steihaug_cg(hvp, g, radius, max_iter=theta.shape[1])
+            step[done] = 0.0
+            predicted = -(g * step).sum(-1) - (step * hvp(step)).sum(-1) / 2
+
+            with torch.no_grad():
+                new_theta = theta + step
+                z0_new, z1_new = (z + self.bias for z in jvp(new_theta))
+                losses_new = vmap(self.loss)(z0_new, z1_new)
+                f_new = losses_new + wd * new_theta.square().sum(-1) / 2
+
+            # Standard trust region update (Nocedal & Wright, Algorithm 4.1)
+            actual = f - f_new
+            rho = actual / predicted.clamp_min(torch.finfo(theta.dtype).tiny)
+            at_boundary = step.norm(dim=-1) >= 0.99 * radius
+            radius = torch.where(rho < 0.25, radius / 4, radius)
+            radius = torch.where((rho > 0.75) & at_boundary, radius * 2, radius)
+
+            # Also stop once accepted steps no longer decrease the loss measurably,
+            # or the trust region is too small to change the parameters
+            accept = (rho > 0.1) & ~done
+            done |= accept & (actual.abs() <= eps * f.abs())
+            done |= radius <= eps * theta.norm(dim=-1)
+
+            theta = torch.where(accept[:, None], new_theta, theta)
+            f = torch.where(accept, f_new, f)
+            losses = torch.where(accept, losses_new, losses)
+            z0 = torch.where(accept[:, None, None], z0_new, z0.detach())
+            z1 = torch.where(accept[:, None, None], z1_new, z1.detach())
+
+        with torch.no_grad():
+            weight = params[f"{key}.weight"]
+            weight.copy_(theta[:, :d].reshape_as(weight))
+            if linear.bias is not None:
+                params[f"{key}.bias"].copy_(theta[:, d:])
+
+        return losses
+
+
+def _steihaug_cg(
+    hvp: Callable[[Tensor], Tensor], g: Tensor, radius: Tensor, max_iter: int
+) -> Tensor:
+    """Approximately minimize `g @ p + p @ H @ p / 2` subject to `||p|| <= radius` for
+    each row of `g`, where `H` is block diagonal with one block per row and is only
+    accessed through the Hessian-vector product `hvp`.
+
+    Args:
+        hvp: Function computing `H @ v` for each row of `v`.
+        g: Gradients of shape `[batch, dim]`.
+        radius: Trust region radius of each row, of shape `[batch]`.
+        max_iter: Maximum number of conjugate gradient iterations.
+
+    Returns:
+        The step for each row, of shape `[batch, dim]`.
+    """
+    p = torch.zeros_like(g)
+    r = g.clone()
+    d = -r
+    rr = (r * r).sum(-1)
+    tol = torch.minimum(rr.sqrt(), rr.new_tensor(0.5)) * rr.sqrt()
+    done = rr.sqrt() <= torch.finfo(g.dtype).eps
+
+    for _ in range(max_iter):
+        Hd = hvp(d)
+        dHd = (d * Hd).sum(-1)
+        alpha = rr / dHd
+        p_next = p + alpha[:, None] * d
+
+        # Follow d to the boundary on negative curvature or when leaving the region
+        hit = (dHd <= 0) | (p_next.norm(dim=-1) >= radius)
+        pd, dd, pp = (p * d).sum(-1), (d * d).sum(-1), (p * p).sum(-1)
+        tau = (-pd + (pd**2 + dd * (radius**2 - pp)).sqrt()) / dd
+
+        p_next = torch.where(hit[:, None], p + tau[:, None] * d, p_next)
+        p = torch.where(done[:, None], p, p_next)
+        done |= hit
+
+        r = r + alpha[:, None] * Hd
+        rr_next = (r * r).sum(-1)
+        done |= rr_next.sqrt() <= tol
+        if done.all():
+            break
+
+        # Rows which are done shouldn't produce NaNs in later iterations
+        d = torch.where(done[:, None], 0.0, -r + (rr_next / rr)[:, None] * d)
+        rr = rr_next
+
+    return p
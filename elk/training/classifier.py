@@ -1,4 +1,7 @@
+from copy import deepcopy
 from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Literal
 
 import torch
 from torch import Tensor
@@ -54,8 +57,27 @@ class Classifier(torch.nn.Module):
         self.linear.bias.data.zero_()
         self.linear.weight.data.zero_()
 
+        self.num_iters = 0
+        """The number of optimizer iterations used by the last call to `fit()`, or
+        by all the fits in the last call to `fit_cv()`."""
+
+        self.erased: Tensor | None = None
+        """Orthonormal basis of shape (D, R) for directions the classifier ignores,
+        as if the inputs were projected onto their orthogonal complement. Used by
+        `inlp()` to avoid projecting the data itself."""
+
     def forward(self, x: Tensor) -> Tensor:
-        return self.linear(x).squeeze(-1)
+        return torch.nn.functional.linear(
+            x, self.effective_weight(), self.linear.bias
+        ).squeeze(-1)
+
+    def effective_weight(self) -> Tensor:
+        """The weight of the linear layer, with the `erased` directions removed."""
+        weight = self.linear.weight
+        if self.erased is None:
+            return weight
+
+        return weight - (weight @ self.erased) @ self.erased.mT
 
     @torch.enable_grad()
     def fit(
@@ -65,8 +87,18 @@ class Classifier(torch.nn.Module):
         *,
         l2_penalty: float = 0.0,
         max_iter: int = 10_000,
+        solver: Literal["lbfgs", "irls"] = "lbfgs",
     ) -> float:
-        """Fits the model to the input data using L-BFGS with L2 regularization.
+        """Fits the model to the input data with L2 regularization.
+
+        Optimization starts from the current parameters, so the model can be warm
+        started by loading the parameters of a related solution first.
+
+        The "irls" solver is Newton's method, a.k.a. iteratively reweighted least
+        squares, which usually converges in about 10 iterations. Each iteration
+        solves a `(D + 1) x (D + 1)` linear system, or an `N x N` one in the dual
+        when there are fewer samples than dimensions and `l2_penalty` is positive.
+        It only supports binary classification.
 
         Args:
             x: Input tensor of shape (N, D), where N is the number of samples and D is
@@ -74,11 +106,17 @@ class Classifier(torch.nn.Module):
             y: Target tensor of shape (N,) for binary classification or (N, C) for
                 multiclass classification, where C is the number of classes.
             l2_penalty: L2 regularization strength.
-            max_iter: Maximum number of iterations for the L-BFGS optimizer.
+            max_iter: Maximum number of iterations for the optimizer.
+            solver: Which optimizer to use, "lbfgs" or "irls".
 
         Returns:
             Final value of the loss function after optimization.
         """
+        if solver == "irls":
+            return self.fit_irls(x, y, l2_penalty=l2_penalty, max_iter=max_iter)
+        elif solver != "lbfgs":
+            raise ValueError(f"Unknown solver: {solver}")
+
         optimizer = torch.optim.LBFGS(
             self.parameters(),
             line_search_fn="strong_wolfe",
@@ -108,6 +146,74 @@ class Classifier(torch.nn.Module):
             return float(reg_loss)
 
         optimizer.step(closure)
+        self.num_iters = optimizer.state[self.linear.weight]["n_iter"]
+        return float(loss)
+
+    @torch.no_grad()
+    def fit_irls(
+        self, x: Tensor, y: Tensor, *, l2_penalty: float = 0.0, max_iter: int = 100
+    ) -> float:
+        """Fits a binary classifier with Newton's method and a backtracking line
+        search. See `fit()` for the arguments."""
+        if self.linear.out_features != 1:
+            raise ValueError("The IRLS solver only supports binary classification")
+
+        n = len(x)
+        y = y.to(x.dtype)
+        w, b = self.effective_weight()[0].clone(), self.linear.bias[0].clone()
+        eps = torch.finfo(x.dtype).eps
+
+        def objective(w: Tensor, b: Tensor) -> tuple[Tensor, Tensor, Tensor]:
+            logits = x @ w + b
+            loss = bce_with_logits(logits, y)
+            return loss, loss + l2_penalty * w.square().sum(), logits
+
+        loss, f, logits = objective(w, b)
+        self.num_iters = 0
+
+        for _ in range(max_iter):
+            p = logits.sigmoid()
+            r = (p - y) / n
+            grad_w = x.mT @ r
+            if self.erased is not None:
+                grad_w -= self.erased @ (self.erased.mT @ grad_w)
+
+            grad_w += 2 * l2_penalty * w
+            grad_b = r.sum()
+
+            step_w, step_b = _newton_step(
+                x, p * (1 - p) / n, grad_w, grad_b, l2_penalty, self.erased
+            )
+
+            # Stop once the gradient or the Newton decrement is negligible. The
+            # gradient tolerance also stops fits to separable data, which have no
+            # finite minimum, once the loss is close to its limit.
+            decrement = -(grad_w @ step_w + grad_b * step_b)
+            max_grad = torch.maximum(grad_w.abs().max(), grad_b.abs())
+            if max_grad <= eps**0.5 or decrement / 2 <= eps * f.clamp_min(1):
+                break
+
+            # Halve the step until it decreases the objective enough (Armijo)
+            t = 1.0
+            new_loss, new_f, new_logits = objective(w + step_w, b + step_b)
+            while new_f > f - t * decrement / 4 and t > eps:
+                t /= 2
+                new_loss, new_f, new_logits = objective(w + t * step_w, b + t * step_b)
+
+            if t <= eps:
+                break
+
+            # Also stop once the objective no longer decreases measurably
+            converged = f - new_f <= eps * f.clamp_min(1)
+
+            w, b = w + t * step_w, b + t * step_b
+            loss, f, logits = new_loss, new_f, new_logits
+            self.num_iters += 1
+            if converged:
+                break
+
+        self.linear.weight[0] = w
+        self.linear.bias[0] = b
         return float(loss)
 
     @torch.no_grad()
@@ -120,6 +226,7 @@ class Classifier(torch.nn.Module):
         max_iter: int = 10_000,
         num_penalties: int = 10,
         seed: int = 42,
+        solver: Literal["lbfgs", "irls"] = "lbfgs",
     ) -> RegularizationPath:
         """Fit using k-fold cross-validation to select the best L2 penalty.
 
@@ -129,9 +236,11 @@ class Classifier(torch.nn.Module):
             y: Target tensor of shape (N,) for binary classification or (N, C) for
                 multiclass classification, where C is the number of classes.
             k: Number of folds for k-fold cross-validation.
-            max_iter: Maximum number of iterations for the L-BFGS optimizer.
+            max_iter: Maximum number of iterations for the optimizer.
             num_penalties: Number of L2 regularization penalties to try.
             seed: Random seed for the k-fold cross-validation.
+            solver: Which optimizer to use. Either way, the models of all the folds
+                are fit together as one batch.
 
         Returns:
             `RegularizationPath` containing the penalties tried and the validation loss
@@ -149,43 +258,137 @@ class Classifier(torch.nn.Module):
         fold_size = num_samples // k
         indices = torch.randperm(num_samples, device=x.device, generator=rng)
 
+        # Fold of each sample. Leftover samples are never used for validation.
+        fold_ids = torch.full_like(indices, -1)
+        fold_ids[indices[: k * fold_size]] = torch.arange(
+            k * fold_size, device=x.device
+        ).div(fold_size, rounding_mode="floor")
+        val_masks = fold_ids == torch.arange(k, device=x.device)[:, None]
+
         # Try a range of L2 penalties, including 0
         l2_penalties = [0.0] + torch.logspace(-4, 4, num_penalties).tolist()
 
         num_classes = self.linear.out_features
-        loss_fn = bce_with_logits if num_classes == 1 else cross_entropy
-        losses = x.new_zeros((k, num_penalties + 1))
         y = y.to(
             torch.get_default_dtype() if num_classes == 1 else torch.long,
         )
 
-        for i in range(k):
-            start, end = i * fold_size, (i + 1) * fold_size
-            train_indices = torch.cat([indices[:start], indices[end:]])
-            val_indices = indices[start:end]
-
-            train_x, train_y = x[train_indices], y[train_indices]
-            val_x, val_y = x[val_indices], y[val_indices]
-
-            # Regularization path with warm-starting
-            for j, l2_penalty in enumerate(l2_penalties):
-                self.fit(train_x, train_y, l2_penalty=l2_penalty, max_iter=max_iter)
+        # Regularization path from the strongest penalty to the weakest, fitting the
+        # models of all the folds at once and warm starting from the previous penalty
+        weight = self.linear.weight.detach().expand(k, -1, -1).clone()
+        bias = self.linear.bias.detach().expand(k, -1).clone()
+        losses = x.new_zeros((k, num_penalties + 1))
 
-                logits = self(val_x).squeeze(-1)
-                loss = loss_fn(logits, val_y)
-                losses[i, j] = loss
+        if solver == "lbfgs":
+            fit_batch = _fit_batch
+        elif solver == "irls":
+            if num_classes != 1:
+                raise ValueError("The IRLS solver only supports binary classification")
+
+            fit_batch = partial(_irls_batch, erased=self.erased)
+        else:
+            raise ValueError(f"Unknown solver: {solver}")
+
+        num_iters = 0
+        for j in reversed(range(len(l2_penalties))):
+            num_iters += fit_batch(
+                x,
+                y,
+                weight,
+                bias,
+                sample_weights=(~val_masks).to(x.dtype),
+                l2_penalty=l2_penalties[j],
+                max_iter=max_iter,
+            )
+
+            # Mean loss of each model on its held-out fold
+            logits = torch.einsum("nd,bcd->bnc", x, weight) + bias[:, None]
+            val_losses = _sample_losses(logits, y) * val_masks
+            losses[:, j] = val_losses.sum(-1) / fold_size
 
         mean_losses = losses.mean(dim=0)
         best_idx = mean_losses.argmin()
 
         # Refit with the best penalty
         best_penalty = l2_penalties[best_idx]
-        self.fit(x, y, l2_penalty=best_penalty, max_iter=max_iter)
+        self.fit(x, y, l2_penalty=best_penalty, max_iter=max_iter, solver=solver)
+        self.num_iters += num_iters
         return RegularizationPath(l2_penalties, mean_losses.tolist())
 
+    @classmethod
+    def fit_stacked(
+        cls,
+        x: Tensor,
+        y: Tensor,
+        *,
+        l2_penalty: float = 0.0,
+        max_iter: int = 10_000,
+    ) -> list["Classifier"]:
+        """Fit an independent classifier to each of a stack of inputs with the same
+        targets, such as the hidden states of every layer, as one batched L-BFGS
+        optimization. Each classifier converges to the same solution as `fit()`.
+
+        Args:
+            x: Input tensor of shape (B, N, D), where B is the number of classifiers,
+                N is the number of samples and D is the input dimension.
+            y: Target tensor of shape (N,) for binary classification or (N, C) for
+                multiclass classification, where C is the number of classes.
+            l2_penalty: L2 regularization strength.
+            max_iter: Maximum number of iterations for the optimizer.
+
+        Returns:
+            The B classifiers. Their `num_iters` is the number of iterations until
+            all of them converged.
+        """
+        (b, _, d) = x.shape
+        template = cls(d, device=x.device, dtype=x.dtype)
+
+        num_classes = template.linear.out_features
+        y = y.to(
+            torch.get_default_dtype() if num_classes == 1 else torch.long,
+        )
+
+        # Flattened weights and biases of every classifier, one row each
+        params = torch.cat(
+            [template.linear.weight.detach().flatten(), template.linear.bias.detach()]
+        ).repeat(b, 1)
+        num_weights = num_classes * d
+
+        def objective(params: Tensor, index: Tensor) -> Tensor:
+            weight = params[:, :num_weights].view(-1, num_classes, d)
+            if len(index) == b:
+                logits = x @ weight.mT
+            else:
+                # Multiply each classifier by its own inputs, rather than copying the
+                # inputs of the subset, so the finished classifiers cost nothing
+                logits = torch.stack(
+                    [x[i] @ w.mT for i, w in zip(index.tolist(), weight)]
+                )
+
+            logits = logits + params[:, None, num_weights:]
+            loss = _sample_losses(logits, y).mean(-1)
+            return loss + l2_penalty * weight.square().sum((1, 2))
+
+        num_iters = _lbfgs_batch(objective, params, max_iter=max_iter)
+
+        classifiers = []
+        for row in params:
+            clf = deepcopy(template)
+            clf.linear.weight.data = row[:num_weights].view(num_classes, d).clone()
+            clf.linear.bias.data = row[num_weights:].clone()
+            clf.num_iters = num_iters
+            classifiers.append(clf)
+
+        return classifiers
+
     @classmethod
     def inlp(
-        cls, x: Tensor, y: Tensor, max_iter: int | None = None, tol: float = 0.01
+        cls,
+        x: Tensor,
+        y: Tensor,
+        max_iter: int | None = None,
+        tol: float = 0.01,
+        solver: Literal["lbfgs", "irls"] = "lbfgs",
     ) -> InlpResult:
         """Iterative Nullspace Projection (INLP) <https://arxiv.org/abs/2004.07667>.
 
@@ -198,36 +401,60 @@ class Classifier(torch.nn.Module):
                 dimension of the input.
             tol: Tolerance for the loss function. The algorithm will stop when the loss
                 is within `tol` of the entropy of the labels.
+            solver: Which optimizer to fit each classifier with; see `fit()`.
 
         Returns:
             `InlpResult` containing the classifiers and losses achieved at each
             iteration.
         """
 
-        y.shape[-1] if y.ndim > 1 else 2
         d = x.shape[-1]
-        loss = 0.0
+        num_iters = d if max_iter is None else min(d, max_iter)
 
         # Compute entropy of the labels
         p = y.float().mean()
         H = -p * torch.log(p) - (1 - p) * torch.log(1 - p)
 
-        if max_iter is not None:
-            d = min(d, max_iter)
+        # Orthonormal basis for the directions removed so far. Instead of projecting
+        # the data onto their nullspace, each classifier ignores them in its forward
+        # pass, which is equivalent since the projection is orthogonal.
+        erased = x.new_zeros(d, 0)
 
         # Iterate until the loss is within epsilon of the entropy
         result = InlpResult()
-        for _ in range(d):
+        for _ in range(num_iters):
             clf = cls(d, device=x.device, dtype=x.dtype)
-            loss = clf.fit(x, y)
+            clf.erased = erased
+
+            # The previous weights are erased, so the best warm start is the optimum
+            # with zero weights, where the logits are the log odds of the labels
+            clf.linear.bias.data.fill_(float(torch.logit(p)))
+
+            loss = clf.fit(x, y, solver=solver)
+
+            # Bake the projection into the weights, so the classifier can be used on
+            # the original data like the ones returned by `fit()`
+            clf.linear.weight.data = clf.effective_weight().detach()
+            clf.erased = None
+
             result.classifiers.append(clf)
             result.losses.append(loss)
 
             if loss >= (1.0 - tol) * H:
                 break
 
-            # Project the data onto the nullspace of the classifier
-            x = clf.nullspace_project(x)
+            # Extend the basis with the new directions, orthogonalizing twice for
+            # numerical stability (classical Gram-Schmidt with reorthogonalization)
+            new = clf.linear.weight.data.mT
+            for _ in range(2):
+                new = new - erased @ (erased.mT @ new)
+
+            Q, R = torch.linalg.qr(new)
+            Q = Q[:, R.diagonal().abs() > torch.finfo(x.dtype).eps * new.norm()]
+            if not Q.shape[1]:
+                break
+
+            erased = torch.cat([erased, Q], dim=1)
 
         return result
 
@@ -238,3 +465,466 @@ class Classifier(torch.nn.Module):
         A = self.linear.weight.data.T
         P = A @ torch.linalg.solve(A.mT @ A, A.mT)
         return x - x @ P
+
+
+class RidgeFitter:
+    """Streaming closed-form linear classifier, from ridge regression of binary
+    labels on the inputs.
+
+    Only the mean of each class and the within-class co-moment matrix are
+    accumulated, with the parallel update of Chan et al., so the inputs can be passed
+    in chunks of any size and the full design matrix never has to exist. Since the
+    statistics are centered, large offsets in the inputs don't cause catastrophic
+    cancellation. The ridge solution is proportional to the direction found by linear
+    discriminant analysis (LDA), and it's turned into logits with the logistic model
+    implied by LDA, as in `PlattMixin.platt_scale_gaussian`.
+
+    Args:
+        input_dim: The input dimension.
+    """
+
+    def __init__(
+        self,
+        input_dim: int,
+        *,
+        device: str | torch.device | None = None,
+        dtype: torch.dtype | None = None,
+    ):
+        self.input_dim = input_dim
+        self.counts = torch.zeros(2, device=device, dtype=torch.long)
+        self.means = torch.zeros(2, input_dim, device=device, dtype=dtype)
+        self.M2 = torch.zeros(input_dim, input_dim, device=device, dtype=dtype)
+        """Sum of the outer products of the deviations from each class mean."""
+
+    @torch.no_grad()
+    def update(self, x: Tensor, y: Tensor) -> None:
+        """Update the statistics with inputs `x` of shape (N, D) and binary labels `y`
+        of shape (N,)."""
+        x = x.to(self.M2.dtype)
+        y = y.bool()
+
+        for c, x_c in enumerate((x[~y], x[y])):
+            n_c = len(x_c)
+            if not n_c:
+                continue
+
+            mean = x_c.mean(0)
+            delta = mean - self.means[c]
+            total = int(self.counts[c]) + n_c
+
+            # Co-moment of the batch around its own mean, plus the correction for
+            # the difference between the batch mean and the running mean
+            centered = x_c - mean
+            self.M2.addmm_(centered.mT, centered)
+            self.M2.add_(delta.outer(delta), alpha=int(self.counts[c]) * n_c / total)
+
+            self.means[c] += delta * n_c / total
+            self.counts[c] = total
+
+    @torch.no_grad()
+    def fit(self, l2_penalty: float = 1e-3) -> Classifier:
+        """Solve for the classifier from the statistics seen so far.
+
+        Args:
+            l2_penalty: Ridge penalty, relative to the mean eigenvalue of the
+                covariance matrix of the inputs.
+        """
+        if (self.counts == 0).any():
+            raise ValueError("RidgeFitter needs examples of both classes")
+
+        n = self.counts.sum()
+        prior = self.counts[1] / n
+        diff = self.means[1] - self.means[0]
+
+        # Total covariance is the within-class covariance plus the between-class part
+        within = self.M2 / n
+        cov = within + prior * (1 - prior) * diff.outer(diff)
+
+        # Ridge regression of the centered labels on the centered inputs
+        cov.diagonal().add_(l2_penalty * cov.trace() / self.input_dim)
+        direction = torch.linalg.solve(cov, prior * (1 - prior) * diff)
+
+        # Logistic model implied by class-conditional Gaussians with shared variance
+        scores = self.means @ direction
+        variance = (direction @ within @ direction).clamp_min(
+            torch.finfo(cov.dtype).eps
+        )
+        scale = (scores[1] - scores[0]) / variance
+
+        classifier = Classifier(
+            self.input_dim, device=self.M2.device, dtype=self.M2.dtype
+        )
+        classifier.linear.weight.data[0] = scale * direction
+        classifier.linear.bias.data[0] = torch.logit(prior) - scale * scores.mean()
+        return classifier
+
+
+def _newton_step(
+    x: Tensor,
+    s: Tensor,
+    grad_w: Tensor,
+    grad_b: Tensor,
+    l2_penalty: float,
+    erased: Tensor | None = None,
+) -> tuple[Tensor, Tensor]:
+    """Newton step for L2-regularized logistic regression with an unpenalized bias,
+    where `s` are the per-sample curvatures, i.e. the Hessian is `X^T diag(s) X` plus
+    the penalty for the inputs `X = [x, 1]`.
+
+    `s`, `grad_w` and `grad_b` may have the same leading batch dimensions, one per
+    model fit to the same inputs, in which case a step is solved for each model.
+
+    When there are fewer samples than dimensions, the system is solved in the dual,
+    with an N x N Cholesky factorization, using the Woodbury identity for the weights
+    and the Schur complement for the bias.
+
+    If `erased` is an orthonormal basis of directions to ignore, the inputs are
+    treated as projected onto its orthogonal complement, and the step is orthogonal
+    to it as long as `grad_w` is.
+    """
+    n, d = x.shape
+    lam = 2 * l2_penalty
+
+    if n < d and lam > 0 and erased is None:
+        a = s.sqrt()
+        A = a[..., None] * x
+        K = torch.eye(n, device=x.device, dtype=x.dtype) + A @ A.mT / lam
+        L = torch.linalg.cholesky(K)
+
+        def solve_M(v: Tensor) -> Tensor:
+            """Solve `(A^T A + lam * I) u = v` with the Woodbury identity."""
+            Kinv_Av = torch.cholesky_solve(A @ v[..., None], L)
+            return (v - (A.mT @ Kinv_Av)[..., 0] / lam) / lam
+
+        Kinv_a = torch.cholesky_solve(a[..., None], L)[..., 0]
+        A_Minv_g = (A @ solve_M(grad_w)[..., None])[..., 0]
+        step_b = (-grad_b + (a * A_Minv_g).sum(-1)) / (a * Kinv_a).sum(-1).clamp_min(
+            torch.finfo(x.dtype).tiny
+        )
+        step_w = -solve_M(grad_w + (A.mT @ a[..., None])[..., 0] * step_b[..., None])
+        return step_w, step_b
+
+    H = x.new_empty(*s.shape[:-1], d + 1, d + 1)
+    xs = s[..., None, :] * x.mT
+    H[..., :d, :d] = xs @ x
+    H[..., :d, d] = H[..., d, :d] = xs.sum(-1)
+    H[..., d, d] = s.sum(-1)
+    if erased is not None:
+        # Project the weight rows and columns: P @ H @ P for P = I - Q @ Q^T
+        H[..., :, :d] -= (H[..., :, :d] @ erased) @ erased.mT
+        H[..., :d, :] -= erased @ (erased.mT @ H[..., :d, :])
+
+    diagonal = H.diagonal(dim1=-2, dim2=-1)
+    diagonal[..., :d] += lam
+    g = torch.cat([grad_w, grad_b[..., None]], dim=-1)
+
+    # Without a penalty the Hessian can be singular or nearly so, e.g. for separable
+    # or projected data, so damp it slightly. This only slows convergence along
+    # directions where the curvature is negligible anyway.
+    diagonal += torch.finfo(x.dtype).eps ** 0.5 * diagonal.mean(-1, keepdim=True)
+    L = torch.linalg.cholesky(H)
+
+    step = -torch.cholesky_solve(g[..., None], L)[..., 0]
+    return step[..., :d], step[..., d]
+
+
+def _sample_losses(logits: Tensor, y: Tensor) -> Tensor:
+    """Loss of each sample for a batch of models, given `[batch, N, C]` logits,
+    where `C` is 1 for binary classification."""
+    if logits.shape[-1] == 1:
+        target = y.expand_as(logits.squeeze(-1))
+        return bce_with_logits(logits.squeeze(-1), target, reduction="none")
+
+    losses = cross_entropy(
+        logits.flatten(0, 1), y.repeat(len(logits)), reduction="none"
+    )
+    return losses.view(logits.shape[:-1])
+
+
+def _fit_batch(
+    x: Tensor,
+    y: Tensor,
+    weight: Tensor,
+    bias: Tensor,
+    *,
+    sample_weights: Tensor,
+    l2_penalty: float,
+    max_iter: int,
+) -> int:
+    """Fit a batch of independent linear classifiers with L-BFGS, each on its own
+    weighting of the same samples, such as the training set of a fold.
+
+    Each model keeps its own L-BFGS state in `_lbfgs_batch()`, so models that are
+    slow to converge, e.g. on separable data, don't hold back the others. The logits
+    of all the unconverged models are computed with a single matrix multiplication.
+
+    Args:
+        x: Input tensor of shape (N, D).
+        y: Float targets of shape (N,) for binary classification, or class indices.
+        weight: Initial weights of shape (B, C, D), which are updated in place.
+        bias: Initial biases of shape (B, C), which are updated in place.
+        sample_weights: Weight of each sample for each model, of shape (B, N).
+        l2_penalty: L2 regularization strength.
+        max_iter: Maximum number of L-BFGS iterations.
+
+    Returns:
+        The number of L-BFGS iterations until every model converged.
+    """
+    (_, c, d) = weight.shape
+    sample_weights = sample_weights / sample_weights.sum(-1, keepdim=True)
+
+    # Flattened weights and biases of every model, one row each
+    params = torch.cat([weight.flatten(1), bias], dim=1)
+
+    def objective(params: Tensor, index: Tensor) -> Tensor:
+        w = params[:, : c * d].view(-1, c, d)
+        logits = torch.einsum("nd,bcd->bnc", x, w) + params[:, None, c * d :]
+        losses = (_sample_losses(logits, y) * sample_weights[index]).sum(-1)
+        return losses + l2_penalty * w.square().sum((1, 2))
+
+    num_iters = _lbfgs_batch(objective, params, max_iter=max_iter)
+    weight.copy_(params[:, : c * d].view_as(weight))
+    bias.copy_(params[:, c * d :])
+    return num_iters
+
+
+@torch.no_grad()
+def _irls_batch(
+    x: Tensor,
+    y: Tensor,
+    weight: Tensor,
+    bias: Tensor,
+    *,
+    sample_weights: Tensor,
+    l2_penalty: float,
+    max_iter: int,
+    erased: Tensor | None = None,
+) -> int:
+    """Fit a batch of independent binary classifiers with Newton's method, each on
+    its own weighting of the same samples, such as the training set of a fold.
+
+    This is `Classifier.fit_irls()` for a batch of models. The Newton steps of all
+    the unconverged models are solved together, while each model has its own
+    backtracking line search and stopping criteria.
+
+    Args:
+        x: Input tensor of shape (N, D).
+        y: Float targets of shape (N,).
+        weight: Initial weights of shape (B, 1, D), which are updated in place.
+        bias: Initial biases of shape (B, 1), which are updated in place.
+        sample_weights: Weight of each sample for each model, of shape (B, N).
+        l2_penalty: L2 regularization strength.
+        max_iter: Maximum number of Newton iterations.
+        erased: Orthonormal basis of shape (D, R) for directions to ignore, as in
+            `Classifier.erased`.
+
+    Returns:
+        The number of Newton iterations until every model converged.
+    """
+    sample_weights = sample_weights / sample_weights.sum(-1, keepdim=True)
+    eps = torch.finfo(x.dtype).eps
+    w, b = weight[:, 0], bias[:, 0]
+    if erased is not None:
+        w -= (w @ erased) @ erased.mT
+
+    def objective(w: Tensor, b: Tensor, index: Tensor) -> tuple[Tensor, Tensor]:
+        logits = w @ x.mT + b[:, None]
+        losses = bce_with_logits(logits, y.expand_as(logits), reduction="none")
+        f = (losses * sample_weights[index]).sum(-1) + l2_penalty * w.square().sum(-1)
+        return f, logits
+
+    # Models that haven't converged yet, with their objectives and logits
+    active = torch.arange(len(w), device=w.device)
+    f, logits = objective(w, b, active)
+    num_iters = 0
+
+    for _ in range(max_iter):
+        if not len(active):
+            break
+
+        w_a, b_a, s_a = w[active], b[active], sample_weights[active]
+        p = logits.sigmoid()
+        r = (p - y) * s_a
+        grad_w = r @ x
+        if erased is not None:
+            grad_w -= (grad_w @ erased) @ erased.mT
+
+        grad_w += 2 * l2_penalty * w_a
+        grad_b = r.sum(-1)
+
+        step_w, step_b = _newton_step(
+            x, p * (1 - p) * s_a, grad_w, grad_b, l2_penalty, erased
+        )
+
+        # Stopping criteria of `fit_irls()`, for each model
+        decrement = -((grad_w * step_w).sum(-1) + grad_b * step_b)
+        max_grad = torch.maximum(grad_w.abs().amax(-1), grad_b.abs())
+        stop = (max_grad <= eps**0.5) | (decrement / 2 <= eps * f.clamp_min(1))
+
+        # Halve the step of each model until it decreases its objective enough
+        t = torch.ones_like(f)
+        new_f, new_logits = objective(w_a + step_w, b_a + step_b, active)
+        searching = ~stop & (new_f > f - t * decrement / 4)
+        while searching.any():
+            t = torch.where(searching, t / 2, t)
+            (idx,) = searching.nonzero(as_tuple=True)
+            new_f[idx], new_logits[idx] = objective(
+                w_a[idx] + t[idx, None] * step_w[idx],
+                b_a[idx] + t[idx] * step_b[idx],
+                active[idx],
+            )
+            searching &= (new_f > f - t * decrement / 4) & (t > eps)
+
+        stop |= t <= eps
+        if stop.all():
+            break
+
+        # Also stop once the objective no longer decreases measurably
+        converged = f - new_f <= eps * f.clamp_min(1)
+
+        step = ~stop
+        w[active[step]] = w_a[step] + t[step, None] * step_w[step]
+        b[active[step]] = b_a[step] + t[step] * step_b[step]
+        num_iters += 1
+
+        keep = step & ~converged
+        active, f, logits = active[keep], new_f[keep], new_logits[keep]
+
+    return num_iters
+
+
+@torch.no_grad()
+def _lbfgs_batch(
+    objective: Callable[[Tensor, Tensor], Tensor],
+    params: Tensor,
+    *,
+    max_iter: int,
+    history_size: int = 100,
+    max_ls: int = 25,
+    tolerance_grad: float = 1e-7,
+    tolerance_change: float = 1e-9,
+) -> int:
+    """Minimize a batch of independent objectives with L-BFGS.
+
+    Unlike minimizing their sum with `torch.optim.LBFGS`, each problem keeps its own
+    curvature history and its own step size, found with a line search for the weak
+    Wolfe conditions, so the problems converge as fast as they would one at a time.
+    Each step of the line search evaluates the objectives of all the problems that
+    are still searching together.
+
+    Args:
+        objective: Function mapping the parameters of a subset of the problems, of
+            shape (M, P), and their indices, of shape (M,), to their objective values.
+        params: Initial parameters of shape (B, P), which are updated in place.
+        max_iter: Maximum number of iterations.
+        history_size: Number of curvature pairs to remember for each problem.
+        max_ls: Maximum number of objective evaluations per line search.
+        tolerance_grad: Stop a problem once its largest gradient entry is this small.
+        tolerance_change: Stop a problem once its step or change in objective value
+            is this small.
+
+    Returns:
+        The number of iterations until every problem converged.
+    """
+
+    def value_and_grad(x: Tensor, index: Tensor) -> tuple[Tensor, Tensor]:
+        with torch.enable_grad():
+            x = x.detach().requires_grad_()
+            f = objective(x, index)
+            (grad,) = torch.autograd.grad(f.sum(), x)
+
+        return f.detach(), grad
+
+    f, grad = value_and_grad(params, torch.arange(len(params), device=params.device))
+    done = grad.abs().amax(-1) <= tolerance_grad
+    eps = torch.finfo(params.dtype).eps
+    s_hist: list[Tensor] = []
+    y_hist: list[Tensor] = []
+    rho_hist: list[Tensor] = []
+
+    # Like torch.optim.LBFGS, scale the first step by the gradient
+    gamma = (1 / grad.abs().sum(-1)).clamp_max(1)
+
+    n_iter = 0
+    while n_iter < max_iter and not done.all():
+        n_iter += 1
+
+        # Two-loop recursion for the quasi-Newton direction of every problem
+        q = -grad
+        alphas = []
+        for s, y, rho in zip(reversed(s_hist), reversed(y_hist), reversed(rho_hist)):
+            alpha = rho * (s * q).sum(-1)
+            q -= alpha[:, None] * y
+            alphas.append(alpha)
+
+        direction = gamma[:, None] * q
+        for s, y, rho, alpha in zip(s_hist, y_hist, rho_hist, reversed(alphas)):
+            beta = rho * (y * direction).sum(-1)
+            direction += (alpha - beta)[:, None] * s
+
+        # Fall back to steepest descent if rounding errors made it an ascent direction
+        slope = (grad * direction).sum(-1)
+        ascent = slope >= 0
+        direction[ascent] = -grad[ascent]
+        slope[ascent] = -grad[ascent].square().sum(-1)
+        direction[done] = 0
+
+        # Bracket a step satisfying the weak Wolfe conditions for each problem, by
+        # doubling it while it's too short and bisecting once it's been too long
+        t = torch.ones_like(f)
+        lo, hi = torch.zeros_like(f), torch.full_like(f, torch.inf)
+        new_f, new_grad = f.clone(), grad.clone()
+        failed = torch.zeros_like(done)
+        pending = (~done).nonzero().squeeze(-1)
+        for _ in range(max_ls):
+            t_p = t[pending]
+            f_p, g_p = value_and_grad(
+                params[pending] + t_p[:, None] * direction[pending], pending
+            )
+            new_f[pending], new_grad[pending] = f_p, g_p
+            too_long = f_p > f[pending] + 1e-4 * t_p * slope[pending]
+            too_short = (g_p * direction[pending]).sum(-1) < 0.9 * slope[pending]
+            hi[pending] = torch.where(too_long, t_p, hi[pending])
+            lo[pending] = torch.where(too_long, lo[pending], t_p)
+
+            # Shorter steps can't help once the objective doesn't change measurably
+            flat = (f_p - f[pending]).abs() <= 4 * eps * f[pending].abs()
+            failed[pending[too_long & flat]] = True
+
+            pending = pending[(too_long & ~flat) | too_short]
+            if not len(pending):
+                break
+
+            lo_p, hi_p = lo[pending], hi[pending]
+            t[pending] = torch.where(hi_p.isinf(), 2 * lo_p, (lo_p + hi_p) / 2)
+
+        # Problems whose line search failed have converged as far as they can
+        failed[pending] = True
+        accepted = ~done & ~failed
+        done |= failed
+
+        step = torch.where(accepted[:, None], t[:, None] * direction, 0)
+        grad_change = torch.where(accepted[:, None], new_grad - grad, 0)
+        params += step
+
+        done |= step.abs().amax(-1) <= tolerance_change
+        done |= (f - new_f).abs() <= tolerance_change
+        f = torch.where(accepted, new_f, f)
+        grad = torch.where(accepted[:, None], new_grad, grad)
+        done |= grad.abs().amax(-1) <= tolerance_grad
+
+        # Skip the curvature update of problems where it wouldn't be positive
+        curvature = (step * grad_change).sum(-1)
+        valid = curvature > 1e-10
+        rho = torch.where(valid, 1 / curvature, 0)
+        gamma = torch.where(
+            valid, curvature / grad_change.square().sum(-1).clamp_min(1e-30), gamma
+        )
+        if valid.any():
+            s_hist.append(step)
+            y_hist.append(grad_change)
+            rho_hist.append(rho)
+            if len(s_hist) > history_size:
+                del s_hist[0], y_hist[0], rho_hist[0]
+
+    return n_iter
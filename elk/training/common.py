@@ -2,6 +2,7 @@
 
 from dataclasses import dataclass
 
+import torch
 from concept_erasure import LeaceEraser
 from simple_parsing.helpers import Serializable
 from torch import Tensor, nn
@@ -25,6 +26,18 @@ class Reporter(PlattMixin):
         self.bias = nn.Parameter(self.weight.new_zeros(1))
         self.scale = nn.Parameter(self.weight.new_ones(1))
 
+    def to(self, device: str | torch.device) -> "Reporter":
+        """Return a copy of the reporter on `device`."""
+        eraser = LeaceEraser(
+            self.eraser.proj_left.to(device),
+            self.eraser.proj_right.to(device),
+            None if self.eraser.bias is None else self.eraser.bias.to(device),
+        )
+        reporter = Reporter(self.weight.to(device), eraser)
+        reporter.bias.data.copy_(self.bias.data)
+        reporter.scale.data.copy_(self.scale.data)
+        return reporter
+
     def __call__(self, hiddens: Tensor) -> Tensor:
         """Return the predicted log odds on input `x`."""
         raw_scores = self.eraser(hiddens) @ self.weight.mT
@@ -1,15 +1,29 @@
 """An ELK reporter network."""
 
-from dataclasses import dataclass
+import warnings
+from copy import deepcopy
+from dataclasses import dataclass, replace
+from typing import Iterable, Literal, Protocol, Sequence
 
 import torch
+import torch.nn.functional as F
 from concept_erasure import LeaceFitter
+from concept_erasure.caching import invalidates_cache
 from einops import rearrange
 from torch import Tensor
 
+from ..truncated_eigh import ConvergenceError, LinearOperator, truncated_eigh
 from ..utils.math_util import cov_mean_fused
 from .common import FitterConfig, Reporter
 
+# Below this hidden size, or above this number of heads, the dense solver is about as
+# fast as Lanczos. On CPU, Lanczos is ~10x faster for d = 1024 and ~50x for d = 4096.
+LANCZOS_MIN_DIM = 1024
+LANCZOS_MAX_HEADS = 10
+
+# Residual tolerance for Lanczos, relative to the Frobenius norm of the VINC matrix
+LANCZOS_TOL = 1e-5
+
 
 @dataclass
 class EigenFitterConfig(FitterConfig):
@@ -25,8 +39,9 @@ class EigenFitterConfig(FitterConfig):
     """The number of eigenvectors to compute from the VINC matrix."""
 
     save_reporter_stats: bool = False
-    """Whether to save the reporter statistics to disk in EigenFitter.save(). This
-    is useful for debugging and analysis, but can take up a lot of disk space."""
+    """Whether to save the statistics of each fitter next to its reporter, as
+    `layer_{i}.safetensors`, so that it can be solved again with different
+    hyperparameters by `elk refit`. Takes up about `16 * d ** 2` bytes per layer."""
 
     erase_prompts: bool = False
     """Whether to apply concept erasure on the prompt template IDs."""
@@ -34,11 +49,190 @@ class EigenFitterConfig(FitterConfig):
     use_centroids: bool = True
     """Whether to average hiddens within each cluster before computing covariance."""
 
+    sketch_rank: int | None = None
+    """If set, keep low-rank Frequent Directions sketches of this rank in place of
+    the dense `d x d` statistics, for both VINC and LEACE. Memory usage then scales
+    with `sketch_rank * d` instead of `d ** 2`. See `SketchedEigenFitter`."""
+
+    eigen_solver: Literal["auto", "dense", "lanczos"] = "auto"
+    """How to compute the top eigenvectors of the VINC matrix. "dense" computes the
+    full eigendecomposition, while "lanczos" uses the thick-restart Lanczos method in
+    `truncated_eigh` and falls back to the dense solver if it fails to converge.
+    "auto" uses Lanczos when the hidden size is large and `num_heads` is small."""
+
     def __post_init__(self):
         if not (0 <= self.neg_cov_weight <= 1):
             raise ValueError("neg_cov_weight must be in [0, 1]")
         if self.num_heads <= 0:
             raise ValueError("num_heads must be positive")
+        if self.sketch_rank is not None:
+            if self.sketch_rank <= 0:
+                raise ValueError("sketch_rank must be positive")
+            if not self.use_centroids:
+                raise ValueError("sketch_rank is only supported with use_centroids")
+            if self.save_reporter_stats:
+                raise ValueError("sketch_rank doesn't support save_reporter_stats")
+
+
+class ScalableOperator(LinearOperator, Protocol):
+    """A `LinearOperator` that can be rescaled, so that a bound on its norm is 1."""
+
+    def norm_bound(self) -> Tensor:
+        """Upper bound on the Frobenius norm of the matrix, of shape `[...]`."""
+        ...
+
+    def scale(self, factor: Tensor) -> "ScalableOperator":
+        """Return the operator multiplied by `factor`, of shape `[...]`."""
+        ...
+
+
+@dataclass(frozen=True)
+class VincOperator:
+    """Matrix-free representation of the VINC matrix `P @ A @ P.mT`.
+
+    Here `A = sum_i weights[..., i] * matrices[i]` is the weighted sum of the VINC
+    statistics and `P = I - proj_left @ proj_right` is the LEACE projection matrix.
+    The operator is only ever applied to vectors, using the symmetric part of each
+    matrix, so neither `A` nor `P` is materialized unless `to_dense()` is called.
+    All tensors may have the same leading batch dimensions, e.g. one per layer.
+    """
+
+    matrices: tuple[Tensor, ...]
+    """The unweighted `[..., d, d]` statistics."""
+
+    weights: Tensor
+    """The `[..., len(matrices)]` weights of the statistics."""
+
+    proj_left: Tensor
+    """Left factor of the LEACE projection, of shape `[..., d, r]`."""
+
+    proj_right: Tensor
+    """Right factor of the LEACE projection, of shape `[..., r, d]`."""
+
+    @property
+    def shape(self) -> torch.Size:
+        d = self.matrices[0].shape[-1]
+        batch = torch.broadcast_shapes(
+            self.weights.shape[:-1],
+            self.matrices[0].shape[:-2],
+            self.proj_left.shape[:-2],
+        )
+        return torch.Size((*batch, d, d))
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return self.matrices[0].dtype
+
+    @property
+    def device(self) -> torch.device:
+        return self.matrices[0].device
+
+    def norm_bound(self) -> Tensor:
+        """Upper bound on the Frobenius norm of `A` for each batch element."""
+        norms = torch.stack([torch.linalg.matrix_norm(m) for m in self.matrices], -1)
+        return (self.weights.abs() * norms).sum(-1)
+
+    def scale(self, factor: Tensor) -> "VincOperator":
+        """Return the operator multiplied by `factor`, of shape `[...]`."""
+        return replace(self, weights=self.weights * factor.unsqueeze(-1))
+
+    def matvec(self, x: Tensor) -> Tensor:
+        # x <- P^T x
+        x = x - torch.einsum(
+            "...rd,...r->...d",
+            self.proj_right,
+            torch.einsum("...dr,...d->...r", self.proj_left, x),
+        )
+
+        # y <- A x, using the symmetric part of each matrix
+        y = torch.zeros_like(x)
+        for w, m in zip(self.weights.unbind(-1), self.matrices):
+            mx = torch.einsum("...ij,...j->...i", m, x)
+            mx += torch.einsum("...ji,...j->...i", m, x)
+            y += 0.5 * w.unsqueeze(-1) * mx
+
+        # y <- P y
+        return y - torch.einsum(
+            "...dr,...r->...d",
+            self.proj_left,
+            torch.einsum("...rd,...d->...r", self.proj_right, y),
+        )
+
+    def to_dense(self) -> Tensor:
+        A = sum(
+            w[..., None, None] * m
+            for w, m in zip(self.weights.unbind(-1), self.matrices)
+        )
+        eye = torch.eye(self.shape[-1], device=self.device, dtype=self.dtype)
+        P = eye - self.proj_left @ self.proj_right
+        return P @ A @ P.mT
+
+
+def top_eigenvectors(
+    A: Tensor | ScalableOperator,
+    k: int,
+    solver: Literal["auto", "dense", "lanczos"] = "dense",
+    *,
+    seed: int | None = None,
+) -> Tensor:
+    """Return the eigenvectors of the top `k` eigenvalues of a symmetric matrix.
+
+    Args:
+        A: A symmetric matrix or batch of symmetric matrices of shape `[..., d, d]`,
+            either dense or as a matrix-free operator such as `VincOperator` or
+            `SketchedVincOperator`.
+            Operators are only materialized if the dense solver is used.
+        k: The number of eigenvectors to return.
+        solver: Which eigensolver to use; see `EigenFitterConfig.eigen_solver`.
+        seed: The random seed for the Lanczos starting vector.
+
+    Returns:
+        The eigenvectors as columns of a tensor of shape `[..., d, k]`, sorted in
+        ascending order of eigenvalue.
+    """
+    if solver == "auto":
+        d = A.shape[-1]
+        use_lanczos = d >= LANCZOS_MIN_DIM and k <= LANCZOS_MAX_HEADS
+        solver = "lanczos" if use_lanczos else "dense"
+
+    if solver == "lanczos":
+        # The residual tolerance is absolute, so normalize A to make it scale-free
+        if isinstance(A, Tensor):
+            A_ = A / torch.linalg.matrix_norm(A, keepdim=True)
+        else:
+            A_ = A.scale(A.norm_bound().reciprocal())
+        try:
+            _, Q = truncated_eigh(A_, k, tol=LANCZOS_TOL, seed=seed)
+            if Q.isfinite().all():
+                return Q
+        except ConvergenceError as e:
+            warnings.warn(f"{e} Falling back to the dense eigensolver.")
+
+    if not isinstance(A, Tensor):
+        A = A.to_dense()
+
+    try:
+        L, Q = torch.linalg.eigh(A)
+    except torch.linalg.LinAlgError:
+        try:
+            L, Q = torch.linalg.eig(A)
+            L, Q = L.real, Q.real
+        except torch.linalg.LinAlgError as e:
+            # Check if the matrix has non-finite values
+            if not A.isfinite().all():
+                raise ValueError(
+                    "Fitting the reporter failed because the VINC matrix has "
+                    "non-finite entries. Usually this means the hidden states "
+                    "themselves had non-finite values."
+                ) from e
+            else:
+                raise e
+
+        # Unlike eigh, eig doesn't sort the eigenvalues
+        L, indices = L.sort(dim=-1)
+        Q = Q.gather(-1, indices.unsqueeze(-2).expand_as(Q))
+
+    return Q[..., -k:]
 
 
 class EigenFitter:
@@ -166,66 +360,164 @@ class EigenFitter:
             # CRC-TPC style
             centroids = rearrange(hiddens, "n v k d -> (n v) k d")
 
-        deltas, deltas2 = [], []
-
-        # Iterating over classes
-        for i, h in enumerate(centroids.unbind(1)):
-            # Update the running means
-            delta = h - self.class_means[i]
-            self.class_means[i] += delta.sum(dim=0) / self.n
+        # Update the running means of all classes at once
+        delta = centroids - self.class_means
+        self.class_means += delta.sum(dim=0) / self.n
 
-            # Post-mean update deltas are used to update the (co)variance
-            delta2 = h - self.class_means[i]  # [n, d]
+        # Post-mean update deltas are used to update the (co)variance
+        delta2 = centroids - self.class_means  # [n, k, d]
 
-            # *** Variance (inter-cluster) ***
-            # See code at https://bit.ly/3YC9BhH and "Welford's online algorithm"
-            # in https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance.
-            self.intercluster_cov_M2.addmm_(delta.mT, delta2, alpha=1 / k)
-            deltas.append(delta)
-            deltas2.append(delta2)
+        # *** Variance (inter-cluster) ***
+        # See code at https://bit.ly/3YC9BhH and "Welford's online algorithm"
+        # in https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance.
+        # Summing delta_i^T @ delta2_i over classes i is a single matmul.
+        self.intercluster_cov_M2.addmm_(
+            delta.flatten(0, 1).mT, delta2.flatten(0, 1), alpha=1 / k
+        )
 
         # *** Negative covariance (contrastive) ***
-        # Iterating over pairs of classes (k, k') where k != k'
-        for i, d in enumerate(deltas):
-            for j, d_ in enumerate(deltas2):
-                # Compare to the other classes only
-                if i == j:
-                    continue
+        # Pair each class i with the sum of the deltas of all the other classes j != i
+        others = delta2.sum(dim=1, keepdim=True) - delta2
+        self.contrastive_xcov_M2.addmm_(
+            delta.flatten(0, 1).mT, others.flatten(0, 1), alpha=1 / (k * (k - 1))
+        )
 
-                scale = 1 / (k * (k - 1))
-                self.contrastive_xcov_M2.addmm_(d.mT, d_, alpha=scale)
+    @torch.no_grad()
+    def merge(self, other: "EigenFitter") -> "EigenFitter":
+        """Merge the statistics of `other`, fit on different data, into this fitter.
+
+        The result is the same, up to floating point error, as if all the data seen by
+        `other` had been passed to this fitter's `update()`. This lets shards of the
+        data be processed by different processes or nodes and reduced at the end.
+        """
+        _check_mergeable(self, other)
+        _merge_vinc_stats(self, other)
+        _merge_leace(self.leace, other.leace)
+        return self
+
+    @classmethod
+    def reduce(cls, fitters: Iterable["EigenFitter"]) -> "EigenFitter":
+        """Merge a sequence of fitters into a new one, leaving the inputs unchanged."""
+        first, *rest = fitters
+        result = deepcopy(first)
+        for fitter in rest:
+            result.merge(fitter)
+
+        return result
+
+    @classmethod
+    def leave_one_out(cls, fitters: Sequence["EigenFitter"]) -> list["EigenFitter"]:
+        """For each fitter, merge all of the *other* fitters into a new one, leaving
+        the inputs unchanged.
+
+        If each fitter holds the statistics of one fold of the data, this gives the
+        fitters for k-fold cross-validation. Prefix and suffix merges are shared
+        between the folds, so this only takes `3 * (k - 2)` merges in total.
+        """
+        if len(fitters) < 2:
+            raise ValueError("Need at least two fitters to leave one out")
+
+        # prefixes[i] has the statistics of fitters[:i + 1], suffixes[i] of fitters[i:]
+        prefixes = [deepcopy(fitters[0])]
+        for fitter in fitters[1:-1]:
+            prefixes.append(deepcopy(prefixes[-1]).merge(fitter))
+
+        suffixes = [deepcopy(fitters[-1])]
+        for fitter in reversed(fitters[1:-1]):
+            suffixes.insert(0, deepcopy(suffixes[0]).merge(fitter))
+
+        return [
+            suffixes[0],
+            *(
+                deepcopy(prefixes[i - 1]).merge(suffixes[i])
+                for i in range(1, len(fitters) - 1)
+            ),
+            prefixes[-1],
+        ]
+
+    def state_dict(self) -> dict[str, Tensor]:
+        """The statistics of the fitter, including the LEACE fitter, as a flat
+        dictionary of `float32` tensors which can be saved with `safetensors`."""
+        return _state_dict(self, self.leace)
+
+    @classmethod
+    def from_state_dict(
+        cls,
+        cfg: EigenFitterConfig,
+        state: dict[str, Tensor],
+        *,
+        device: str | torch.device | None = None,
+    ) -> "EigenFitter":
+        """Rebuild a fitter from the statistics saved by `state_dict()`.
+
+        `cfg` may have different hyperparameters from the config used to compute the
+        statistics, as long as `erase_prompts` and `use_centroids` are the same.
+        """
+        k, d = state["class_means"].shape
+        z_dim = state["leace.mean_z"].shape[-1]
+        num_variants = z_dim // k if cfg.erase_prompts else 1
+
+        fitter = cls(cfg, d, k, device=device, num_variants=num_variants)
+        if fitter.leace.z_dim != z_dim:
+            raise ValueError("erase_prompts doesn't match the saved statistics")
+
+        for name, value in state.items():
+            if name in _STATE_NAMES:
+                obj = fitter.leace if name.startswith("leace.") else fitter
+                getattr(obj, name.removeprefix("leace.")).copy_(value)
+
+        return fitter
+
+    def vinc_operator(self) -> VincOperator:
+        """The VINC matrix for the current statistics, after removing the subspace
+        responsible for pseudolabel correlations."""
+        eraser = self.leace.eraser
+        return VincOperator(
+            *_vinc_terms(self.config, self),
+            eraser.proj_left,
+            eraser.proj_right,
+        )
 
     def fit_streaming(self) -> Reporter:
         """Fit the probe using the current streaming statistics."""
-        inv_weight = 1 - self.config.neg_cov_weight
-        A = (
-            self.config.var_weight * self.intercluster_cov
-            - inv_weight * self.intracluster_cov
-            - self.config.neg_cov_weight * self.contrastive_xcov
+        Q = top_eigenvectors(
+            self.vinc_operator(),
+            self.config.num_heads,
+            self.config.eigen_solver,
+            seed=self.config.seed,
         )
-
-        # Remove the subspace responsible for pseudolabel correlations
-        A = self.leace.eraser.P @ A @ self.leace.eraser.P.mT
-        try:
-            L, Q = torch.linalg.eigh(A)
-        except torch.linalg.LinAlgError:
-            try:
-                L, Q = torch.linalg.eig(A)
-                L, Q = L.real, Q.real
-            except torch.linalg.LinAlgError as e:
-                # Check if the matrix has non-finite values
-                if not A.isfinite().all():
-                    raise ValueError(
-                        "Fitting the reporter failed because the VINC matrix has "
-                        "non-finite entries. Usually this means the hidden states "
-                        "themselves had non-finite values."
-                    ) from e
-                else:
-                    raise e
-
-        L, Q = L[-self.config.num_heads :], Q[:, -self.config.num_heads :]
         return Reporter(Q.T, self.leace.eraser)
 
+    def fit_grid(self, hparams: Sequence[tuple[float, float]]) -> list[Reporter]:
+        """Fit a probe for each `(var_weight, neg_cov_weight)` pair in `hparams`.
+
+        Only the weights of the VINC statistics depend on these hyperparameters, so
+        all the probes share the current statistics and LEACE eraser, and their
+        VINC matrices are solved together with batched eigendecompositions.
+        """
+        configs = [
+            replace(self.config, var_weight=a, neg_cov_weight=b) for a, b in hparams
+        ]
+        weights = torch.stack([_vinc_terms(cfg, self)[1] for cfg in configs])
+        op = replace(self.vinc_operator(), weights=weights)
+
+        # Bound the size of the dense `[grid, d, d]` VINC matrices to 1 GiB
+        d = self.in_features
+        chunk_size = max(1, 2**30 // (d**2 * self.intracluster_cov.element_size()))
+
+        Q = torch.cat(
+            [
+                top_eigenvectors(
+                    replace(op, weights=chunk),
+                    self.config.num_heads,
+                    self.config.eigen_solver,
+                    seed=self.config.seed,
+                )
+                for chunk in weights.split(chunk_size)
+            ]
+        )
+        return [Reporter(q.T, self.leace.eraser) for q in Q]
+
     def fit(self, hiddens: Tensor) -> Reporter:
         """Fit the probe to the contrast set `hiddens`.
 
@@ -234,3 +526,346 @@ class EigenFitter:
         """
         self.update(hiddens)
         return self.fit_streaming()
+
+
+class MultiLayerEigenFitter:
+    """Fit linear reporters for several layers at once with eigendecomposition.
+
+    This is equivalent to running a separate `EigenFitter` on each layer, but all the
+    statistics are kept as stacks of shape `[layers, ...]` so that every layer is
+    updated with a few batched matrix multiplications, and all of the VINC matrices
+    are solved with a single batched eigendecomposition.
+
+    Args:
+        cfg: The reporter configuration.
+        in_features: The number of input features.
+        num_layers: The number of layers to fit reporters for.
+        num_classes: The number of classes for tracking the running means.
+
+    Attributes:
+        config: The reporter configuration.
+        leace: One `LeaceFitter` for each layer.
+        intercluster_cov_M2: The unnormalized inter-cluster covariance of each layer.
+        intracluster_cov: The running mean of the intra-cluster covariance matrices of
+            each layer.
+        contrastive_xcov_M2: The unnormalized contrastive cross-covariance of each
+            layer.
+        n: The running sum of the number of clusters processed by `update()`.
+    """
+
+    config: EigenFitterConfig
+
+    intercluster_cov_M2: Tensor  # variance
+    intracluster_cov: Tensor  # invariance
+    contrastive_xcov_M2: Tensor  # negative covariance
+
+    n: Tensor
+    class_means: Tensor
+
+    def __init__(
+        self,
+        cfg: EigenFitterConfig,
+        in_features: int,
+        num_layers: int,
+        num_classes: int = 2,
+        *,
+        device: str | torch.device | None = None,
+        dtype: torch.dtype | None = None,
+        num_variants: int = 1,
+    ):
+        self.config = cfg
+        self.in_features = in_features
+        self.num_layers = num_layers
+        self.num_classes = num_classes
+        self.num_variants = num_variants
+
+        self.leace = [
+            LeaceFitter(
+                in_features,
+                num_classes * num_variants if cfg.erase_prompts else num_classes,
+                device=device,
+                dtype=dtype,
+            )
+            for _ in range(num_layers)
+        ]
+
+        # Running statistics
+        self.n = torch.zeros((), device=device, dtype=torch.long)
+        self.class_means = torch.zeros(
+            num_layers, num_classes, in_features, device=device, dtype=dtype
+        )
+        self.contrastive_xcov_M2 = torch.zeros(
+            num_layers, in_features, in_features, device=device, dtype=dtype
+        )
+        self.intercluster_cov_M2 = torch.zeros(
+            num_layers, in_features, in_features, device=device, dtype=dtype
+        )
+        self.intracluster_cov = torch.zeros(
+            num_layers, in_features, in_features, device=device, dtype=dtype
+        )
+
+    @property
+    def contrastive_xcov(self) -> Tensor:
+        assert self.n > 0, "Stats not initialized; did you call update()?"
+        return self.contrastive_xcov_M2 / self.n
+
+    @property
+    def intercluster_cov(self) -> Tensor:
+        assert self.n > 0, "Stats not initialized; did you call update()?"
+        return self.intercluster_cov_M2 / self.n
+
+    @torch.no_grad()
+    def update(self, hiddens: Tensor) -> None:
+        """Update the statistics of every layer.
+
+        Args:
+            hiddens: The contrast set of shape [layers, batch, variants, choices, dim].
+        """
+        (L, n, v, k, d) = hiddens.shape
+
+        # Sanity checks
+        assert L == self.num_layers, f"Expected {self.num_layers} layers, got {L}"
+        assert k > 1, "Must provide at least two hidden states"
+        assert hiddens.ndim == 5, "Must be of shape [layers, batch, variants, k, dim]"
+
+        self.n += n
+
+        if self.config.erase_prompts:
+            # Independent indicator for each (template, pseudo-label) pair
+            indicators = torch.eye(k * v, device=hiddens.device).expand(n, -1, -1)
+        else:
+            # Only use indicators for each pseudo-label
+            indicators = torch.eye(k, device=hiddens.device).expand(n, v, -1, -1)
+
+        for fitter, h in zip(self.leace, hiddens):
+            fitter.update(x=h, z=indicators)
+
+        # *** Invariance (intra-cluster) ***
+        # Batched version of `cov_mean_fused` over the layer dimension
+        x_ = hiddens - hiddens.mean(dim=2, keepdim=True)
+        x_ = x_.reshape(L, -1, d)
+        intra_cov = x_.mT @ x_ / x_.shape[1]
+        self.intracluster_cov += (n / self.n) * (intra_cov - self.intracluster_cov)
+
+        if self.config.use_centroids:
+            # VINC style
+            centroids = hiddens.mean(2)
+        else:
+            # CRC-TPC style
+            centroids = rearrange(hiddens, "l n v k d -> l (n v) k d")
+
+        # Update the running means of all classes at once
+        delta = centroids - self.class_means.unsqueeze(1)
+        self.class_means += delta.sum(dim=1) / self.n
+
+        # Post-mean update deltas are used to update the (co)variance
+        delta2 = centroids - self.class_means.unsqueeze(1)  # [l, n, k, d]
+
+        # *** Variance (inter-cluster) ***
+        # Sum over classes of the Welford updates delta_i^T @ delta2_i
+        self.intercluster_cov_M2.baddbmm_(
+            delta.flatten(1, 2).mT, delta2.flatten(1, 2), alpha=1 / k
+        )
+
+        # *** Negative covariance (contrastive) ***
+        # Pair each class i with the sum of the deltas of all the other classes j != i
+        others = delta2.sum(dim=2, keepdim=True) - delta2
+        self.contrastive_xcov_M2.baddbmm_(
+            delta.flatten(1, 2).mT, others.flatten(1, 2), alpha=1 / (k * (k - 1))
+        )
+
+    @torch.no_grad()
+    def merge(self, other: "MultiLayerEigenFitter") -> "MultiLayerEigenFitter":
+        """Merge the statistics of `other`, fit on different data, into this fitter.
+        See `EigenFitter.merge()`."""
+        _check_mergeable(self, other)
+        if self.num_layers != other.num_layers:
+            raise ValueError("Can't merge fitters with different numbers of layers")
+
+        _merge_vinc_stats(self, other)
+        for leace, other_leace in zip(self.leace, other.leace):
+            _merge_leace(leace, other_leace)
+
+        return self
+
+    @classmethod
+    def reduce(
+        cls, fitters: Iterable["MultiLayerEigenFitter"]
+    ) -> "MultiLayerEigenFitter":
+        """Merge a sequence of fitters into a new one, leaving the inputs unchanged."""
+        first, *rest = fitters
+        result = deepcopy(first)
+        for fitter in rest:
+            result.merge(fitter)
+
+        return result
+
+    def state_dicts(self) -> list[dict[str, Tensor]]:
+        """The statistics of each layer, in the format of `EigenFitter.state_dict()`."""
+        return [
+            {name: value.clone() for name, value in _state_dict(self, leace, i).items()}
+            for i, leace in enumerate(self.leace)
+        ]
+
+    def vinc_operator(self) -> VincOperator:
+        """The `[layers, d, d]` VINC matrices for the current statistics, after
+        removing the subspace responsible for pseudolabel correlations."""
+        erasers = [fitter.eraser for fitter in self.leace]
+
+        # The erasers can have different ranks, so pad them with zeros to stack them
+        r = max(eraser.proj_right.shape[0] for eraser in erasers)
+        proj_left = torch.stack(
+            [
+                F.pad(eraser.proj_left, (0, r - eraser.proj_left.shape[1]))
+                for eraser in erasers
+            ]
+        )
+        proj_right = torch.stack(
+            [
+                F.pad(eraser.proj_right, (0, 0, 0, r - eraser.proj_right.shape[0]))
+                for eraser in erasers
+            ]
+        )
+        return VincOperator(*_vinc_terms(self.config, self), proj_left, proj_right)
+
+    def fit_streaming(self) -> list[Reporter]:
+        """Fit a probe for each layer using the current streaming statistics."""
+        Q = top_eigenvectors(
+            self.vinc_operator(),
+            self.config.num_heads,
+            self.config.eigen_solver,
+            seed=self.config.seed,
+        )
+        erasers = [fitter.eraser for fitter in self.leace]
+        return [Reporter(q.T, eraser) for q, eraser in zip(Q, erasers)]
+
+
+def _vinc_terms(
+    cfg: EigenFitterConfig, fitter: "EigenFitter | MultiLayerEigenFitter"
+) -> tuple[tuple[Tensor, ...], Tensor]:
+    """The statistics making up the VINC matrix of `fitter`, and their weights.
+
+    The unnormalized `M2` statistics are used directly, folding the division by the
+    number of samples into the weights, so that no `d x d` temporaries are created.
+    """
+    assert fitter.n > 0, "Stats not initialized; did you call update()?"
+    n = fitter.n.item()
+
+    matrices = (
+        fitter.intercluster_cov_M2,
+        fitter.intracluster_cov,
+        fitter.contrastive_xcov_M2,
+    )
+    weights = torch.tensor(
+        [
+            cfg.var_weight / n,
+            -(1 - cfg.neg_cov_weight),
+            -cfg.neg_cov_weight / n,
+        ],
+        device=fitter.intracluster_cov.device,
+        dtype=fitter.intracluster_cov.dtype,
+    )
+    return matrices, weights.expand(*matrices[0].shape[:-2], -1)
+
+
+def _check_mergeable(
+    a: "EigenFitter | MultiLayerEigenFitter", b: "EigenFitter | MultiLayerEigenFitter"
+) -> None:
+    """Raise an error if the statistics of two fitters can't be combined."""
+    if a.config != b.config:
+        raise ValueError("Can't merge fitters with different configs")
+    if (a.in_features, a.num_classes) != (b.in_features, b.num_classes):
+        raise ValueError("Can't merge fitters with different shapes")
+    if a.config.erase_prompts and a.num_variants != b.num_variants:
+        raise ValueError("Can't merge fitters with different numbers of variants")
+
+
+def _merge_vinc_stats(
+    a: "EigenFitter | MultiLayerEigenFitter", b: "EigenFitter | MultiLayerEigenFitter"
+) -> None:
+    """Merge the VINC statistics of `b` into `a` in place.
+
+    Uses the parallel algorithm of Chan et al. (1979), which corrects the sum of the
+    two co-moment matrices by the outer product of the difference in means. Works for
+    any number of leading (layer) dimensions.
+    """
+    if b.n == 0:
+        return
+
+    n_a, n_b = a.n.item(), b.n.item()
+    n = n_a + n_b
+    k = a.num_classes
+
+    delta = b.class_means - a.class_means  # [..., k, d]
+    others = delta.sum(dim=-2, keepdim=True) - delta
+
+    # *** Variance (inter-cluster) ***
+    a.intercluster_cov_M2 += b.intercluster_cov_M2
+    a.intercluster_cov_M2 += delta.mT @ delta * (n_a * n_b / (n * k))
+
+    # *** Negative covariance (contrastive) ***
+    a.contrastive_xcov_M2 += b.contrastive_xcov_M2
+    a.contrastive_xcov_M2 += delta.mT @ others * (n_a * n_b / (n * k * (k - 1)))
+
+    # *** Invariance (intra-cluster) ***
+    a.intracluster_cov += (n_b / n) * (b.intracluster_cov - a.intracluster_cov)
+
+    a.class_means += delta * (n_b / n)
+    a.n += b.n
+
+
+@invalidates_cache("eraser")
+def _merge_leace(a: LeaceFitter, b: LeaceFitter) -> None:
+    """Merge the statistics of LEACE fitter `b` into `a` in place."""
+    if b.n == 0:
+        return
+
+    n = a.n + b.n
+    delta_x = b.mean_x - a.mean_x
+    delta_z = b.mean_z - a.mean_z
+    coef = a.n * b.n / n
+
+    if a.sigma_xx_ is not None:
+        assert b.sigma_xx_ is not None
+        a.sigma_xx_ += b.sigma_xx_ + torch.outer(delta_x, delta_x) * coef
+
+    a.sigma_xz_ += b.sigma_xz_ + torch.outer(delta_x, delta_z) * coef
+    a.mean_x += delta_x * (b.n / n)
+    a.mean_z += delta_z * (b.n / n)
+    a.n += b.n
+
+
+# Statistics saved by `EigenFitter.state_dict()`
+_STATE_NAMES = (
+    "n",
+    "class_means",
+    "intercluster_cov_M2",
+    "intracluster_cov",
+    "contrastive_xcov_M2",
+    "leace.n",
+    "leace.mean_x",
+    "leace.mean_z",
+    "leace.sigma_xx_",
+    "leace.sigma_xz_",
+)
+
+
+def _state_dict(
+    fitter: "EigenFitter | MultiLayerEigenFitter",
+    leace: LeaceFitter,
+    layer: int | None = None,
+) -> dict[str, Tensor]:
+    """The statistics of `fitter`, optionally of a single `layer`, and `leace`."""
+    state = {}
+    for name in _STATE_NAMES:
+        obj = leace if name.startswith("leace.") else fitter
+        value = getattr(obj, name.removeprefix("leace."))
+        if value is None:
+            continue
+
+        if layer is not None and obj is fitter and value.ndim > 0:
+            value = value[layer]
+
+        state[name] = value if name == "n" else value.float()
+
+    return state
@@ -154,3 +154,54 @@ def prompt_var_loss(logit0: Tensor, logit1: Tensor, coef: float = 1.0) -> Tensor
     var1 = p1.var(dim=-1, unbiased=False).mean()
     prompt_variance = var0 + var1
     return coef * prompt_variance
+
+
+# Each built-in loss as a weighted sum of terms which can be shared between losses
+FUSED_LOSSES: dict[str, dict[str, float]] = {
+    "ccs": {"consistency": 1.0, "confidence": 1.0},
+    "ccs_prompt_var": {"consistency": 1.0, "confidence": 1.0, "prompt_var": 1.0},
+    "js": {"mixture_entropy": 1.0, "entropy": -0.5},
+    "js_confidence": {"mixture_entropy": 1.0},
+    "consistency_squared": {"consistency": 1.0},
+    "confidence_squared": {"confidence": 1.0},
+    "prompt_var_squared": {"prompt_var": 1.0},
+}
+
+
+def fused_loss(logit0: Tensor, logit1: Tensor, loss_dict: dict[str, float]) -> Tensor:
+    """Return the sum of `coef * LOSSES[name](logit0, logit1)` over `loss_dict`.
+
+    The sigmoids and any terms shared between the built-in losses are only computed
+    once, and terms are combined before being reduced. Losses which aren't in
+    `FUSED_LOSSES` fall back to calling `LOSSES` directly.
+    """
+    coefs: dict[str, float] = {}
+    loss = logit0.new_zeros(())
+    for name, coef in loss_dict.items():
+        if name not in FUSED_LOSSES:
+            loss = loss + LOSSES[name](logit0, logit1, coef)
+            continue
+
+        for term, weight in FUSED_LOSSES[name].items():
+            coefs[term] = coefs.get(term, 0.0) + coef * weight
+
+    if not coefs:
+        return loss
+
+    p0, p1 = logit0.sigmoid(), logit1.sigmoid()
+    neg_p1 = 1 - p1
+    if "consistency" in coefs:
+        loss = loss + coefs["consistency"] * p0.sub(neg_p1).square().mean()
+    if "confidence" in coefs:
+        loss = loss + coefs["confidence"] * torch.min(p0, p1).square().mean()
+    if "prompt_var" in coefs:
+        assert logit0.shape == logit1.shape
+        assert len(logit0.shape) in [1, 2]
+        prompt_var = p0.var(dim=-1, unbiased=False) + p1.var(dim=-1, unbiased=False)
+        loss = loss + coefs["prompt_var"] * prompt_var.mean()
+    if "mixture_entropy" in coefs:
+        loss = loss + coefs["mixture_entropy"] * H((p0 + neg_p1) / 2)
+    if "entropy" in coefs:
+        loss = loss + coefs["entropy"] * (H(p0) + H(neg_p1))
+
+    return loss
@@ -41,3 +41,67 @@ class PlattMixin(ABC):
             return float(loss)
 
         opt.step(closure)
+
+    def platt_scale_scores(
+        self, labels: Tensor, scores: Tensor, max_iter: int = 100
+    ) -> Tensor:
+        """Fit the scale and bias terms from the current outputs of the model, when
+        the hidden states are too large to keep in memory for `platt_scale()`.
+
+        An affine map of `scores` is fit with LBFGS and folded into the scale and
+        bias, which gives the same model as fitting them directly.
+
+        Args:
+            labels: Binary labels of shape [batch].
+            scores: Outputs of the model with its current scale and bias, of shape
+                [batch].
+            max_iter: Maximum number of iterations for LBFGS.
+
+        Returns:
+            The outputs of the model for the same examples with the new scale and
+            bias.
+        """
+        scale = torch.ones_like(self.scale, requires_grad=True)
+        bias = torch.zeros_like(self.bias, requires_grad=True)
+        opt = optim.LBFGS(
+            [bias, scale],
+            line_search_fn="strong_wolfe",
+            max_iter=max_iter,
+            tolerance_change=torch.finfo(scores.dtype).eps,
+            tolerance_grad=torch.finfo(scores.dtype).eps,
+        )
+
+        def closure():
+            opt.zero_grad()
+            loss = nn.functional.binary_cross_entropy_with_logits(
+                scores * scale + bias, labels.float()
+            )
+
+            loss.backward()
+            return float(loss)
+
+        opt.step(closure)
+
+        with torch.no_grad():
+            self.bias.data.mul_(scale).add_(bias)
+            self.scale.data.mul_(scale)
+            return scores * scale + bias
+
+    def platt_scale_gaussian(self, means: Tensor, variance: Tensor, prior: Tensor):
+        """Set the scale and bias terms in closed form, assuming the raw scores are
+        Gaussian within each class with a shared variance.
+
+        This is the logistic model implied by linear discriminant analysis. It only
+        needs summary statistics of the raw scores, so it can be used when the
+        hidden states themselves are no longer available.
+
+        Args:
+            means: Mean raw score of the negative and positive examples, shape [2].
+            variance: Variance of the raw scores within each class.
+            prior: Fraction of examples which are positive.
+        """
+        scale = (means[1] - means[0]) / variance
+        bias = torch.logit(prior) - scale * means.mean()
+
+        self.scale.data.copy_(scale)
+        self.bias.data.copy_(bias)
@@ -0,0 +1,117 @@
+"""Refit Eigen reporters from saved statistics, without touching the hidden states."""
+
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Literal
+
+import torch
+from safetensors.torch import load_file
+from simple_parsing.helpers import field
+from simple_parsing.helpers.serialization import save
+from torch import Tensor
+
+from ..files import elk_reporter_dir, memorably_named_dir
+from .common import FitterConfig, Reporter
+from .eigen_reporter import EigenFitter, EigenFitterConfig
+
+
+def refit_reporter(
+    cfg: EigenFitterConfig,
+    stats: dict[str, Tensor],
+    device: str | torch.device = "cpu",
+) -> Reporter:
+    """Fit and Platt scale a reporter from statistics saved by `Elicit`.
+
+    The Platt scaling parameters are computed in closed form from the saved means of
+    the negative and positive examples and the covariance of the hidden states, with
+    `PlattMixin.platt_scale_gaussian`. They're close to, but not the same as, the
+    parameters fit by logistic regression during elicitation.
+    """
+    stats = {name: value.to(device) for name, value in stats.items()}
+    fitter = EigenFitter.from_state_dict(cfg, stats, device=device)
+    reporter = fitter.fit_streaming()
+
+    # The raw scores are an affine function of the hidden states: x @ A @ w.T + c
+    d = fitter.in_features
+    eye = torch.eye(d, device=device, dtype=reporter.weight.dtype)
+    A = reporter.eraser(eye) - reporter.eraser(torch.zeros_like(eye[0]))
+    u = A @ reporter.weight.mT
+
+    sigma = fitter.leace.sigma_xx_
+    assert sigma is not None
+    sigma = (sigma + sigma.mT) / (2 * fitter.leace.n)
+
+    counts = stats["label_counts"].float()
+    prior = counts[1] / counts.sum()
+    means = (reporter.eraser(stats["label_means"]) @ reporter.weight.mT).squeeze(-1)
+
+    # Remove the variance explained by the labels to get the within-class variance
+    total_var = torch.einsum("dh,de,eh->h", u, sigma, u).squeeze(-1)
+    between_var = prior * (1 - prior) * (means[1] - means[0]) ** 2
+    variance = (total_var - between_var).clamp_min(torch.finfo(sigma.dtype).eps)
+
+    reporter.platt_scale_gaussian(means, variance, prior)
+    return reporter
+
+
+@dataclass
+class Refit:
+    """Solve the statistics saved by an `elk elicit` run with `save_reporter_stats`
+    again, with different Eigen hyperparameters. Unset hyperparameters keep the
+    values of the original run. The refit reporters can be evaluated with `elk eval`.
+    """
+
+    source: Path = field(positional=True)
+    """Output directory of the original run, relative to the elk reporter directory."""
+
+    var_weight: float | None = None
+    """The weight of the variance term in the loss."""
+
+    neg_cov_weight: float | None = None
+    """The weight of the negative covariance term in the loss."""
+
+    num_heads: int | None = None
+    """The number of eigenvectors to compute from the VINC matrix."""
+
+    eigen_solver: Literal["auto", "dense", "lanczos"] | None = None
+    """How to compute the top eigenvectors of the VINC matrix."""
+
+    out_dir: Path | None = None
+    """Where to save the refit reporters. Defaults to a memorably named directory
+    under `refits` in the source directory."""
+
+    def execute(self):
+        source_dir = elk_reporter_dir() / self.source
+        original = FitterConfig.load(source_dir / "reporters" / "cfg.yaml")
+        if not isinstance(original, EigenFitterConfig):
+            raise ValueError("Only Eigen reporters can be refit")
+
+        paths = sorted(
+            (source_dir / "reporters").glob("layer_*.safetensors"),
+            key=lambda path: int(path.stem.removeprefix("layer_")),
+        )
+        if not paths:
+            raise ValueError(
+                f"No reporter statistics found in {source_dir}; was the original run "
+                "trained with --save_reporter_stats?"
+            )
+
+        changes = {
+            name: value
+            for name in ("var_weight", "neg_cov_weight", "num_heads", "eigen_solver")
+            if (value := getattr(self, name)) is not None
+        }
+        net = replace(original, **changes)
+
+        if self.out_dir is None:
+            self.out_dir = memorably_named_dir(source_dir / "refits")
+
+        print(f"Output directory at \033[1m{self.out_dir}\033[0m")
+        reporter_dir = self.out_dir / "reporters"
+        reporter_dir.mkdir(parents=True, exist_ok=True)
+        save(net, reporter_dir / "cfg.yaml", save_dc_types=True)
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        for path in paths:
+            reporter = refit_reporter(net, load_file(path), device)
+            torch.save(reporter.to("cpu"), reporter_dir / f"{path.stem}.pt")
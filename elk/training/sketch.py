@@ -0,0 +1,485 @@
+"""Low-memory sketched statistics for fitting reporters on very wide models."""
+
+import math
+from dataclasses import dataclass, replace
+
+import torch
+from concept_erasure import LeaceEraser
+from einops import rearrange
+from torch import Tensor
+
+from .common import Reporter
+from .eigen_reporter import EigenFitterConfig, top_eigenvectors
+
+
+class FrequentDirections:
+    """Streaming low-rank sketch of the Gram matrix `X^T X` of a stream of rows `X`.
+
+    Implements the Frequent Directions algorithm of Liberty (2013) as analyzed by
+    Ghashami et al. (2016) https://arxiv.org/abs/1501.01711. The sketch `B` has at
+    most `2 * rank` rows and, in the Loewner order, satisfies
+    `0 <= X^T X - B^T B <= ||X - X_j||_F^2 / (rank - j)` for every `j < rank`, where
+    `X_j` is the best rank `j` approximation of `X`. Memory usage is `O(rank * dim)`
+    regardless of the number of rows.
+
+    Args:
+        dim: The number of columns of `X`.
+        rank: The number of directions to keep.
+
+    Attributes:
+        buffer: The `[2 * rank, dim]` buffer holding the rows of the sketch.
+        num_rows: The number of rows of `buffer` currently in use.
+        total: The squared Frobenius norm of all the rows seen so far.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        rank: int,
+        *,
+        device: str | torch.device | None = None,
+        dtype: torch.dtype | None = None,
+    ):
+        if rank <= 0:
+            raise ValueError("rank must be positive")
+
+        self.dim = dim
+        self.rank = min(rank, dim)
+        self.buffer = torch.zeros(2 * self.rank, dim, device=device, dtype=dtype)
+        self.num_rows = 0
+        self.total = torch.zeros((), device=device, dtype=dtype)
+
+    @property
+    def sketch(self) -> Tensor:
+        """The rows `B` of the sketch."""
+        return self.buffer[: self.num_rows]
+
+    @torch.no_grad()
+    def update(self, x: Tensor) -> None:
+        """Add the rows of `x`, of shape `[..., dim]`, to the sketch."""
+        x = x.reshape(-1, self.dim).type_as(self.buffer)
+        self.total += x.square().sum()
+
+        while len(x):
+            free = len(self.buffer) - self.num_rows
+            chunk, x = x[:free], x[free:]
+
+            self.buffer[self.num_rows : self.num_rows + len(chunk)] = chunk
+            self.num_rows += len(chunk)
+            if self.num_rows == len(self.buffer):
+                self._shrink()
+
+    def _shrink(self) -> None:
+        """Shrink the buffer down to `rank` rows."""
+        _, S, Vh = torch.linalg.svd(self.sketch, full_matrices=False)
+
+        # Subtract the (rank + 1)th squared singular value from all the others
+        S2 = S[: self.rank].square()
+        if len(S) > self.rank:
+            S2 -= S[self.rank].square()
+
+        self.buffer[: self.rank] = S2.clamp_min(0.0).sqrt()[:, None] * Vh[: self.rank]
+        self.buffer[self.rank :] = 0.0
+        self.num_rows = self.rank
+
+
+def _low_rank_plus_diag(
+    sketch: FrequentDirections, n: int | Tensor, mean: Tensor | None = None
+) -> tuple[Tensor, Tensor, Tensor]:
+    """Approximate the covariance `B^T B / n - mean mean^T` of a sketched stream as
+    `V^T diag(L) V + sigma2 * (I - V^T V)`, with orthonormal rows `V`.
+
+    The residual variance `sigma2` is spread evenly over the directions that the
+    sketch doesn't capture, so that the trace matches the exact covariance trace.
+    """
+    B = sketch.sketch
+    trace = sketch.total / n
+
+    if mean is not None:
+        B = torch.cat([B, mean[None]])
+        trace = trace - mean.square().sum()
+
+    # Eigendecomposition of the small core matrix in an orthonormal basis for the rows
+    U, _ = torch.linalg.qr(B.mT)
+    BU = sketch.sketch @ U
+    core = BU.mT @ BU / n
+    if mean is not None:
+        m = U.mT @ mean
+        core -= m[:, None] * m[None]
+
+    L, E = torch.linalg.eigh(core)
+    V = (U @ E).mT
+
+    # Keep at most `rank` directions so the residual has somewhere to go
+    L, V = L[-sketch.rank :], V[-sketch.rank :]
+
+    d = sketch.dim
+    sigma2 = (trace - L.clamp_min(0.0).sum()) / max(d - len(L), 1)
+    sigma2 = sigma2.clamp_min(torch.finfo(L.dtype).tiny)
+    return L.clamp_min(sigma2), V, sigma2
+
+
+class SketchedLeaceFitter:
+    """Fits a LEACE eraser using a low-rank sketch of the covariance of X.
+
+    Drop-in replacement for `concept_erasure.LeaceFitter` that uses `O(rank * x_dim)`
+    memory. The cross-covariance of X and Z is tracked exactly, while the covariance
+    of X is approximated by its top `rank` eigenpairs, estimated with Frequent
+    Directions, plus an isotropic component for the remaining variance. Since the
+    whitening and unwhitening matrices are always exact inverses of each other, the
+    resulting eraser still guarantees that the class-conditional means of the erased
+    representation are equal; only its optimality is approximate. Unlike
+    `LeaceFitter`, no shrinkage or trace constraint is applied.
+
+    Args:
+        x_dim: Dimensionality of the representation.
+        z_dim: Dimensionality of the concept.
+        rank: The number of directions of the covariance of X to keep.
+        svd_tol: Singular values of the whitened cross-covariance under this
+            threshold are truncated.
+    """
+
+    mean_x: Tensor
+    """Running mean of X."""
+
+    mean_z: Tensor
+    """Running mean of Z."""
+
+    sigma_xz_: Tensor
+    """Unnormalized cross-covariance matrix X^T Z."""
+
+    n: Tensor
+    """Number of X samples seen so far."""
+
+    shift: Tensor | None
+    """Mean of the first batch of X, subtracted before sketching for stability."""
+
+    def __init__(
+        self,
+        x_dim: int,
+        z_dim: int,
+        rank: int,
+        *,
+        device: str | torch.device | None = None,
+        dtype: torch.dtype | None = None,
+        svd_tol: float = 0.01,
+    ):
+        self.x_dim = x_dim
+        self.z_dim = z_dim
+        self.svd_tol = svd_tol
+
+        self.mean_x = torch.zeros(x_dim, device=device, dtype=dtype)
+        self.mean_z = torch.zeros(z_dim, device=device, dtype=dtype)
+        self.n = torch.tensor(0, device=device, dtype=dtype)
+        self.sigma_xz_ = torch.zeros(x_dim, z_dim, device=device, dtype=dtype)
+
+        self.shift = None
+        self.sketch = FrequentDirections(x_dim, rank, device=device, dtype=dtype)
+        self._eraser = None
+
+    @torch.no_grad()
+    def update(self, x: Tensor, z: Tensor) -> "SketchedLeaceFitter":
+        """Update the running statistics with a new batch of data."""
+        d, c = self.sigma_xz_.shape
+        x = x.reshape(-1, d).type_as(self.mean_x)
+        n, d2 = x.shape
+
+        assert d == d2, f"Unexpected number of features {d2}"
+        self.n += n
+        self._eraser = None
+
+        if self.shift is None:
+            self.shift = x.mean(dim=0)
+        self.sketch.update(x - self.shift)
+
+        # Welford's online algorithm
+        delta_x = x - self.mean_x
+        self.mean_x += delta_x.sum(dim=0) / self.n
+
+        z = z.reshape(n, -1).type_as(x)
+        assert z.shape[-1] == c, f"Unexpected number of classes {z.shape[-1]}"
+
+        delta_z = z - self.mean_z
+        self.mean_z += delta_z.sum(dim=0) / self.n
+        delta_z2 = z - self.mean_z
+
+        # Update the cross-covariance matrix
+        self.sigma_xz_.addmm_(delta_x.mT, delta_z2)
+
+        return self
+
+    @property
+    def sigma_xz(self) -> Tensor:
+        """The cross-covariance matrix."""
+        assert self.n > 1, "Call update() with labels before accessing sigma_xz"
+        return self.sigma_xz_ / (self.n - 1)
+
+    @property
+    def eraser(self) -> LeaceEraser:
+        """Erasure function computed from the current statistics."""
+        if self._eraser is not None:
+            return self._eraser
+
+        assert self.shift is not None, "Call update() before accessing the eraser"
+        L, V, sigma2 = _low_rank_plus_diag(
+            self.sketch, self.n, self.mean_x - self.shift
+        )
+
+        def whiten(M: Tensor, power: float) -> Tensor:
+            """Multiply `M` by the `power`th power of the covariance matrix."""
+            coef = L.pow(power) - sigma2.pow(power)
+            return V.mT @ (coef[:, None] * (V @ M)) + sigma2.pow(power) * M
+
+        u, s, _ = torch.linalg.svd(whiten(self.sigma_xz, -0.5), full_matrices=False)
+
+        # Throw away singular values that are too small
+        u *= s > self.svd_tol
+
+        self._eraser = LeaceEraser(whiten(u, 0.5), whiten(u, -0.5).mT, bias=self.mean_x)
+        return self._eraser
+
+
+@dataclass(frozen=True)
+class SketchedVincOperator:
+    """Matrix-free VINC matrix `P @ A @ P.mT` with a low-rank plus identity `A`.
+
+    Here `A = identity_weight * I + factors.mT @ diag(coefs) @ factors` and
+    `P = I - proj_left @ proj_right` is the LEACE projection matrix. Implements the
+    same `ScalableOperator` interface as `VincOperator`, so it can be passed to
+    `top_eigenvectors`.
+    """
+
+    identity_weight: Tensor
+    """The weight of the identity matrix in `A`."""
+
+    factors: Tensor
+    """The `[m, d]` rows of the low-rank part of `A`."""
+
+    coefs: Tensor
+    """The `[m]` weights of the rows of `factors`."""
+
+    proj_left: Tensor
+    """Left factor of the LEACE projection, of shape `[d, r]`."""
+
+    proj_right: Tensor
+    """Right factor of the LEACE projection, of shape `[r, d]`."""
+
+    @property
+    def shape(self) -> torch.Size:
+        d = self.factors.shape[-1]
+        return torch.Size([d, d])
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return self.factors.dtype
+
+    @property
+    def device(self) -> torch.device:
+        return self.factors.device
+
+    def norm_bound(self) -> Tensor:
+        """Upper bound on the Frobenius norm of `A`."""
+        low_rank = self.coefs.abs() @ self.factors.square().sum(-1)
+        return self.identity_weight.abs() * math.sqrt(self.shape[-1]) + low_rank
+
+    def scale(self, factor: Tensor) -> "SketchedVincOperator":
+        """Return the operator multiplied by the scalar `factor`."""
+        return replace(
+            self,
+            identity_weight=self.identity_weight * factor,
+            coefs=self.coefs * factor,
+        )
+
+    def matvec(self, x: Tensor) -> Tensor:
+        # x <- P^T x
+        x = x - (x @ self.proj_left) @ self.proj_right
+
+        # y <- A x
+        y = (
+            self.identity_weight * x
+            + (self.coefs * (x @ self.factors.mT)) @ self.factors
+        )
+
+        # y <- P y
+        return y - (y @ self.proj_right.mT) @ self.proj_left.mT
+
+    def to_dense(self) -> Tensor:
+        d = self.shape[-1]
+        eye = torch.eye(d, device=self.device, dtype=self.dtype)
+
+        A = self.identity_weight * eye + self.factors.mT @ (
+            self.coefs[:, None] * self.factors
+        )
+        P = eye - self.proj_left @ self.proj_right
+        return P @ A @ P.mT
+
+
+class SketchedEigenFitter:
+    """Fit a linear reporter with eigendecomposition of sketched statistics.
+
+    Low-memory counterpart of `EigenFitter` for very wide models. Instead of keeping
+    dense `d x d` accumulators, the inter-cluster covariance and contrastive
+    cross-covariance are reconstructed from Frequent Directions sketches of the class
+    centroids and of their sums across classes, together with the exact class means.
+    The intra-cluster covariance is sketched as well, with its residual variance
+    spread isotropically over the directions the sketch doesn't capture, and LEACE is
+    fit with a `SketchedLeaceFitter`. Memory usage is `O(sketch_rank * d)`.
+
+    The sketch captures the directions of largest variance, so the reporter is
+    accurate whenever the top eigenvectors of the VINC matrix lie mostly within them,
+    as is the case when the truth direction has high variance across examples.
+
+    Args:
+        cfg: The reporter configuration. `cfg.sketch_rank` must be set.
+        in_features: The number of input features.
+        num_classes: The number of classes for tracking the running means.
+    """
+
+    config: EigenFitterConfig
+
+    n: Tensor
+    class_means: Tensor
+    class_shift: Tensor | None
+
+    def __init__(
+        self,
+        cfg: EigenFitterConfig,
+        in_features: int,
+        num_classes: int = 2,
+        *,
+        device: str | torch.device | None = None,
+        dtype: torch.dtype | None = None,
+        num_variants: int = 1,
+    ):
+        if cfg.sketch_rank is None:
+            raise ValueError("SketchedEigenFitter requires cfg.sketch_rank to be set")
+
+        self.config = cfg
+        self.in_features = in_features
+        self.num_classes = num_classes
+        self.num_variants = num_variants
+
+        rank = cfg.sketch_rank
+        self.leace = SketchedLeaceFitter(
+            in_features,
+            num_classes * num_variants if cfg.erase_prompts else num_classes,
+            rank,
+            device=device,
+            dtype=dtype,
+        )
+
+        # Running statistics
+        self.n = torch.zeros((), device=device, dtype=torch.long)
+        self.class_means = torch.zeros(
+            num_classes, in_features, device=device, dtype=dtype
+        )
+        self.class_shift = None
+        self.num_intra_rows = 0
+
+        kwargs = dict(device=device, dtype=dtype)
+        self.centroid_sketch = FrequentDirections(in_features, rank, **kwargs)
+        self.sum_sketch = FrequentDirections(in_features, rank, **kwargs)
+        self.intra_sketch = FrequentDirections(in_features, rank, **kwargs)
+
+    @torch.no_grad()
+    def update(self, hiddens: Tensor) -> None:
+        (n, v, k, d) = hiddens.shape
+
+        # Sanity checks
+        assert k > 1, "Must provide at least two hidden states"
+        assert hiddens.ndim == 4, "Must be of shape [batch, variants, choices, dim]"
+
+        self.n += n
+
+        if self.config.erase_prompts:
+            # Independent indicator for each (template, pseudo-label) pair
+            indicators = torch.eye(k * v, device=hiddens.device).expand(n, -1, -1)
+        else:
+            # Only use indicators for each pseudo-label
+            indicators = torch.eye(k, device=hiddens.device).expand(n, v, -1, -1)
+
+        self.leace.update(x=hiddens, z=indicators)
+
+        # *** Invariance (intra-cluster) ***
+        # Sketch the deviations of each variant from its cluster mean
+        self.intra_sketch.update(hiddens - hiddens.mean(dim=1, keepdim=True))
+        self.num_intra_rows += n * v * k
+
+        # *** Variance and negative covariance (inter-cluster) ***
+        centroids = hiddens.mean(1)
+        if self.class_shift is None:
+            self.class_shift = centroids.mean(dim=0)
+
+        delta = centroids - self.class_means
+        self.class_means += delta.sum(dim=0) / self.n
+
+        shifted = centroids - self.class_shift
+        self.centroid_sketch.update(rearrange(shifted, "n k d -> (n k) d"))
+        self.sum_sketch.update(shifted.sum(dim=1))
+
+    def vinc_operator(self) -> SketchedVincOperator:
+        """The VINC matrix reconstructed from the current sketches, after removing
+        the subspace responsible for pseudolabel correlations."""
+        assert self.class_shift is not None, "Call update() before fitting"
+
+        cfg = self.config
+        n = self.n.item()
+        k = self.num_classes
+
+        # Weights of the inter-cluster covariance, intra-cluster covariance and
+        # contrastive cross-covariance in the VINC matrix
+        w_var = cfg.var_weight / k
+        w_inv = -(1 - cfg.neg_cov_weight)
+        w_neg = -cfg.neg_cov_weight / (k * (k - 1))
+
+        # Both covariances are shift-invariant, so we can work with shifted means.
+        # inter-cluster = (sum_i E[c_i^T c_i] - m_i^T m_i) / k
+        # contrastive = (E[S^T S] - sum_i E[c_i^T c_i] - s^T s + sum_i m_i^T m_i)
+        #     / (k (k - 1)), where S = sum_i c_i and s = sum_i m_i
+        means = self.class_means - self.class_shift
+        L_intra, V_intra, sigma2 = _low_rank_plus_diag(
+            self.intra_sketch, self.num_intra_rows
+        )
+
+        factors = [
+            self.centroid_sketch.sketch,
+            self.sum_sketch.sketch,
+            means,
+            means.sum(dim=0, keepdim=True),
+            V_intra,
+        ]
+        coefs = [
+            torch.full_like(factors[0][:, 0], (w_var - w_neg) / n),
+            torch.full_like(factors[1][:, 0], w_neg / n),
+            torch.full_like(factors[2][:, 0], w_neg - w_var),
+            torch.full_like(factors[3][:, 0], -w_neg),
+            w_inv * (L_intra - sigma2),
+        ]
+
+        eraser = self.leace.eraser
+        return SketchedVincOperator(
+            w_inv * sigma2,
+            torch.cat(factors),
+            torch.cat(coefs),
+            eraser.proj_left,
+            eraser.proj_right,
+        )
+
+    def fit_streaming(self) -> Reporter:
+        """Fit the probe using the current sketched statistics."""
+        Q = top_eigenvectors(
+            self.vinc_operator(),
+            self.config.num_heads,
+            self.config.eigen_solver,
+            seed=self.config.seed,
+        )
+        return Reporter(Q.T, self.leace.eraser)
+
+    def fit(self, hiddens: Tensor) -> Reporter:
+        """Fit the probe to the contrast set `hiddens`.
+
+        Args:
+            hiddens: The contrast set of shape [batch, variants, choices, dim].
+        """
+        self.update(hiddens)
+        return self.fit_streaming()
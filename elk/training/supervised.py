@@ -1,15 +1,17 @@
+from typing import Iterable, Literal
+
 import torch
 from einops import rearrange, repeat
+from torch import Tensor
 
 from ..metrics import to_one_hot
-from .classifier import Classifier
+from .classifier import Classifier, RidgeFitter
 
 
-def train_supervised(
-    data: dict[str, tuple], device: str, mode: str
-) -> list[Classifier]:
+def flatten_supervised_data(data: dict[str, tuple]) -> tuple[Tensor, Tensor]:
+    """Concatenate the hidden states of all the datasets into one (N, D) matrix, with
+    a binary label for each row saying whether it's the true answer."""
     Xs, train_labels = [], []
-
     for train_h, labels, _ in data.values():
         (_, v, k, _) = train_h.shape
         train_h = rearrange(train_h, "n v k d -> (n v k) d")
@@ -20,16 +22,50 @@ def train_supervised(
         Xs.append(train_h)
         train_labels.append(labels)
 
-    X, train_labels = torch.cat(Xs), torch.cat(train_labels)
+    return torch.cat(Xs), torch.cat(train_labels)
+
+
+def train_ridge(batches: Iterable[tuple[Tensor, Tensor]], device: str) -> Classifier:
+    """Fit a ridge classifier from batches of `[n, v, k, d]` hidden states and their
+    `[n]` labels, accumulating the statistics one batch at a time without
+    concatenating."""
+    fitter = None
+    for train_h, labels in batches:
+        (_, v, k, d) = train_h.shape
+        fitter = fitter or RidgeFitter(d, device=device, dtype=train_h.dtype)
+
+        labels = to_one_hot(repeat(labels, "n -> (n v)", v=v), k).flatten()
+        fitter.update(rearrange(train_h, "n v k d -> (n v k) d"), labels)
+
+    assert fitter is not None, "No training data"
+    return fitter.fit()
+
+
+def train_supervised(
+    data: dict[str, tuple],
+    device: str,
+    mode: str,
+    warm_start: list[Classifier] | None = None,
+    solver: Literal["lbfgs", "irls"] = "lbfgs",
+) -> list[Classifier]:
+    if mode == "ridge":
+        return [train_ridge(((h, y) for h, y, _ in data.values()), device)]
+
+    X, train_labels = flatten_supervised_data(data)
+
+    # Start from the previous solution if there is one, except for INLP, whose
+    # classifiers are fit to successively projected data
+    lr_model = Classifier(X.shape[-1], device=device)
+    if warm_start and mode != "inlp":
+        lr_model.load_state_dict(warm_start[0].state_dict())
+
     if mode == "cv":
-        lr_model = Classifier(X.shape[-1], device=device)
-        lr_model.fit_cv(X, train_labels)
+        lr_model.fit_cv(X, train_labels, solver=solver)
         return [lr_model]
     elif mode == "inlp":
-        return Classifier.inlp(X, train_labels).classifiers
+        return Classifier.inlp(X, train_labels, solver=solver).classifiers
     elif mode == "single":
-        lr_model = Classifier(X.shape[-1], device=device)
-        lr_model.fit(X, train_labels)
+        lr_model.fit(X, train_labels, solver=solver)
         return [lr_model]
     else:
         raise ValueError(f"Unknown mode: {mode}")
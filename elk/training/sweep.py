@@ -117,7 +117,8 @@ class Sweep:
         )
 
         step = self.hparam_step
-        weights = np.arange(0.0, 1.0 + step, step) if step > 0 else [None]
+        # Round to the nearest grid that ends exactly at 1; np.arange can overshoot
+        weights = np.linspace(0.0, 1.0, round(1 / step) + 1) if step > 0 else []
 
         for i, model in enumerate(self.models):
             print(colorize(f"===== {model} ({i + 1} of {M}) =====", "magenta"))
@@ -128,52 +129,51 @@ class Sweep:
                 # single sweep.
                 train_datasets = tuple(ds.strip() for ds in dataset_str.split("+"))
 
-                for var_weight in weights:
-                    for neg_cov_weight in weights:
-                        out_dir = sweep_dir / model / dataset_str
-
-                        data = replace(
-                            self.run_template.data, model=model, datasets=train_datasets
-                        )
-                        run = replace(self.run_template, data=data, out_dir=out_dir)
-                        if var_weight is not None and neg_cov_weight is not None:
-                            assert isinstance(run.net, EigenFitterConfig)
-                            run.net.var_weight = var_weight
-                            run.net.neg_cov_weight = neg_cov_weight
-
-                            # Add hyperparameter values to output directory if needed
-                            assert run.out_dir is not None
-                            run.out_dir /= f"var_weight={var_weight:.2f}"
-                            run.out_dir /= f"neg_cov_weight={neg_cov_weight:.2f}"
-
-                        try:
-                            run.execute()
-                        except torch.linalg.LinAlgError as e:
-                            print(colorize(f"LinAlgError: {e}", "red"))
+                # Every point of the hyperparameter grid is solved from the same
+                # statistics in a single run, and saved in its own subdirectory
+                data = replace(
+                    self.run_template.data, model=model, datasets=train_datasets
+                )
+                run = replace(
+                    self.run_template,
+                    data=data,
+                    out_dir=sweep_dir / model / dataset_str,
+                    hparam_grid=tuple(float(w) for w in weights),
+                )
+
+                try:
+                    run.execute()
+                except torch.linalg.LinAlgError as e:
+                    print(colorize(f"LinAlgError: {e}", "red"))
+                    continue
+
+                if self.skip_transfer_eval:
+                    continue
+
+                if len(eval_datasets) > 1:
+                    print(colorize("== Transfer eval ==", "green"))
+
+                runs = run.grid_runs().values() if run.hparam_grid else [run]
+                for grid_run in runs:
+                    # Now evaluate the reporter on the other datasets
+                    for eval_dataset in eval_datasets:
+                        # We already evaluated on this one during training
+                        if eval_dataset in train_datasets:
                             continue
 
-                        if not self.skip_transfer_eval:
-                            if len(eval_datasets) > 1:
-                                print(colorize("== Transfer eval ==", "green"))
-
-                            # Now evaluate the reporter on the other datasets
-                            for eval_dataset in eval_datasets:
-                                # We already evaluated on this one during training
-                                if eval_dataset in train_datasets:
-                                    continue
-
-                                assert run.out_dir is not None
-                                eval = Eval(
-                                    data=replace(
-                                        run.data, model=model, datasets=(eval_dataset,)
-                                    ),
-                                    source=run.out_dir,
-                                    out_dir=run.out_dir / "transfer" / eval_dataset,
-                                    num_gpus=run.num_gpus,
-                                    min_gpu_mem=run.min_gpu_mem,
-                                    skip_supervised=run.supervised == "none",
-                                )
-                                eval.execute(highlight_color="green")
+                        assert grid_run.out_dir is not None
+                        eval = Eval(
+                            data=replace(
+                                run.data, model=model, datasets=(eval_dataset,)
+                            ),
+                            source=grid_run.out_dir,
+                            use_token_loc=run.use_token_loc,
+                            out_dir=grid_run.out_dir / "transfer" / eval_dataset,
+                            num_gpus=run.num_gpus,
+                            min_gpu_mem=run.min_gpu_mem,
+                            skip_supervised=run.supervised == "none",
+                        )
+                        eval.execute(highlight_color="green")
 
         if self.visualize:
             visualize_sweep(sweep_dir)
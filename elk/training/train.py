@@ -1,23 +1,39 @@
 """Main training loop."""
 
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from functools import partial
 from pathlib import Path
-from typing import Literal
+from typing import Callable, Iterator, Literal
 
 import pandas as pd
 import torch
 from einops import rearrange, repeat
+from safetensors.torch import load_file, save_file
 from simple_parsing import subgroups
+from simple_parsing.helpers import field
 from simple_parsing.helpers.serialization import save
+from torch import Tensor
 
 from ..metrics import evaluate_preds, to_one_hot
 from ..run import Run
-from ..training.supervised import train_supervised
-from ..utils.typing import assert_type
+from ..training.supervised import (
+    flatten_supervised_data,
+    train_ridge,
+    train_supervised,
+)
+from ..utils import (
+    assert_type,
+    get_layer_indices,
+    int16_to_float32,
+    select_split,
+    select_usable_devices,
+)
 from .ccs_reporter import CcsConfig, CcsReporter
-from .common import FitterConfig
-from .eigen_reporter import EigenFitter, EigenFitterConfig
+from .classifier import Classifier
+from .common import FitterConfig, Reporter
+from .eigen_reporter import EigenFitter, EigenFitterConfig, MultiLayerEigenFitter
+from .sketch import SketchedEigenFitter
 
 
 @dataclass
@@ -29,10 +45,291 @@ class Elicit(Run):
     )
     """Config for building the reporter network."""
 
-    supervised: Literal["none", "single", "inlp", "cv"] = "single"
+    supervised: Literal["none", "single", "inlp", "cv", "ridge"] = "single"
     """Whether to train a supervised classifier, and if so, whether to use
     cross-validation. Defaults to "single", which means to train a single classifier
-    on the training data. "cv" means to use cross-validation."""
+    on the training data. "cv" means to use cross-validation. "ridge" is a closed-form
+    baseline computed from streaming statistics of the hidden states."""
+
+    supervised_solver: Literal["lbfgs", "irls"] = "lbfgs"
+    """The optimizer for the supervised classifiers. "irls" is Newton's method, which
+    converges in a few iterations but factors a hidden size x hidden size matrix
+    in each of them."""
+
+    fit_layers_jointly: bool = False
+    """Whether to fit the reporters of all layers at once, updating the statistics of
+    every layer from a single pass over the training data and solving them with one
+    batched eigendecomposition. The per-layer workers then only Platt scale and
+    evaluate the reporters. Only supported for the eigen reporter."""
+
+    fit_supervised_jointly: bool = False
+    """Whether to fit the supervised classifiers of all layers at once, stacking the
+    training hidden states of every layer into one `[layers, examples, dim]` tensor
+    and fitting a classifier to each layer with a single batched L-BFGS optimization.
+    The per-layer workers then only evaluate and save the classifiers. Only supported
+    for `supervised="single"`, and needs the hidden states of all layers to fit in
+    memory at once."""
+
+    hparam_grid: tuple[float, ...] = ()
+    """Values of `var_weight` and `neg_cov_weight` to sweep over. If nonempty, an
+    eigen reporter is fit for every pair of values from the same statistics, in place
+    of the reporter for `net`. Each one is saved along with its evaluation results in
+    `var_weight=.../neg_cov_weight=...` under the output directory."""
+
+    cv_folds: int = 0
+    """If nonzero, also estimate the out-of-sample performance of the eigen reporter
+    with k-fold cross-validation on the training set, writing the results for each
+    held-out fold to `cv_eval.csv`. The statistics of each fold are accumulated in
+    the same pass over the data as the full reporter, and the reporter for each fold
+    is solved from the merged statistics of the other folds."""
+
+    warm_start: bool = False
+    """Whether to train the layers one at a time in order, initializing the CCS
+    reporter and the supervised classifier of each layer from the solution for the
+    previous layer. The CCS reporter is mapped through the normalizers of both layers
+    and trained from `warm_start_tries` restarts, the first of which is the warm
+    start. The optimizer iterations of each layer are added to `eval.csv` and
+    `lr_eval.csv` as `train_iters`, and the savings over the first layer are
+    printed."""
+
+    warm_start_tries: int = 1
+    """The number of CCS restarts for warm-started layers."""
+
+    joint_reporters: dict[int, Reporter] = field(
+        default_factory=dict, init=False, to_dict=False
+    )
+    """Reporters fit by `fit_layers()`, stored on the CPU and keyed by layer."""
+
+    joint_lr_models: dict[int, list[Classifier]] = field(
+        default_factory=dict, init=False, to_dict=False
+    )
+    """Classifiers fit by `fit_supervised_layers()`, stored on the CPU and keyed by
+    layer."""
+
+    warm_reporter: CcsReporter | None = field(default=None, init=False, to_dict=False)
+    """The CCS reporter of the previous layer, if `warm_start` is set."""
+
+    warm_lr_models: list[Classifier] = field(
+        default_factory=list, init=False, to_dict=False
+    )
+    """The supervised classifiers of the previous layer, if `warm_start` is set."""
+
+    first_iters: dict[str, int] = field(default_factory=dict, init=False, to_dict=False)
+    """Optimizer iterations of the first layer, to compare warm starts against."""
+
+    def __post_init__(self):
+        if self.fit_layers_jointly:
+            if not isinstance(self.net, EigenFitterConfig):
+                raise ValueError("fit_layers_jointly is only supported for eigen")
+            if self.net.sketch_rank is not None:
+                raise ValueError("fit_layers_jointly doesn't support sketch_rank")
+        if self.fit_supervised_jointly:
+            if self.supervised != "single":
+                raise ValueError(
+                    "fit_supervised_jointly is only supported for supervised=single"
+                )
+            if self.supervised_solver != "lbfgs" or self.warm_start:
+                raise ValueError(
+                    "fit_supervised_jointly doesn't support the irls solver or "
+                    "warm_start"
+                )
+        if self.hparam_grid:
+            if not isinstance(self.net, EigenFitterConfig):
+                raise ValueError("hparam_grid is only supported for eigen")
+            if self.net.sketch_rank is not None or self.fit_layers_jointly:
+                raise ValueError(
+                    "hparam_grid doesn't support sketch_rank or fit_layers_jointly"
+                )
+            if not all(0 <= w <= 1 for w in self.hparam_grid):
+                raise ValueError("hparam_grid values must be in [0, 1]")
+        if self.cv_folds:
+            if self.cv_folds < 2:
+                raise ValueError("cv_folds must be at least 2")
+            if not isinstance(self.net, EigenFitterConfig):
+                raise ValueError("cv_folds is only supported for eigen")
+            if self.net.sketch_rank is not None or self.fit_layers_jointly:
+                raise ValueError(
+                    "cv_folds doesn't support sketch_rank or fit_layers_jointly"
+                )
+            if self.hparam_grid:
+                raise ValueError("cv_folds doesn't support hparam_grid")
+        if self.warm_start_tries < 1:
+            raise ValueError("warm_start_tries must be at least 1")
+        if self.streaming and self.supervised not in ("none", "ridge"):
+            raise ValueError(
+                "With net.batch_size, the supervised classifier must be 'ridge' or "
+                "'none', since the others need the whole training set in memory"
+            )
+
+    @property
+    def streaming(self) -> bool:
+        """Whether the training hidden states are streamed in batches instead of
+        being loaded into memory, which is the case for CCS with `batch_size`."""
+        return isinstance(self.net, CcsConfig) and bool(self.net.batch_size)
+
+    def grid_runs(self) -> dict[str, "Elicit"]:
+        """The run for each pair of values in `hparam_grid`, keyed by the name of its
+        output directory relative to `out_dir`."""
+        assert isinstance(self.net, EigenFitterConfig)
+        out_dir = assert_type(Path, self.out_dir)
+
+        runs = {}
+        for var_weight in self.hparam_grid:
+            for neg_cov_weight in self.hparam_grid:
+                subdir = (
+                    f"var_weight={var_weight:.2f}/neg_cov_weight={neg_cov_weight:.2f}"
+                )
+                net = replace(
+                    self.net, var_weight=var_weight, neg_cov_weight=neg_cov_weight
+                )
+                runs[subdir] = replace(
+                    self, net=net, hparam_grid=(), out_dir=out_dir / subdir
+                )
+
+        return runs
+
+    def cross_validate(
+        self,
+        fitters: list[EigenFitter],
+        train_dict: dict[str, tuple[Tensor, Tensor, Tensor | None]],
+        fold_ids: dict[str, Tensor],
+        layer: int,
+    ) -> list[dict]:
+        """Evaluate reporters fit without each fold of the training data on the
+        held-out fold.
+
+        Args:
+            fitters: For each fold, a fitter with the statistics of the other folds.
+            train_dict: The training data of each dataset, from `prepare_data()`.
+            fold_ids: The fold of each training example, for each dataset.
+            layer: The layer the reporters are fit on.
+
+        Returns:
+            The evaluation rows of every held-out fold.
+        """
+        rows = []
+        for i, fitter in enumerate(fitters):
+            reporter = fitter.fit_streaming()
+
+            hidden_list, label_list = [], []
+            for ds_name, (train_h, train_gt, _) in train_dict.items():
+                mask = fold_ids[ds_name] != i
+                (_, v, k, _) = train_h.shape
+
+                hidden_list.append(rearrange(train_h[mask], "n v k d -> (n v k) d"))
+                label_list.append(
+                    to_one_hot(repeat(train_gt[mask], "n -> (n v)", v=v), k).flatten()
+                )
+
+            reporter.platt_scale(torch.cat(label_list), torch.cat(hidden_list))
+
+            for ds_name, (train_h, train_gt, _) in train_dict.items():
+                mask = fold_ids[ds_name] == i
+                credences = reporter(train_h[mask])
+                for mode in ("none", "partial", "full"):
+                    rows.append(
+                        {
+                            "dataset": ds_name,
+                            "layer": layer,
+                            "ensembling": mode,
+                            "fold": i,
+                            **evaluate_preds(train_gt[mask], credences, mode).to_dict(),
+                        }
+                    )
+
+        return rows
+
+    def labeled_train_batches(
+        self, layer: int, device: str, batch_size: int, shuffle: bool = True
+    ) -> Iterator[tuple[str, Tensor, Tensor]]:
+        """Read the training hidden states of `layer` and their labels lazily, in
+        batches of up to `batch_size` consecutive examples from each dataset.
+
+        Yields the name of the dataset, the hidden states and the labels of each
+        batch. If `shuffle` is set, the order of the batches is shuffled, but their
+        contents are not. Otherwise the batches are in the order of the datasets.
+        """
+        column = self.layer_column(layer)
+        splits = [
+            (
+                ds_name,
+                ds[select_split(ds, "train")].with_format(
+                    "torch", device=device, dtype=torch.int16
+                ),
+            )
+            for ds_name, ds in self.datasets
+        ]
+        starts = [
+            (ds_name, split, start)
+            for ds_name, split in splits
+            for start in range(0, len(split), batch_size)
+        ]
+
+        order = torch.randperm(len(starts)).tolist() if shuffle else range(len(starts))
+        for i in order:
+            ds_name, split, start = starts[i]
+            batch = split[start : start + batch_size]
+            hiddens = int16_to_float32(assert_type(Tensor, batch[column]))
+            if self.prompt_indices:
+                hiddens = hiddens[:, self.prompt_indices]
+
+            labels = assert_type(Tensor, batch["label"])
+            yield ds_name, hiddens, labels.to(hiddens.device)
+
+    def train_batches(
+        self, layer: int, device: str, batch_size: int
+    ) -> Iterator[Tensor]:
+        """The hidden states of `labeled_train_batches()`, in shuffled order."""
+        for _, hiddens, _ in self.labeled_train_batches(layer, device, batch_size):
+            yield hiddens
+
+    def platt_scale_streaming(
+        self, reporter: CcsReporter, layer: int, device: str, batch_size: int
+    ) -> dict[str, Tensor]:
+        """Platt scale `reporter` on the training data of `layer`, read in batches.
+
+        Only the scores of the reporter are kept in memory, not the hidden states.
+
+        Returns:
+            The Platt scaled credences of the training examples of each dataset, of
+            shape `[n, v, k]`.
+        """
+        scores, labels = defaultdict(list), defaultdict(list)
+        with torch.no_grad():
+            for ds_name, hiddens, gt in self.labeled_train_batches(
+                layer, device, batch_size, shuffle=False
+            ):
+                (_, v, k, _) = hiddens.shape
+                scores[ds_name].append(reporter(hiddens))
+                labels[ds_name].append(repeat(to_one_hot(gt, k), "n k -> n v k", v=v))
+
+        credences = {ds_name: torch.cat(s) for ds_name, s in scores.items()}
+        scaled = reporter.platt_scale_scores(
+            torch.cat([torch.cat(y).flatten() for y in labels.values()]),
+            torch.cat([c.flatten() for c in credences.values()]),
+        )
+        return {
+            ds_name: s.view_as(c)
+            for (ds_name, c), s in zip(
+                credences.items(),
+                scaled.split([c.numel() for c in credences.values()]),
+            )
+        }
+
+    def report_warm_start(self, layer: int, iters: dict[str, dict[str, int]]):
+        """Print how many fewer optimizer iterations `layer` took than the first
+        layer, which was trained from scratch."""
+        msgs = []
+        for key, name in (("eval", "CCS"), ("lr_eval", "supervised")):
+            if (num_iters := iters[key].get("train_iters")) is None:
+                continue
+
+            first = self.first_iters.setdefault(key, num_iters)
+            saved = 1 - num_iters / first if first else 0.0
+            msgs.append(f"{name} {num_iters} ({saved:.0%} fewer than the first layer)")
+
+        if msgs:
+            print(f"Layer {layer} optimizer iterations: " + ", ".join(msgs))
 
     def create_models_dir(self, out_dir: Path):
         lr_dir = None
@@ -48,6 +345,120 @@ class Elicit(Run):
 
         return reporter_dir, lr_dir
 
+    def fit_layers(self, layers: list[int], device: str) -> dict[int, Reporter]:
+        """Fit Eigen reporters for all `layers` from a single pass over the data.
+
+        The hidden states of every layer are read together in chunks of examples, so
+        memory usage is bounded no matter how large the training sets are. If
+        `save_reporter_stats` is set, the statistics of each layer are saved to the
+        reporter directory.
+
+        Args:
+            layers: The layers to fit reporters for.
+            device: The device to compute the statistics on.
+
+        Returns:
+            A dictionary mapping each layer to its reporter, stored on the CPU and
+            not yet Platt scaled.
+        """
+        assert isinstance(self.net, EigenFitterConfig)
+        columns = [self.layer_column(layer) for layer in layers]
+        fitter = None
+
+        for _, ds in self.datasets:
+            split = ds[select_split(ds, "train")].with_format(
+                "torch", device=device, dtype=torch.int16
+            )
+
+            # Read roughly 1 GiB of float32 hidden states at a time
+            example_size = split[0][columns[0]].numel() * len(layers) * 4
+            chunk_size = max(1, 2**30 // example_size)
+
+            for start in range(0, len(split), chunk_size):
+                chunk = split[start : start + chunk_size]
+                hiddens = torch.stack(
+                    [int16_to_float32(assert_type(Tensor, chunk[c])) for c in columns]
+                )
+                if self.prompt_indices:
+                    hiddens = hiddens[:, :, self.prompt_indices]
+
+                if fitter is None:
+                    (_, _, v, k, d) = hiddens.shape
+                    fitter = MultiLayerEigenFitter(
+                        self.net,
+                        d,
+                        len(layers),
+                        num_classes=k,
+                        num_variants=v,
+                        device=device,
+                    )
+
+                fitter.update(hiddens)
+
+        assert fitter is not None, "No training data"
+        if self.net.save_reporter_stats:
+            reporter_dir, _ = self.create_models_dir(assert_type(Path, self.out_dir))
+            for layer, stats in zip(layers, fitter.state_dicts()):
+                save_file(stats, reporter_dir / f"layer_{layer}.safetensors")
+
+        reporters = fitter.fit_streaming()
+        return {layer: r.to("cpu") for layer, r in zip(layers, reporters)}
+
+    def fit_supervised_layers(
+        self, layers: list[int], device: str
+    ) -> dict[int, list[Classifier]]:
+        """Fit the supervised classifiers of all `layers` as one batched optimization.
+
+        The training hidden states of each layer are flattened as in
+        `train_supervised()` and stacked into a single `[layers, examples, dim]`
+        tensor, which is fit with `Classifier.fit_stacked()`.
+
+        Args:
+            layers: The layers to fit classifiers for.
+            device: The device to fit the classifiers on.
+
+        Returns:
+            A dictionary mapping each layer to a list with its classifier, stored on
+            the CPU.
+        """
+        x, labels = None, None
+        for i, layer in enumerate(layers):
+            hiddens, labels = flatten_supervised_data(
+                self.prepare_data(device, layer, "train")
+            )
+            if x is None:
+                x = hiddens.new_empty(len(layers), *hiddens.shape)
+
+            x[i] = hiddens
+
+        assert x is not None and labels is not None, "No layers to fit"
+        classifiers = Classifier.fit_stacked(x, labels)
+        return {layer: [clf.to("cpu")] for layer, clf in zip(layers, classifiers)}
+
+    def apply_to_layers(
+        self,
+        func: Callable[[int], dict[str, pd.DataFrame]],
+        num_devices: int,
+    ):
+        if self.fit_layers_jointly or self.fit_supervised_jointly:
+            layers = get_layer_indices(self.datasets[0][1])
+            devices = select_usable_devices(self.num_gpus, min_memory=self.min_gpu_mem)
+            if self.fit_layers_jointly:
+                self.joint_reporters = self.fit_layers(layers, devices[0])
+            if self.fit_supervised_jointly:
+                self.joint_lr_models = self.fit_supervised_layers(layers, devices[0])
+
+        for run in self.grid_runs().values() if self.hparam_grid else []:
+            out_dir = assert_type(Path, run.out_dir)
+            out_dir.mkdir(parents=True, exist_ok=True)
+            save(run, out_dir / "cfg.yaml", save_dc_types=True)
+
+        # Warm starts need the layers to be trained one after another in this process
+        if self.warm_start:
+            num_devices = 1
+
+        super().apply_to_layers(func=func, num_devices=num_devices)
+
     def apply_to_layer(
         self,
         layer: int,
@@ -59,10 +470,12 @@ class Elicit(Run):
         self.make_reproducible(seed=self.net.seed + layer)
         device = self.get_device(devices, world_size)
 
-        train_dict = self.prepare_data(device, layer, "train")
+        # Streamed training hidden states are never loaded all at once. They have
+        # the same shape as the validation hidden states of the same dataset.
+        train_dict = {} if self.streaming else self.prepare_data(device, layer, "train")
         val_dict = self.prepare_data(device, layer, "val")
 
-        (first_train_h, train_gt, _), *rest = train_dict.values()
+        (first_train_h, _, _), *rest = (train_dict or val_dict).values()
         (_, v, k, d) = first_train_h.shape
         if not all(other_h.shape[-1] == d for other_h, _, _ in rest):
             raise ValueError("All datasets must have the same hidden state size")
@@ -74,23 +487,90 @@ class Elicit(Run):
         if not all(other_h.shape[-2] == k for other_h, _, _ in rest):
             raise ValueError("All datasets must have the same number of classes")
 
-        reporter_dir, lr_dir = self.create_models_dir(assert_type(Path, self.out_dir))
+        runs = self.grid_runs() if self.hparam_grid else {"": self}
+        hidden_list, label_list = [], []
+        folds: list[EigenFitter] = []
+        fold_ids: dict[str, Tensor] = {}
+        streamed_credences: dict[str, Tensor] = {}
         train_loss = None
 
         if isinstance(self.net, CcsConfig):
-            assert len(train_dict) == 1, "CCS only supports single-task training"
+            net = self.net
+            if self.warm_reporter is not None:
+                net = replace(net, num_tries=self.warm_start_tries)
+
+            reporter = CcsReporter(net, d, device=device, num_variants=v)
+            if self.net.batch_size:
+                if not all(other_h.shape[1] == v for other_h, _, _ in rest):
+                    raise ValueError(
+                        "All datasets must have the same number of variants"
+                    )
+
+                batches = partial(
+                    self.train_batches, layer, device, self.net.batch_size
+                )
+                train_loss = reporter.fit_streaming(batches, self.warm_reporter)
+                streamed_credences = self.platt_scale_streaming(
+                    reporter, layer, device, self.net.batch_size
+                )
+            else:
+                assert len(train_dict) == 1, "CCS needs batch_size to pool datasets"
+                train_loss = reporter.fit(first_train_h, self.warm_reporter)
+
+                for train_h, train_gt, _ in train_dict.values():
+                    labels = repeat(to_one_hot(train_gt, k), "n k -> n v k", v=v)
+                    label_list.append(labels)
+                    hidden_list.append(train_h)
+
+                reporter.platt_scale(torch.cat(label_list), torch.cat(hidden_list))
 
-            reporter = CcsReporter(self.net, d, device=device, num_variants=v)
-            train_loss = reporter.fit(first_train_h)
-            labels = repeat(to_one_hot(train_gt, k), "n k -> n v k", v=v)
-            reporter.platt_scale(labels, first_train_h)
+            reporters = [reporter]
 
         elif isinstance(self.net, EigenFitterConfig):
-            fitter = EigenFitter(
-                self.net, d, num_classes=k, num_variants=v, device=device
-            )
+            if self.fit_layers_jointly:
+                # Already fit together with all the other layers in `fit_layers()`
+                reporters = [self.joint_reporters[layer].to(device)]
+            else:
+                fitter_cls = (
+                    SketchedEigenFitter if self.net.sketch_rank else EigenFitter
+                )
+                if self.cv_folds:
+                    # Fit the statistics of each fold, which are merged to get the
+                    # full statistics and the complement of every fold
+                    folds = [
+                        EigenFitter(
+                            self.net, d, num_classes=k, num_variants=v, device=device
+                        )
+                        for _ in range(self.cv_folds)
+                    ]
+                    for ds_name, (train_h, _, _) in train_dict.items():
+                        fold_ids[ds_name] = torch.randperm(
+                            len(train_h), device=train_h.device
+                        ) % len(folds)
+                        for i, fold in enumerate(folds):
+                            if (mask := fold_ids[ds_name] == i).any():
+                                fold.update(train_h[mask])
+
+                    fitter = EigenFitter.reduce(folds)
+                else:
+                    fitter = fitter_cls(
+                        self.net, d, num_classes=k, num_variants=v, device=device
+                    )
+                    for train_h, _, _ in train_dict.values():
+                        fitter.update(train_h)
+
+                if self.hparam_grid:
+                    assert isinstance(fitter, EigenFitter)
+                    reporters = fitter.fit_grid(
+                        [
+                            (run.net.var_weight, run.net.neg_cov_weight)
+                            for run in runs.values()
+                            if isinstance(run.net, EigenFitterConfig)
+                        ]
+                    )
+                else:
+                    reporters = [fitter.fit_streaming()]
 
-            hidden_list, label_list = [], []
             for ds_name, (train_h, train_gt, _) in train_dict.items():
                 (_, v, _, _) = train_h.shape
 
@@ -100,60 +580,87 @@ class Elicit(Run):
                 label_list.append(
                     to_one_hot(repeat(train_gt, "n -> (n v)", v=v), k).flatten()
                 )
-                fitter.update(train_h)
 
-            reporter = fitter.fit_streaming()
-            reporter.platt_scale(
-                torch.cat(label_list),
-                torch.cat(hidden_list),
-            )
+            labels, hiddens = torch.cat(label_list), torch.cat(hidden_list)
+            for reporter in reporters:
+                reporter.platt_scale(labels, hiddens)
+
+            if self.net.save_reporter_stats:
+                reporter_dir, _ = self.create_models_dir(
+                    assert_type(Path, self.out_dir)
+                )
+                stats_path = reporter_dir / f"layer_{layer}.safetensors"
+                if self.fit_layers_jointly:
+                    stats = load_file(stats_path, device=device)
+                else:
+                    stats = fitter.state_dict()
+
+                # Needed to Platt scale the reporter again in `elk refit`
+                y = labels.bool()
+                stats["label_means"] = torch.stack(
+                    [hiddens[~y].mean(0), hiddens[y].mean(0)]
+                )
+                stats["label_counts"] = torch.stack([(~y).sum(), y.sum()])
+                save_file(stats, stats_path)
         else:
             raise ValueError(f"Unknown reporter config type: {type(self.net)}")
 
-        # Save reporter checkpoint to disk
-        torch.save(reporter, reporter_dir / f"layer_{layer}.pt")
-
         # Fit supervised logistic regression model
-        if self.supervised != "none":
+        if self.fit_supervised_jointly:
+            # Already fit together with the other layers in `fit_supervised_layers()`
+            lr_models = [model.to(device) for model in self.joint_lr_models[layer]]
+        elif self.streaming and self.supervised == "ridge":
+            assert isinstance(self.net, CcsConfig) and self.net.batch_size
+            batches = self.labeled_train_batches(layer, device, self.net.batch_size)
+            lr_models = [train_ridge(((h, y) for _, h, y in batches), device)]
+        elif self.supervised != "none":
             lr_models = train_supervised(
                 train_dict,
                 device=device,
                 mode=self.supervised,
+                warm_start=self.warm_lr_models,
+                solver=self.supervised_solver,
             )
-            with open(lr_dir / f"layer_{layer}.pt", "wb") as file:
-                torch.save(lr_models, file)
         else:
             lr_models = []
 
-        row_bufs = defaultdict(list)
+        # Number of optimizer iterations, reported when warm starting
+        iters: dict[str, dict[str, int]] = defaultdict(dict)
+        if self.warm_start:
+            if isinstance(reporters[0], CcsReporter):
+                iters["eval"]["train_iters"] = reporters[0].num_iters
+                self.warm_reporter = reporters[0]
+            if lr_models and self.supervised in ("single", "cv"):
+                iters["lr_eval"]["train_iters"] = lr_models[0].num_iters
+                self.warm_lr_models = lr_models
+
+            self.report_warm_start(layer, iters)
+
+        # Rows which don't depend on the reporter are shared by all the runs
+        shared_bufs = defaultdict(list)
+        if self.cv_folds:
+            shared_bufs["cv_eval"] = self.cross_validate(
+                EigenFitter.leave_one_out(folds), train_dict, fold_ids, layer
+            )
+
+        # Labels and LM predictions of the training set, which are small enough to
+        # load even when the hidden states are streamed
+        train_labels = (
+            self.prepare_labels(device, "train")
+            if self.streaming
+            else {
+                ds_name: (gt, preds) for ds_name, (_, gt, preds) in train_dict.items()
+            }
+        )
+
         for ds_name in val_dict:
             val_h, val_gt, val_lm_preds = val_dict[ds_name]
-            train_h, train_gt, train_lm_preds = train_dict[ds_name]
+            train_gt, train_lm_preds = train_labels[ds_name]
             meta = {"dataset": ds_name, "layer": layer}
 
-            val_credences = reporter(val_h)
-            train_credences = reporter(train_h)
             for mode in ("none", "partial", "full"):
-                row_bufs["eval"].append(
-                    {
-                        **meta,
-                        "ensembling": mode,
-                        **evaluate_preds(val_gt, val_credences, mode).to_dict(),
-                        "train_loss": train_loss,
-                    }
-                )
-
-                row_bufs["train_eval"].append(
-                    {
-                        **meta,
-                        "ensembling": mode,
-                        **evaluate_preds(train_gt, train_credences, mode).to_dict(),
-                        "train_loss": train_loss,
-                    }
-                )
-
                 if val_lm_preds is not None:
-                    row_bufs["lm_eval"].append(
+                    shared_bufs["lm_eval"].append(
                         {
                             **meta,
                             "ensembling": mode,
@@ -162,7 +669,7 @@ class Elicit(Run):
                     )
 
                 if train_lm_preds is not None:
-                    row_bufs["train_lm_eval"].append(
+                    shared_bufs["train_lm_eval"].append(
                         {
                             **meta,
                             "ensembling": mode,
@@ -171,13 +678,59 @@ class Elicit(Run):
                     )
 
                 for i, model in enumerate(lr_models):
-                    row_bufs["lr_eval"].append(
+                    shared_bufs["lr_eval"].append(
                         {
                             **meta,
                             "ensembling": mode,
                             "inlp_iter": i,
                             **evaluate_preds(val_gt, model(val_h), mode).to_dict(),
+                            **iters["lr_eval"],
+                        }
+                    )
+
+        row_bufs = defaultdict(list)
+        for (subdir, run), reporter in zip(runs.items(), reporters):
+            reporter_dir, lr_dir = run.create_models_dir(assert_type(Path, run.out_dir))
+
+            # Save reporter checkpoint to disk
+            torch.save(reporter, reporter_dir / f"layer_{layer}.pt")
+            if lr_models:
+                with open(lr_dir / f"layer_{layer}.pt", "wb") as file:
+                    torch.save(lr_models, file)
+
+            # Results of grid runs are written to CSVs in their own directories
+            bufs = defaultdict(list, shared_bufs)
+            for ds_name in val_dict:
+                val_h, val_gt, _ = val_dict[ds_name]
+                train_gt, _ = train_labels[ds_name]
+                meta = {"dataset": ds_name, "layer": layer}
+
+                val_credences = reporter(val_h)
+                if self.streaming:
+                    train_credences = streamed_credences[ds_name]
+                else:
+                    train_credences = reporter(train_dict[ds_name][0])
+                for mode in ("none", "partial", "full"):
+                    bufs["eval"].append(
+                        {
+                            **meta,
+                            "ensembling": mode,
+                            **evaluate_preds(val_gt, val_credences, mode).to_dict(),
+                            "train_loss": train_loss,
+                            **iters["eval"],
                         }
                     )
 
+                    bufs["train_eval"].append(
+                        {
+                            **meta,
+                            "ensembling": mode,
+                            **evaluate_preds(train_gt, train_credences, mode).to_dict(),
+                            "train_loss": train_loss,
+                        }
+                    )
+
+            for name, rows in bufs.items():
+                row_bufs[str(Path(subdir) / name)] = rows
+
         return {k: pd.DataFrame(v) for k, v in row_bufs.items()}
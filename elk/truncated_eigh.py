@@ -1,4 +1,5 @@
-from typing import Literal, NamedTuple, Optional
+from functools import partial
+from typing import Callable, Literal, NamedTuple, Optional, Protocol
 
 import torch
 import torch.nn.functional as F
@@ -9,6 +10,32 @@ class ConvergenceError(Exception):
     """Raised when the Lanczos iteration fails to converge."""
 
 
+class LinearOperator(Protocol):
+    """A symmetric matrix, or batch of matrices, that is only accessed through
+    matrix-vector products. Useful when the matrix is too expensive to materialize."""
+
+    @property
+    def shape(self) -> torch.Size:
+        """The shape `[..., n, n]` of the matrix."""
+        ...
+
+    @property
+    def dtype(self) -> torch.dtype:
+        ...
+
+    @property
+    def device(self) -> torch.device:
+        ...
+
+    def matvec(self, x: Tensor) -> Tensor:
+        """Multiply the matrix by a batch of vectors `x` of shape `[..., n]`."""
+        ...
+
+    def to_dense(self) -> Tensor:
+        """Materialize the matrix as a tensor of shape `[..., n, n]`."""
+        ...
+
+
 class Eigendecomposition(NamedTuple):
     """A namedtuple containing eigenpairs of a matrix."""
 
@@ -17,7 +44,7 @@ class Eigendecomposition(NamedTuple):
 
 
 def truncated_eigh(
-    A: Tensor,
+    A: Tensor | LinearOperator,
     k: int = 1,
     *,
     max_iter: Optional[int] = None,
@@ -35,8 +62,10 @@ def truncated_eigh(
     Empirically this is faster than our Lanczos implementation for such small matrices.
 
     Args:
-        A (Tensor): The matrix or batch of matrices of shape `[..., n, n]` for which to
-            compute eigenpairs. Must be symmetric, but need not be positive definite.
+        A (Tensor | LinearOperator): The matrix or batch of matrices of shape
+            `[..., n, n]` for which to compute eigenpairs. Must be symmetric, but need
+            not be positive definite. If a `LinearOperator` is passed, the matrix is
+            only materialized when short-circuiting to `torch.linalg.eigh`.
         k (int): The number of eigenpairs to compute.
         max_iter (int, optional): The maximum number of iterations to perform.
         ncv (int, optional): The number of Lanczos vectors generated. Must be
@@ -62,7 +91,7 @@ def truncated_eigh(
     # Short circuit if the matrix is too small or if we're asked for too many
     # eigenpairs; we can't outcompete the naive method.
     if k > 10 or n <= 256:
-        L, Q = torch.linalg.eigh(A)
+        L, Q = torch.linalg.eigh(A if isinstance(A, Tensor) else A.to_dense())
         if which == "LA":
             return Eigendecomposition(L[..., -k:], Q[..., :, -k:])
         elif which == "SA":
@@ -79,11 +108,11 @@ def truncated_eigh(
         max_iter = 10 * n
 
     # Diagonal and off-diagonal elements of the tridiagonal matrix
-    alpha = A.new_zeros([*leading, ncv])
-    beta = A.new_zeros([*leading, ncv])
+    alpha = torch.zeros([*leading, ncv], dtype=A.dtype, device=A.device)
+    beta = torch.zeros([*leading, ncv], dtype=A.dtype, device=A.device)
 
     # Lanczos vector basis for the Krylov subspace
-    Q = A.new_empty([*leading, ncv, n])
+    Q = torch.empty([*leading, ncv, n], dtype=A.dtype, device=A.device)
 
     # Initialize Lanczos vector
     rng = torch.Generator(A.device)
@@ -93,7 +122,13 @@ def truncated_eigh(
     r_k = torch.randn(*leading, n, dtype=A.dtype, device=A.device, generator=rng)
 
     Q[..., 0, :] = F.normalize(r_k, dim=-1)
-    _lanczos_inner_loop(A, Q, r_k, alpha, beta, 0, ncv)
+    # From here on, we only access A through matrix-vector products
+    if isinstance(A, Tensor):
+        matvec = partial(torch.einsum, "...ij,...j->...i", A)
+    else:
+        matvec = A.matvec
+
+    _lanczos_inner_loop(matvec, Q, r_k, alpha, beta, 0, ncv)
 
     # Compute the Ritz vectors and values
     cur_iter = ncv
@@ -116,7 +151,7 @@ def truncated_eigh(
         _gram_schmidt(r_k, Q[..., :k, :])
         Q[..., k, :] = F.normalize(r_k, dim=-1)
 
-        r_k[:] = torch.einsum("...ij,...j->...i", A, Q[..., k, :])
+        r_k[:] = matvec(Q[..., k, :])
         alpha[..., k] = torch.einsum("...i,...i->...", Q[..., k, :], r_k)
         _gram_schmidt(r_k, Q[..., : k + 1, :])
 
@@ -124,7 +159,7 @@ def truncated_eigh(
         Q[..., k + 1, :] = r_k / beta[..., k, None]
 
         # Inner loop
-        _lanczos_inner_loop(A, Q, r_k, alpha, beta, k + 1, ncv)
+        _lanczos_inner_loop(matvec, Q, r_k, alpha, beta, k + 1, ncv)
 
         w, s = _solve_ritz_pairs(alpha, beta, beta_k, k, which)
         x = Q.mT @ s
@@ -154,7 +189,7 @@ def truncated_eigh(
 
     # We use the torch.autocast decorator above to speed up the algorithm, but
     # make sure the returned values are in the same dtype as the input.
-    return Eigendecomposition(w.type_as(A), x.type_as(A))
+    return Eigendecomposition(w.to(A.dtype), x.to(A.dtype))
 
 
 @torch.jit.script
@@ -210,13 +245,18 @@ def _gram_schmidt(z: Tensor, Q: Tensor, num_iter: int = 2):
         z -= torch.einsum("...ij,...i->...j", Q, proj)
 
 
-@torch.jit.script
-def _lanczos_inner_loop(A, krylov, q, alpha, beta, k: int, end: int):
-    """Step 2 of Algorithm 3 in Wu & Simon (1998)."""
+def _lanczos_inner_loop(
+    matvec: Callable[[Tensor], Tensor], krylov, q, alpha, beta, k: int, end: int
+):
+    """Step 2 of Algorithm 3 in Wu & Simon (1998).
+
+    Not scripted since TorchScript doesn't support arbitrary callables. The loop only
+    runs `ncv` times per restart, so the interpreter overhead is negligible next to the
+    matrix-vector products."""
 
     for i in range(k, end):
         # Compute the next matrix-vector product Au
-        q[:] = torch.einsum("...ij,...j->...i", A, krylov[..., i, :])
+        q[:] = matvec(krylov[..., i, :])
         alpha[..., i] = torch.einsum("...i,...i->...", krylov[..., i, :], q)
 
         # Project away from the current Krylov subspace
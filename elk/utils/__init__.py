@@ -2,6 +2,7 @@ from .data_utils import (
     get_columns_all_equal,
     get_layer_indices,
     has_multiple_configs,
+    hidden_column,
     infer_label_column,
     infer_num_classes,
     prevent_name_conflicts,
@@ -25,6 +26,7 @@ __all__ = [
     "get_columns_all_equal",
     "get_layer_indices",
     "has_multiple_configs",
+    "hidden_column",
     "infer_label_column",
     "infer_num_classes",
     "instantiate_model",
@@ -120,6 +120,15 @@ def infer_num_classes(label_feature: Any) -> int:
         )
 
 
+def hidden_column(layer: int, token_loc: str | None = None) -> str:
+    """Return the name of the column holding the hiddens of a layer.
+
+    Hiddens at the primary token location are stored in `hidden_{layer}`, and those at
+    any extra token locations in `hidden_{layer}_{token_loc}`.
+    """
+    return f"hidden_{layer}" if token_loc is None else f"hidden_{layer}_{token_loc}"
+
+
 def get_layer_indices(ds: DatasetDict) -> list[int]:
     """Return the indices of the layers from which the hiddens have been extracted."""
     # Dataset has a bunch of columns of the form "hidden_0", "hidden_1", etc.
@@ -29,6 +29,10 @@ def instantiate_model(
     device = torch.device(device)
     kwargs["device_map"] = {"": device}
 
+    # Newer versions of transformers reject `load_in_8bit` even when it's False
+    if not kwargs.get("load_in_8bit", True):
+        del kwargs["load_in_8bit"]
+
     with prevent_name_conflicts():
         model_cfg = AutoConfig.from_pretrained(model_str)
 
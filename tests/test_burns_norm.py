@@ -1,7 +1,7 @@
 import torch
 from torch import Tensor
 
-from elk.training.burns_norm import BurnsNorm
+from elk.training.burns_norm import BurnsNorm, BurnsNormFitter
 
 
 def correct_but_slow_normalization(x_all: Tensor, scale=True) -> Tensor:
@@ -38,3 +38,15 @@ def test_BurnsNorm_4d_input():
     output_4d = bn(x_all_4d)
     diff = output_4d - expected_output_4d
     assert (diff == torch.zeros_like(diff)).all()
+
+
+def test_BurnsNormFitter():
+    x_all_4d = torch.randn((100, 13, 2, 768))
+
+    fitter = BurnsNormFitter((13, 2, 768))
+    for chunk in x_all_4d.split(30):
+        fitter.update(chunk)
+
+    # Same as normalizing each side of the contrast pairs separately
+    expected = torch.stack([BurnsNorm()(x) for x in x_all_4d.unbind(2)], dim=2)
+    torch.testing.assert_close(fitter.normalizer()(x_all_4d), expected)
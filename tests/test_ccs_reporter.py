@@ -0,0 +1,238 @@
+from dataclasses import replace
+
+import pytest
+import torch
+from torch.func import functional_call
+
+from elk.training import CcsConfig, CcsReporter
+from elk.training.losses import FUSED_LOSSES, LOSSES, fused_loss
+
+
+def test_ccs_restarts():
+    torch.manual_seed(0)
+    n, v, d = 200, 3, 16
+    gt = torch.randint(0, 2, (n,))
+    x = torch.randn(n, v, 2, d)
+    x[torch.arange(n), :, gt] += torch.randn(d)
+
+    cfg = CcsConfig(optimizer="adam", num_epochs=50, num_tries=4)
+    reporter = CcsReporter(cfg, d, num_variants=v)
+    reporter.fit(x)
+
+    x_neg, x_pos = reporter.norm(x).unbind(2)
+
+    # Training the restarts together should be the same as training them one by one
+    params = reporter.init_restarts(x_neg, x_pos)
+    singles = [
+        {k: p[i, None].detach().clone() for k, p in params.items()} for i in range(4)
+    ]
+    losses = reporter.train_loop_adam(params, x_neg, x_pos)
+
+    for i, single in enumerate(singles):
+        single = {k: p.requires_grad_() for k, p in single.items()}
+        expected = reporter.train_loop_adam(single, x_neg, x_pos)
+        torch.testing.assert_close(losses[i, None], expected)
+
+
+def test_ccs_successive_halving():
+    torch.manual_seed(0)
+    n, v, d = 200, 3, 16
+    gt = torch.randint(0, 2, (n,))
+    x = torch.randn(n, v, 2, d, dtype=torch.float64)
+    x[torch.arange(n), :, gt] += torch.randn(d, dtype=torch.float64)
+
+    cfg = CcsConfig(optimizer="adam", num_epochs=60, num_tries=6)
+    reporter = CcsReporter(cfg, d, num_variants=v, dtype=torch.float64)
+    reporter.probe.double()
+    reporter.fit_norm([x])
+    x_neg, x_pos = reporter.norm(x).unbind(2)
+
+    torch.manual_seed(1)
+    params = reporter.init_restarts(x_neg, x_pos)
+    full = {k: p.detach().clone().requires_grad_() for k, p in params.items()}
+    full_losses = reporter.train_loop_adam(full, x_neg, x_pos)
+
+    # The survivor should follow the same trajectory as without pruning
+    survivor, losses = reporter.train_successive_halving(params, x_neg, x_pos)
+    assert losses.shape == (1,)
+    assert (losses >= full_losses.min()).all()
+
+    i = int((full_losses - losses).abs().argmin())
+    torch.testing.assert_close(losses, full_losses[i, None])
+    for k, p in survivor.items():
+        torch.testing.assert_close(p, full[k][i, None])
+
+
+def test_ccs_warm_start():
+    torch.manual_seed(0)
+    n, v, d = 500, 3, 64
+    gt = torch.randint(0, 2, (n,))
+    x = torch.randn(n, v, 2, d, dtype=torch.float64)
+    x[torch.arange(n), :, gt] += 2 * torch.randn(d, dtype=torch.float64)
+
+    # Hidden states of the "next layer" are a perturbed version of the first ones
+    x_next = x + 0.1 * torch.randn_like(x)
+
+    cfg = CcsConfig(num_tries=4)
+    reporters = [
+        CcsReporter(cfg, d, num_variants=v, dtype=torch.float64) for _ in range(3)
+    ]
+    for reporter in reporters:
+        reporter.probe.double()
+
+    first, cold, warm = reporters
+    first.fit(x)
+    cold_loss = cold.fit(x_next)
+    warm.config = replace(cfg, num_tries=1)
+    warm_loss = warm.fit(x_next, warm_start=first)
+
+    assert warm_loss == pytest.approx(cold_loss, rel=1e-4)
+    assert warm.num_iters < cold.num_iters / 2
+
+    # With the same normalizer, the mapped probe should compute the same function
+    warm.fit_norm([x])
+    params = warm.warm_start_params(first)
+    torch.testing.assert_close(
+        functional_call(warm.probe, params, (warm.norm(x),)), first.probe(first.norm(x))
+    )
+
+
+def test_ccs_fit_streaming():
+    torch.manual_seed(0)
+    n, v, d = 200, 3, 16
+    x = torch.randn(n, v, 2, d)
+
+    # With a single batch per epoch, minibatch training is full-batch Adam
+    cfg = CcsConfig(optimizer="adam", num_epochs=20, num_tries=3, batch_size=n)
+    torch.manual_seed(1)
+    full = CcsReporter(cfg, d, num_variants=v)
+    full_loss = full.fit(x)
+
+    torch.manual_seed(1)
+    streamed = CcsReporter(cfg, d, num_variants=v)
+    streamed_loss = streamed.fit_streaming(lambda: [x])
+
+    assert full_loss == pytest.approx(streamed_loss)
+    torch.testing.assert_close(streamed(x), full(x))
+
+    # Smaller batches should work too
+    streamed.fit_streaming(lambda: x.split(32))
+    assert streamed(x).isfinite().all()
+
+
+def test_ccs_fit_streaming_burns_other_variants():
+    torch.manual_seed(0)
+    n, d = 200, 16
+    x = torch.randn(n, 5, 2, d)
+
+    cfg = CcsConfig(
+        optimizer="adam", norm="burns", num_epochs=20, num_tries=3, batch_size=n
+    )
+    torch.manual_seed(1)
+    full = CcsReporter(cfg, d, num_variants=5)
+    full_loss = full.fit(x)
+
+    torch.manual_seed(1)
+    streamed = CcsReporter(cfg, d, num_variants=5)
+    streamed_loss = streamed.fit_streaming(lambda: [x])
+    assert streamed_loss == pytest.approx(full_loss)
+
+    # Both should work on, and normalize, data with fewer templates the same way
+    x_eval = torch.randn(30, 3, 2, d)
+    torch.testing.assert_close(streamed(x_eval), full(x_eval))
+
+
+def test_fused_loss():
+    torch.manual_seed(0)
+    logit0, logit1 = torch.randn(2, 50, 4).unbind(0)
+
+    # Every combination of the built-in losses should match the eager versions
+    loss_dict = {name: i + 1.0 for i, name in enumerate(FUSED_LOSSES)}
+    for name, coef in [*loss_dict.items(), (None, None)]:
+        losses = {name: coef} if name else loss_dict
+        expected = sum(LOSSES[k](logit0, logit1, c) for k, c in losses.items())
+        torch.testing.assert_close(fused_loss(logit0, logit1, losses), expected)
+
+
+@pytest.mark.parametrize("pre_ln", [False, True])
+def test_ccs_newton(pre_ln: bool):
+    torch.manual_seed(0)
+    n, v, d = 300, 3, 32
+    gt = torch.randint(0, 2, (n,))
+    x = torch.randn(n, v, 2, d, dtype=torch.float64)
+    x[torch.arange(n), :, gt] += torch.randn(d, dtype=torch.float64)
+
+    # Both optimizers should end at stationary points of the regularized loss, and
+    # the best restart should be equally good; the loss isn't convex, so individual
+    # restarts may settle in different basins
+    objectives = []
+    for optimizer in ("lbfgs", "newton"):
+        cfg = CcsConfig(optimizer=optimizer, num_tries=3, pre_ln=pre_ln)
+        reporter = CcsReporter(cfg, d, num_variants=v, dtype=torch.float64)
+        reporter.probe.double()
+        reporter.fit_norm([x])
+
+        x_neg, x_pos = reporter.norm(x).unbind(2)
+        torch.manual_seed(1)
+        params = reporter.init_restarts(x_neg, x_pos)
+        getattr(reporter, f"train_loop_{optimizer}")(params, x_neg, x_pos)
+
+        params = {k: p.detach().requires_grad_() for k, p in params.items()}
+        losses = reporter.restart_losses(params, x_neg, x_pos)
+        l2 = sum(p.flatten(1).square().sum(1) for p in params.values())
+        objective = losses + cfg.weight_decay * l2 / 2
+        objective.sum().backward()
+
+        grad_norm = sum(p.grad.flatten(1).square().sum(1) for p in params.values())
+        assert (grad_norm.sqrt() < 1e-6).all()
+        objectives.append(objective.detach().min())
+
+    torch.testing.assert_close(objectives[1], objectives[0], rtol=1e-6, atol=1e-8)
+
+
+def _compile_works() -> bool:
+    try:
+        return bool(torch.compile(lambda x: x + 1)(torch.zeros(1)) == 1)
+    except Exception:
+        return False
+
+
+@pytest.mark.skipif(not _compile_works(), reason="torch.compile is unavailable")
+@pytest.mark.parametrize(
+    "optimizer, batch_size", [("adam", None), ("lbfgs", None), ("adam", 50)]
+)
+def test_ccs_compile_matches_eager(optimizer: str, batch_size: int | None):
+    # In float32, rounding differences between the compiled and eager kernels can
+    # move the point where LBFGS stops on the flat CCS loss, so use float64
+    torch.manual_seed(0)
+    n, v, d = 200, 3, 16
+    gt = torch.randint(0, 2, (n,))
+    x = torch.randn(n, v, 2, d, dtype=torch.float64)
+    x[torch.arange(n), :, gt] += torch.randn(d, dtype=torch.float64)
+
+    reporters, losses = [], []
+    for compile in (False, True):
+        cfg = CcsConfig(
+            optimizer=optimizer,  # type: ignore[arg-type]
+            num_epochs=30,
+            num_tries=3,
+            batch_size=batch_size,
+            compile=compile,
+        )
+        torch.manual_seed(1)
+        reporter = CcsReporter(cfg, d, num_variants=v, dtype=torch.float64)
+        reporter.probe.double()
+        if batch_size:
+            losses.append(reporter.fit_streaming(lambda: x.split(batch_size)))
+        else:
+            losses.append(reporter.fit(x))
+
+        reporters.append(reporter)
+
+    eager, compiled = reporters
+    assert compiled.num_iters == eager.num_iters
+    assert losses[1] == pytest.approx(losses[0])
+    for (name, p), q in zip(
+        eager.probe.named_parameters(), compiled.probe.parameters()
+    ):
+        torch.testing.assert_close(q, p, msg=name)
@@ -1,8 +1,14 @@
+import pytest
 import torch
 from sklearn.datasets import make_classification
 from sklearn.linear_model import LogisticRegression
 
-from elk.training.classifier import Classifier
+from elk.training.classifier import (
+    Classifier,
+    RidgeFitter,
+    _fit_batch,
+    _irls_batch,
+)
 
 
 @torch.no_grad()
@@ -41,3 +47,207 @@ def test_classifier_roughly_same_sklearn():
     torch_pred = classifier(new_sample).sigmoid().squeeze()
 
     torch.testing.assert_close(sklearn_pred, torch_pred, atol=1e-2, rtol=1e-2)
+
+
+def test_fit_batch_matches_fit():
+    torch.manual_seed(0)
+    features, truths = make_classification(n_samples=600, n_features=20, random_state=0)
+    x, y = torch.from_numpy(features), torch.from_numpy(truths).double()
+
+    # Each model of the batch is fit on a different subset of the samples
+    masks = torch.rand(3, len(x)) < 0.7
+    weight, bias = torch.zeros(3, 1, 20, dtype=x.dtype), torch.zeros(
+        3, 1, dtype=x.dtype
+    )
+    _fit_batch(
+        x,
+        y,
+        weight,
+        bias,
+        sample_weights=masks.double(),
+        l2_penalty=0.01,
+        max_iter=1000,
+    )
+
+    # Newton's method converges much more tightly than L-BFGS, so it's the reference
+    for i, mask in enumerate(masks):
+        classifier = Classifier(input_dim=20, dtype=torch.float64)
+        classifier.fit(x[mask], y[mask], l2_penalty=0.01, solver="irls")
+        torch.testing.assert_close(
+            weight[i], classifier.linear.weight.data, atol=1e-4, rtol=1e-4
+        )
+        torch.testing.assert_close(
+            bias[i], classifier.linear.bias.data, atol=1e-4, rtol=1e-4
+        )
+
+    # Cross-validation should pick a moderate penalty, and report every penalty
+    path = Classifier(input_dim=20, dtype=torch.float64).fit_cv(x, y)
+    assert len(path.losses) == len(path.penalties) == 11
+    assert 0 < path.best_penalty < 100
+
+
+def test_irls_matches_lbfgs():
+    # Primal solver, and the dual solver with fewer samples than dimensions
+    for n_samples, l2_penalty in [(1000, 0.01), (100, 0.01)]:
+        features, truths = make_classification(
+            n_samples=n_samples, n_features=200, random_state=0
+        )
+        x, y = torch.from_numpy(features), torch.from_numpy(truths)
+
+        expected = Classifier(input_dim=200, dtype=torch.float64)
+        expected.fit(x, y, l2_penalty=l2_penalty)
+
+        classifier = Classifier(input_dim=200, dtype=torch.float64)
+        classifier.fit(x, y, l2_penalty=l2_penalty, solver="irls")
+        assert classifier.num_iters < 20
+
+        torch.testing.assert_close(
+            classifier.linear.weight.data,
+            expected.linear.weight.data,
+            atol=1e-3,
+            rtol=1e-3,
+        )
+
+
+def test_irls_batch_matches_fit_irls():
+    # Primal solver, and the dual solver with fewer samples than dimensions
+    for n_samples, l2_penalty in [(600, 0.0), (100, 0.01)]:
+        features, truths = make_classification(
+            n_samples=n_samples, n_features=200, random_state=0
+        )
+        x, y = torch.from_numpy(features), torch.from_numpy(truths).double()
+
+        # Each model of the batch is fit on a different subset of the samples
+        torch.manual_seed(0)
+        masks = torch.rand(3, len(x)) < 0.7
+        weight = torch.zeros(3, 1, 200, dtype=x.dtype)
+        bias = torch.zeros(3, 1, dtype=x.dtype)
+        _irls_batch(
+            x,
+            y,
+            weight,
+            bias,
+            sample_weights=masks.double(),
+            l2_penalty=l2_penalty,
+            max_iter=100,
+        )
+
+        for i, mask in enumerate(masks):
+            classifier = Classifier(input_dim=200, dtype=torch.float64)
+            classifier.fit(x[mask], y[mask], l2_penalty=l2_penalty, solver="irls")
+            torch.testing.assert_close(weight[i], classifier.linear.weight.data)
+            torch.testing.assert_close(bias[i], classifier.linear.bias.data)
+
+    # Both solvers should give the same regularization path
+    features, truths = make_classification(n_samples=300, n_features=20, random_state=0)
+    x, y = torch.from_numpy(features), torch.from_numpy(truths).double()
+    paths = [
+        Classifier(input_dim=20, dtype=torch.float64).fit_cv(x, y, solver=solver)
+        for solver in ("lbfgs", "irls")
+    ]
+    assert paths[0].best_penalty == paths[1].best_penalty
+    torch.testing.assert_close(
+        torch.tensor(paths[1].losses), torch.tensor(paths[0].losses), rtol=1e-3, atol=0
+    )
+
+
+def test_fit_stacked_matches_fit():
+    # Layers with very different scales, which converge at different speeds
+    features, truths = make_classification(n_samples=500, n_features=20, random_state=0)
+    x, y = torch.from_numpy(features), torch.from_numpy(truths)
+    stack = torch.stack([x * scale for scale in (0.1, 1.0, 30.0)])
+    stack[1] += torch.randn_like(x)
+
+    classifiers = Classifier.fit_stacked(stack, y, l2_penalty=0.01)
+    assert len(classifiers) == 3
+
+    for layer_x, classifier in zip(stack, classifiers):
+        expected = Classifier(input_dim=20, dtype=torch.float64)
+        expected.fit(layer_x, y, l2_penalty=0.01)
+
+        torch.testing.assert_close(
+            classifier.linear.weight.data,
+            expected.linear.weight.data,
+            atol=1e-4,
+            rtol=1e-4,
+        )
+        torch.testing.assert_close(
+            classifier(layer_x).sigmoid(),
+            expected(layer_x).sigmoid(),
+            atol=1e-3,
+            rtol=0,
+        )
+
+
+def test_ridge_fitter():
+    features, truths = make_classification(
+        n_samples=1000, n_features=20, random_state=0
+    )
+    x, y = torch.from_numpy(features), torch.from_numpy(truths)
+
+    streamed = RidgeFitter(20, dtype=torch.float64)
+    for x_chunk, y_chunk in zip(x.split(77), y.split(77)):
+        streamed.update(x_chunk, y_chunk)
+
+    # The weights should be the LDA direction (Sigma + penalty)^-1 (mu_1 - mu_0)
+    centered = torch.cat([x[y == 0] - x[y == 0].mean(0), x[y == 1] - x[y == 1].mean(0)])
+    sigma = x.T.cov(correction=0)
+    sigma.diagonal().add_(1e-3 * sigma.trace() / 20)
+    direction = torch.linalg.solve(sigma, x[y == 1].mean(0) - x[y == 0].mean(0))
+
+    classifier = streamed.fit()
+    weight = classifier.linear.weight.data[0]
+    assert torch.cosine_similarity(weight, direction, dim=0) > 1 - 1e-8
+
+    # The logits should be those of LDA, with Gaussian scores of shared variance
+    scores = x @ direction
+    means = torch.stack([scores[y == 0].mean(), scores[y == 1].mean()])
+    within_var = (centered @ direction).var(correction=0)
+    scale = (means[1] - means[0]) / within_var
+    prior = y.double().mean()
+    expected = scale * (scores - means.mean()) + torch.logit(prior)
+    torch.testing.assert_close(classifier(x), expected)
+
+
+def test_ridge_fitter_float32_offset():
+    torch.manual_seed(0)
+    n, d = 20_000, 64
+
+    # Hidden states often have a few features with huge offsets
+    y = torch.randint(0, 2, (n,))
+    x = torch.randn(n, d, dtype=torch.float64)
+    x += 0.1 * y[:, None] * torch.randn(d, dtype=torch.float64)
+    x[:, :4] += 3e3
+
+    fitters = [RidgeFitter(d, dtype=torch.float32), RidgeFitter(d, dtype=torch.float64)]
+    for x_chunk, y_chunk in zip(x.split(1000), y.split(1000)):
+        for fitter in fitters:
+            fitter.update(x_chunk, y_chunk)
+
+    single, double = (fitter.fit() for fitter in fitters)
+    torch.testing.assert_close(single(x.float()).double(), double(x), atol=1e-2, rtol=0)
+
+
+def test_inlp_matches_explicit_projection():
+    torch.manual_seed(0)
+
+    # Anisotropic noise, so the class means still differ after each projection
+    y = torch.randint(0, 2, (2000,))
+    x = torch.randn(2000, 32, dtype=torch.float64) * torch.logspace(-1, 1, 32)
+    x += 0.1 * y[:, None] * torch.randn(32, dtype=torch.float64)
+
+    result = Classifier.inlp(x, y, max_iter=5)
+    assert len(result.classifiers) == 5
+
+    # Same losses as fitting each classifier to explicitly projected data
+    projected = x
+    for clf, loss in zip(result.classifiers, result.losses):
+        expected = Classifier(32, dtype=torch.float64)
+        assert expected.fit(projected, y) == pytest.approx(loss, rel=1e-4, abs=1e-6)
+        projected = expected.nullspace_project(projected)
+
+    # The classifiers should be mutually orthogonal, and usable on the raw data
+    weights = torch.cat([clf.linear.weight.data for clf in result.classifiers])
+    gram = weights @ weights.T
+    torch.testing.assert_close(gram, gram.diag().diag(), atol=1e-8, rtol=0)
+    assert all(clf.erased is None for clf in result.classifiers)
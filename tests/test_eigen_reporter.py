@@ -1,6 +1,13 @@
+import pytest
 import torch
 
-from elk.training import EigenFitter, EigenFitterConfig
+from elk.training import (
+    EigenFitter,
+    EigenFitterConfig,
+    MultiLayerEigenFitter,
+    eigen_reporter,
+)
+from elk.truncated_eigh import ConvergenceError
 from elk.utils import batch_cov, cov_mean_fused
 
 
@@ -45,3 +52,262 @@ def test_eigen_reporter():
     torch.testing.assert_close(reporter.intracluster_cov, expected_invariance)
 
     assert reporter.n == N
+
+
+@pytest.mark.parametrize("use_centroids", [True, False])
+def test_multi_layer_eigen_fitter(use_centroids: bool):
+    num_layers = 3
+    num_variants = 4
+    hidden_size = 10
+
+    torch.manual_seed(0)
+    x = torch.randn(num_layers, 100, num_variants, 3, hidden_size, dtype=torch.float64)
+
+    # LEACE erases a 2D subspace, so the top 3 eigenvectors are always unique
+    cfg = EigenFitterConfig(num_heads=3, use_centroids=use_centroids)
+
+    multi = MultiLayerEigenFitter(
+        cfg,
+        hidden_size,
+        num_layers,
+        num_classes=3,
+        dtype=torch.float64,
+        num_variants=num_variants,
+    )
+    for chunk in x.chunk(3, dim=1):
+        multi.update(chunk)
+
+    reporters = multi.fit_streaming()
+    assert len(reporters) == num_layers
+
+    for i, reporter in enumerate(reporters):
+        single = EigenFitter(
+            cfg,
+            hidden_size,
+            num_classes=3,
+            dtype=torch.float64,
+            num_variants=num_variants,
+        )
+        for chunk in x[i].chunk(3, dim=0):
+            single.update(chunk)
+
+        torch.testing.assert_close(multi.class_means[i], single.class_means)
+        torch.testing.assert_close(multi.intercluster_cov[i], single.intercluster_cov)
+        torch.testing.assert_close(multi.intracluster_cov[i], single.intracluster_cov)
+        torch.testing.assert_close(multi.contrastive_xcov[i], single.contrastive_xcov)
+
+        # Eigenvectors are only unique up to sign, so compare the projections
+        expected = single.fit_streaming().weight
+        torch.testing.assert_close(
+            reporter.weight.mT @ reporter.weight, expected.mT @ expected
+        )
+
+
+def test_lanczos_eigen_solver(monkeypatch: pytest.MonkeyPatch):
+    torch.manual_seed(0)
+    hidden_size = 384
+
+    # Hidden states with a decaying spectrum, like those of real models, and a
+    # direction whose sign flips between the two halves of each contrast pair
+    scale = torch.arange(1, hidden_size + 1, dtype=torch.float64) ** -0.7
+    x = torch.randn(500, 4, 2, hidden_size, dtype=torch.float64) * scale
+    truth = torch.randn(500, 1, 1, dtype=torch.float64) * torch.randn(hidden_size)
+    x[:, :, 0] += 0.05 * truth
+    x[:, :, 1] -= 0.05 * truth
+
+    weights = {}
+    for solver in ("dense", "lanczos"):
+        cfg = EigenFitterConfig(eigen_solver=solver)
+        fitter = EigenFitter(cfg, hidden_size, dtype=torch.float64, num_variants=4)
+        weights[solver] = fitter.fit(x).weight
+
+    dense, lanczos = weights["dense"], weights["lanczos"]
+    torch.testing.assert_close(
+        lanczos.mT @ lanczos, dense.mT @ dense, atol=1e-4, rtol=0
+    )
+
+    # Convergence failures should fall back to the dense solver
+    def fail(*args, **kwargs):
+        raise ConvergenceError("Failed to converge.")
+
+    monkeypatch.setattr(eigen_reporter, "truncated_eigh", fail)
+    cfg = EigenFitterConfig(eigen_solver="lanczos")
+    fitter = EigenFitter(cfg, hidden_size, dtype=torch.float64, num_variants=4)
+
+    with pytest.warns(UserWarning, match="dense"):
+        torch.testing.assert_close(fitter.fit(x).weight, dense)
+
+
+def test_vinc_operator():
+    torch.manual_seed(0)
+    x = torch.randn(2, 100, 4, 3, 10, dtype=torch.float64)
+    cfg = EigenFitterConfig(var_weight=0.3)
+
+    multi = MultiLayerEigenFitter(
+        cfg, 10, 2, num_classes=3, dtype=torch.float64, num_variants=4
+    )
+    multi.update(x)
+    single = EigenFitter(cfg, 10, num_classes=3, dtype=torch.float64, num_variants=4)
+    single.update(x[0])
+
+    for op in (single.vinc_operator(), multi.vinc_operator()):
+        # The dense matrix is the same one we'd get by building it explicitly
+        A = (
+            0.3 * single.intercluster_cov
+            - 0.5 * single.intracluster_cov
+            - 0.5 * single.contrastive_xcov
+        )
+        P = single.leace.eraser.P
+        dense = op.to_dense()
+        torch.testing.assert_close(dense[0] if dense.ndim == 3 else dense, P @ A @ P.mT)
+
+        # Matrix-vector products use the symmetric part of the dense matrix
+        v = torch.randn(*op.shape[:-1], dtype=torch.float64)
+        expected = 0.5 * (dense + dense.mT) @ v.unsqueeze(-1)
+        torch.testing.assert_close(op.matvec(v), expected.squeeze(-1))
+
+
+def test_eigen_reporter_many_classes():
+    torch.manual_seed(0)
+    k, hidden_size = 14, 16
+    x = torch.randn(3, 50, 2, k, hidden_size, dtype=torch.float64)
+
+    fitter = EigenFitter(
+        EigenFitterConfig(), hidden_size, k, dtype=torch.float64, num_variants=2
+    )
+
+    # Reference implementation looping over classes and pairs of classes
+    n = 0
+    means = torch.zeros(k, hidden_size, dtype=torch.float64)
+    inter = torch.zeros(hidden_size, hidden_size, dtype=torch.float64)
+    xcov = torch.zeros(hidden_size, hidden_size, dtype=torch.float64)
+
+    for batch in x:
+        fitter.update(batch)
+
+        n += len(batch)
+        deltas, deltas2 = [], []
+        for i, h in enumerate(batch.mean(1).unbind(1)):
+            delta = h - means[i]
+            means[i] += delta.sum(dim=0) / n
+            delta2 = h - means[i]
+
+            inter.addmm_(delta.mT, delta2, alpha=1 / k)
+            deltas.append(delta)
+            deltas2.append(delta2)
+
+        for i, d in enumerate(deltas):
+            for j, d_ in enumerate(deltas2):
+                if i != j:
+                    xcov.addmm_(d.mT, d_, alpha=1 / (k * (k - 1)))
+
+    torch.testing.assert_close(fitter.class_means, means)
+    torch.testing.assert_close(fitter.intercluster_cov_M2, inter)
+    torch.testing.assert_close(fitter.contrastive_xcov_M2, xcov)
+
+
+def test_merge_eigen_fitters():
+    torch.manual_seed(0)
+    x = torch.randn(2, 120, 4, 3, 10, dtype=torch.float64)
+    cfg = EigenFitterConfig(num_heads=3)
+
+    def make(cls, *args):
+        return cls(cfg, 10, *args, num_classes=3, dtype=torch.float64, num_variants=4)
+
+    sequential = make(EigenFitter)
+    sequential.update(x[0])
+
+    # Uneven shards, including an empty one
+    shards = []
+    for chunk in [x[0, :7], x[0, 7:80], x[0, 80:80], x[0, 80:]]:
+        shard = make(EigenFitter)
+        if len(chunk):
+            shard.update(chunk)
+        shards.append(shard)
+
+    # Populate the cached eraser, which merging should invalidate
+    shards[0].leace.eraser
+
+    merged = EigenFitter.reduce(shards)
+    assert merged.n == sequential.n
+    assert shards[0].n == 7, "reduce() shouldn't modify its inputs"
+
+    for name in (
+        "class_means",
+        "intercluster_cov_M2",
+        "intracluster_cov",
+        "contrastive_xcov_M2",
+    ):
+        torch.testing.assert_close(getattr(merged, name), getattr(sequential, name))
+
+    for name in ("mean_x", "mean_z", "sigma_xx_", "sigma_xz_", "n"):
+        torch.testing.assert_close(
+            getattr(merged.leace, name), getattr(sequential.leace, name)
+        )
+
+    # The reporters should agree
+    expected = sequential.fit_streaming()
+    reporter = merged.fit_streaming()
+    torch.testing.assert_close(reporter.eraser.P, expected.eraser.P)
+    torch.testing.assert_close(
+        reporter.weight.mT @ reporter.weight, expected.weight.mT @ expected.weight
+    )
+
+    # Same for the multi-layer fitter
+    sequential = make(MultiLayerEigenFitter, 2)
+    sequential.update(x)
+
+    shards = [make(MultiLayerEigenFitter, 2) for _ in range(3)]
+    for shard, chunk in zip(shards, x.chunk(3, dim=1)):
+        shard.update(chunk)
+
+    merged = MultiLayerEigenFitter.reduce(shards)
+    torch.testing.assert_close(merged.contrastive_xcov, sequential.contrastive_xcov)
+    torch.testing.assert_close(merged.intercluster_cov, sequential.intercluster_cov)
+    torch.testing.assert_close(merged.intracluster_cov, sequential.intracluster_cov)
+
+
+@pytest.mark.parametrize("solver", ["dense", "lanczos"])
+def test_fit_grid(solver):
+    torch.manual_seed(0)
+    x = torch.randn(300, 3, 2, 20, dtype=torch.float64)
+    hparams = [(a, b) for a in (0.0, 0.5, 1.0) for b in (0.0, 0.5, 1.0)]
+
+    def make(var_weight=0.0, neg_cov_weight=0.5):
+        cfg = EigenFitterConfig(
+            var_weight=var_weight, neg_cov_weight=neg_cov_weight, eigen_solver=solver
+        )
+        fitter = EigenFitter(cfg, 20, dtype=torch.float64, num_variants=3)
+        fitter.update(x)
+        return fitter
+
+    # Solving the whole grid at once should match fitting each point separately
+    reporters = make().fit_grid(hparams)
+    for (a, b), reporter in zip(hparams, reporters):
+        expected = make(a, b).fit_streaming()
+        assert (reporter.weight @ expected.weight.mT).abs() > 1 - 1e-6
+
+
+def test_leave_one_out():
+    torch.manual_seed(0)
+    x = torch.randn(4, 50, 3, 2, 10, dtype=torch.float64)
+
+    def make():
+        return EigenFitter(EigenFitterConfig(), 10, dtype=torch.float64, num_variants=3)
+
+    folds = [make() for _ in x]
+    for fold, chunk in zip(folds, x):
+        fold.update(chunk)
+
+    # Each complement should have the statistics of all the other folds
+    for i, complement in enumerate(EigenFitter.leave_one_out(folds)):
+        expected = make()
+        expected.update(torch.cat([chunk for j, chunk in enumerate(x) if j != i]))
+
+        assert complement.n == expected.n
+        torch.testing.assert_close(
+            complement.contrastive_xcov_M2, expected.contrastive_xcov_M2
+        )
+        torch.testing.assert_close(complement.leace.sigma_xx_, expected.leace.sigma_xx_)
+
+    assert all(fold.n == 50 for fold in folds), "Inputs shouldn't be modified"
@@ -0,0 +1,100 @@
+from copy import deepcopy
+from pathlib import Path
+
+import numpy as np
+import torch
+from datasets import Array3D, Dataset, DatasetDict, Features, Value
+
+from elk.extraction import Extract
+from elk.metrics import evaluate_preds
+from elk.training import CcsConfig, CcsReporter
+from elk.training.train import Elicit
+
+
+def synthetic_split(n: int, v: int = 3, d: int = 16, seed: int = 0) -> Dataset:
+    """Hidden states stored as int16 bit patterns of float16, as in `extract()`."""
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(0, 2, n)
+    x = rng.standard_normal((n, v, 2, d)) + 2 * rng.standard_normal(d)
+
+    # The true choice is shifted along a fixed direction
+    sign = np.where(np.arange(2) == labels[:, None], 1.0, -1.0)
+    x += sign[:, None, :, None] * np.linspace(-1, 1, d)
+
+    features = Features(
+        {
+            "hidden_1": Array3D(dtype="int16", shape=(v, 2, d)),
+            "label": Value(dtype="int64"),
+        }
+    )
+    hiddens = x.astype(np.float16).view(np.int16)
+    return Dataset.from_dict({"hidden_1": hiddens, "label": labels}, features)
+
+
+def test_streaming_elicit_pools_without_loading_train(tmp_path: Path, monkeypatch):
+    datasets = [
+        (
+            name,
+            DatasetDict(
+                train=synthetic_split(300 + 50 * i, seed=i),
+                validation=synthetic_split(100, seed=10 + i),
+            ),
+        )
+        for i, name in enumerate(["imdb", "sst2"])
+    ]
+    run = Elicit(
+        data=Extract(model="gpt2", datasets=("imdb", "sst2")),
+        net=CcsConfig(batch_size=64, optimizer="adam", num_epochs=5, num_tries=2),
+        supervised="ridge",
+        out_dir=tmp_path,
+    )
+    run.datasets = datasets
+
+    # Loading the whole training split is what streaming is meant to avoid
+    prepare_data = Elicit.prepare_data
+
+    def val_only(self, device, layer, split_type):
+        assert split_type != "train", "Loaded the whole training split"
+        return prepare_data(self, device, layer, split_type)
+
+    monkeypatch.setattr(Elicit, "prepare_data", val_only)
+    dfs = run.apply_to_layer(1, ["cpu"], world_size=1)
+
+    assert set(dfs["eval"].dataset) == {"imdb", "sst2"}
+    assert len(dfs["lr_eval"]) == 2 * 3
+
+    # The streamed train metrics are those of the saved reporter on each dataset
+    reporter = torch.load(tmp_path / "reporters" / "layer_1.pt", weights_only=False)
+    monkeypatch.setattr(Elicit, "prepare_data", prepare_data)
+    train_dict = run.prepare_data("cpu", 1, "train")
+
+    train_eval = dfs["train_eval"].set_index(["dataset", "ensembling"])
+    for ds_name, (train_h, train_gt, _) in train_dict.items():
+        for mode in ("none", "partial", "full"):
+            expected = evaluate_preds(train_gt, reporter(train_h), mode).to_dict()
+            row = train_eval.loc[(ds_name, mode)]
+            assert row["acc_estimate"] == expected["acc_estimate"]
+            assert abs(row["auroc_estimate"] - expected["auroc_estimate"]) < 1e-6
+
+
+def test_platt_scale_scores_matches_platt_scale():
+    torch.manual_seed(0)
+    split = synthetic_split(500)
+    hiddens = torch.tensor(split["hidden_1"], dtype=torch.int16).view(torch.float16)
+    hiddens = hiddens.float()
+    labels = torch.tensor(split["label"])[:, None, None].eq(torch.arange(2))
+    labels = labels.expand(-1, hiddens.shape[1], -1)
+
+    cfg = CcsConfig(num_epochs=20, num_tries=1)
+    direct = CcsReporter(cfg, hiddens.shape[-1], num_variants=hiddens.shape[1])
+    direct.fit(hiddens)
+    streamed = deepcopy(direct)
+
+    direct.platt_scale(labels, hiddens)
+    with torch.no_grad():
+        scores = streamed(hiddens).flatten()
+    scaled = streamed.platt_scale_scores(labels.flatten(), scores)
+
+    torch.testing.assert_close(streamed.scale, direct.scale, atol=1e-4, rtol=1e-4)
+    torch.testing.assert_close(streamed.bias, direct.bias, atol=1e-4, rtol=1e-4)
+    torch.testing.assert_close(scaled.view_as(labels), streamed(hiddens).detach())
@@ -0,0 +1,40 @@
+from pathlib import Path
+
+import torch
+
+from elk.extraction import ForwardMemo
+from elk.utils import float_to_int16
+
+
+def test_forward_memo(tmp_path: Path):
+    path = tmp_path / "memo.sqlite"
+    memo = ForwardMemo(path, "model\nlast\n(1, 2)", num_vectors=2, hidden_size=8)
+
+    ids = torch.tensor([[1, 2, 3]])
+    labels = torch.tensor([[-100, -100, 3]])
+    hiddens = float_to_int16(torch.randn(2, 8))
+
+    key = memo.key(ids, labels)
+    assert memo.get(key) is None
+
+    memo.put(key, hiddens, -1.5)
+    memo.close()
+
+    # Entries should persist across instances with the same namespace
+    memo = ForwardMemo(path, "model\nlast\n(1, 2)", num_vectors=2, hidden_size=8)
+    result = memo.get(memo.key(ids, labels))
+    assert result is not None
+
+    cached_hiddens, lm_logit = result
+    assert torch.equal(cached_hiddens, hiddens)
+    assert lm_logit == -1.5
+
+    # Different labels, ids or namespaces shouldn't collide
+    assert memo.get(memo.key(ids)) is None
+    assert memo.get(memo.key(ids[..., :2], labels[..., :2])) is None
+
+    other = ForwardMemo(path, "model\nmean\n(1, 2)", num_vectors=2, hidden_size=8)
+    assert other.get(other.key(ids, labels)) is None
+
+    assert memo.hits == 1 and memo.misses == 2
+    assert memo.hit_rate == 1 / 3
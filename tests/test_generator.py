@@ -0,0 +1,36 @@
+from pathlib import Path
+
+import numpy as np
+from datasets import Array3D, Features, SplitInfo, Value
+
+from elk.extraction import _GeneratorBuilder
+
+
+def _generate(num_rows: list[int]):
+    for i in range(num_rows[0]):
+        yield dict(label=i, hidden_1=np.full((2, 2, 256), i, dtype=np.int16))
+
+
+def test_generator_builder_byte_budget(tmp_path: Path):
+    features = Features(
+        {
+            "label": Value(dtype="int64"),
+            "hidden_1": Array3D(dtype="int16", shape=(2, 2, 256)),
+        }
+    )
+    builder = _GeneratorBuilder(
+        cache_dir=str(tmp_path),
+        features=features,
+        generator=_generate,
+        split_name="train",
+        split_info=SplitInfo(name="train", num_examples=10),
+        # Each row takes up 2 KiB, so we should flush every 3 rows
+        max_bytes_per_flush=3 * 2048 + 100,
+        gen_kwargs=dict(num_rows=[10]),
+    )
+    assert builder._writer_batch_size == 3
+
+    builder.download_and_prepare(max_shard_size=4 * 2048)
+    ds = builder.as_dataset(split="train")
+    assert ds["label"] == list(range(10))
+    assert np.asarray(ds[9]["hidden_1"]).max() == 9
@@ -1,9 +1,12 @@
 from itertools import islice
+from random import Random
 from typing import Literal
 
 import pytest
+from datasets import Dataset
 
 from elk.extraction import Extract, load_prompts
+from elk.extraction.prompt_loading import _lazy_permutation, _sample_rows
 from elk.promptsource.templates import DatasetTemplates
 
 
@@ -38,3 +41,28 @@ def test_load_prompts():
     cfg = Extract.load_yaml("tests/dbpedia_prompts.yaml")
     test_single_split(cfg, "train")
     test_single_split(cfg, "val")
+
+
+def test_sample_rows():
+    ds = Dataset.from_dict({"idx": list(range(1000)), "label": [0, 1] * 500})
+
+    # The first rows should come from a single small batch of sampled ids
+    rows = list(islice(_sample_rows(ds, 10, Random(42)), 10))
+    assert len({row["idx"] for row in rows}) == 10
+    assert all(row["label"] == row["idx"] % 2 for row in rows)
+
+    # If we keep consuming, we should eventually see every row exactly once
+    all_rows = [row["idx"] for row in _sample_rows(ds, 100, Random(42))]
+    assert sorted(all_rows) == list(range(1000))
+    assert all_rows != list(range(1000))
+
+
+def test_lazy_permutation():
+    for n in (0, 1, 2, 17, 1000):
+        perm = list(_lazy_permutation(n, Random(n)))
+        assert sorted(perm) == list(range(n))
+
+    # Drawing a few ids only costs as much as the ids drawn, however large the range
+    ids = list(islice(_lazy_permutation(10**15, Random(0)), 100))
+    assert len(set(ids)) == 100
+    assert all(0 <= i < 10**15 for i in ids)
@@ -0,0 +1,164 @@
+from pathlib import Path
+
+import pytest
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+import elk.extraction.extraction as extraction
+from elk.extraction import Extract
+from elk.extraction.extraction import _packed_forward, extract_hiddens
+from elk.utils import hidden_column
+
+WORDS = "review : the movie was good bad great awful fine i liked hated it so much"
+WORDS += " sentiment is positive negative"
+
+
+def tiny_gpt2() -> GPT2LMHeadModel:
+    torch.manual_seed(42)
+    config = GPT2Config(
+        n_embd=32,
+        n_layer=3,
+        n_head=4,
+        n_positions=64,
+        vocab_size=100,
+        bos_token_id=0,
+        eos_token_id=0,
+        architectures=["GPT2LMHeadModel"],
+    )
+    return GPT2LMHeadModel(config).eval()
+
+
+@pytest.mark.parametrize("token_loc", ["first", "last", "mean"])
+@torch.inference_mode()
+def test_packed_forward_matches_unpacked(token_loc):
+    model = tiny_gpt2()
+    layer_indices = tuple(range(1, model.config.num_hidden_layers + 1))
+
+    # Contrast pairs of different lengths, with the answer at the end
+    torch.manual_seed(42)
+    sequences = []
+    for length in [5, 9, 7, 12, 3, 8]:
+        ids = torch.randint(0, model.config.vocab_size, (1, length))
+        labels = ids.clone()
+        labels[:, :-2] = -100
+        sequences.append((ids, labels))
+
+    # Force several rows so that we also test the row splitting
+    packed = _packed_forward(
+        model,
+        sequences,
+        layer_indices=layer_indices,
+        token_locs=(token_loc,),
+        max_length=20,
+    )
+
+    for (ids, labels), (hiddens, lm_logit) in zip(sequences, packed):
+        outputs = model(input_ids=ids, labels=labels, output_hidden_states=True)
+        expected = [outputs.hidden_states[i][0] for i in layer_indices]
+        if token_loc == "first":
+            expected = [h[0] for h in expected]
+        elif token_loc == "last":
+            expected = [h[-1] for h in expected]
+        else:
+            expected = [h.mean(dim=0) for h in expected]
+
+        # Matmuls over packed rows can sum in a different order than over a single
+        # sequence, so we can only expect agreement up to float32 rounding error
+        torch.testing.assert_close(hiddens, torch.stack(expected))
+        torch.testing.assert_close(lm_logit, -outputs.loss)
+
+
+def fake_prompts(*args, max_examples: int, **kwargs):
+    """Three examples with two variants of a contrast pair each. The last example
+    repeats a variant of the first one, so its prompts are in the memo."""
+    reviews = [
+        "the movie was good i liked it so much",
+        "the movie was awful",
+        "i hated it",
+        "the movie was fine",
+        "the movie was good i liked it so much",
+        "great movie",
+    ]
+    for k in range(max_examples):
+        yield dict(
+            prompts=[
+                [
+                    dict(question=f"review : {review} sentiment is", answer=answer)
+                    for answer in (" negative", " positive")
+                ]
+                for review in reviews[2 * k : 2 * k + 2]
+            ],
+            label=k % 2,
+            template_names=["a", "b"],
+        )
+
+
+@torch.inference_mode()
+def test_extract_hiddens_packed_matches_unpacked(tmp_path: Path, monkeypatch):
+    # A random model and word-level tokenizer saved to disk, so no download is needed
+    model_dir = tmp_path / "tiny-gpt2"
+    tiny_gpt2().save_pretrained(model_dir)
+
+    vocab = {w: i for i, w in enumerate(["<unk>", *WORDS.split()])}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, unk_token="<unk>", model_max_length=24
+    ).save_pretrained(model_dir)
+
+    monkeypatch.setenv("ELK_DIR", str(tmp_path / "elk"))
+    monkeypatch.setattr(extraction, "load_prompts", fake_prompts)
+
+    # Record how many sequences are packed for each example
+    num_packed = []
+
+    def counting_packed_forward(model, sequences, **kwargs):
+        num_packed.append(len(sequences))
+        return _packed_forward(model, sequences, **kwargs)
+
+    monkeypatch.setattr(extraction, "_packed_forward", counting_packed_forward)
+
+    cfg = Extract(
+        model=str(model_dir),
+        datasets=("fake",),
+        max_examples=(3, 3),
+        token_loc="last",
+        extra_token_locs=("first", "mean"),
+    )
+    expected = list(extract_hiddens(cfg))
+    assert not num_packed
+
+    cfg = Extract(
+        model=str(model_dir),
+        datasets=("fake",),
+        max_examples=(3, 3),
+        token_loc="last",
+        extra_token_locs=("first", "mean"),
+        memoize=True,
+        pack_sequences=True,
+    )
+    packed = list(extract_hiddens(cfg))
+
+    # Each example has 4 sequences, which need several rows of at most 24 tokens. The
+    # repeated variant of the last example comes from the memo and isn't packed.
+    assert num_packed == [4, 4, 2]
+    assert len(packed) == len(expected) == 3
+
+    columns = [
+        hidden_column(layer, loc) for layer in (1, 2) for loc in (None, "first", "mean")
+    ]
+    for record, reference in zip(packed, expected):
+        assert set(record) == set(reference)
+        assert record["text_questions"] == reference["text_questions"]
+        assert record["label"] == reference["label"]
+
+        for col in columns:
+            # Rounding to float16 can flip the last bit of the packed hidden states
+            torch.testing.assert_close(
+                record[col].view(torch.float16),
+                reference[col].view(torch.float16),
+                atol=1e-3,
+                rtol=2e-3,
+            )
+        torch.testing.assert_close(record["model_logits"], reference["model_logits"])
@@ -0,0 +1,51 @@
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from elk.extraction.extraction import _PrefixCache
+
+
+@pytest.mark.parametrize("token_loc", ["first", "last", "mean"])
+@torch.inference_mode()
+def test_prefix_cache_matches_full_sequence(token_loc):
+    torch.manual_seed(0)
+    config = GPT2Config(n_embd=32, n_layer=3, n_head=4, n_positions=64, vocab_size=100)
+    model = GPT2LMHeadModel(config).eval()
+    layer_indices = tuple(range(1, config.n_layer + 1))
+
+    prefix_ids = torch.randint(0, config.vocab_size, (1, 12))
+    cache = _PrefixCache.build(model, prefix_ids, layer_indices)
+
+    for length in [1, 4, 9]:
+        # Question tokens followed by a two-token answer
+        rest = torch.randint(0, config.vocab_size, (1, length + 2))
+        ids = torch.cat([prefix_ids, rest], dim=-1)
+        labels = ids.clone()
+        labels[:, :-2] = -100
+
+        continuation = cache.strip(ids)
+        assert continuation is not None
+        hiddens, lm_logit = cache.forward(
+            model,
+            continuation,
+            labels[:, prefix_ids.shape[-1] :],
+            layer_indices=layer_indices,
+            token_locs=(token_loc,),
+        )
+
+        outputs = model(input_ids=ids, labels=labels, output_hidden_states=True)
+        expected = [outputs.hidden_states[i][0] for i in layer_indices]
+        if token_loc == "first":
+            expected = [h[0] for h in expected]
+        elif token_loc == "last":
+            expected = [h[-1] for h in expected]
+        else:
+            expected = [h.mean(dim=0) for h in expected]
+
+        torch.testing.assert_close(hiddens, torch.stack(expected))
+        torch.testing.assert_close(lm_logit, -outputs.loss)
+
+    # Sequences that don't start with the prefix tokens, or don't continue past them,
+    # have to be run in full
+    assert cache.strip(prefix_ids) is None
+    assert cache.strip(torch.cat([prefix_ids[:, 1:], prefix_ids], dim=-1)) is None
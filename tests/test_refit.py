@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import pytest
+import torch
+from einops import rearrange, repeat
+from safetensors.torch import save_file
+from simple_parsing.helpers.serialization import save
+
+from elk.metrics import to_one_hot
+from elk.training import EigenFitter, EigenFitterConfig
+from elk.training.refit import Refit, refit_reporter
+
+
+def fit_with_stats(x: torch.Tensor, gt: torch.Tensor, cfg: EigenFitterConfig):
+    """Mimic `Elicit`, returning the Platt scaled reporter and saved statistics."""
+    (n, v, k, d) = x.shape
+    fitter = EigenFitter(cfg, d, num_variants=v)
+    fitter.update(x)
+    reporter = fitter.fit_streaming()
+
+    hiddens = rearrange(x, "n v k d -> (n v k) d")
+    labels = to_one_hot(repeat(gt, "n -> (n v)", v=v), k).flatten().bool()
+    reporter.platt_scale(labels, hiddens)
+
+    stats = fitter.state_dict()
+    stats["label_means"] = torch.stack(
+        [hiddens[~labels].mean(0), hiddens[labels].mean(0)]
+    )
+    stats["label_counts"] = torch.stack([(~labels).sum(), labels.sum()])
+    return reporter, stats
+
+
+def synthetic_data(n: int = 2000, d: int = 16):
+    torch.manual_seed(0)
+    gt = torch.randint(0, 2, (n,))
+    direction = torch.randn(d)
+    x = torch.randn(n, 3, 2, d) + torch.randn(d)
+
+    # The true choice is shifted along `direction`
+    sign = to_one_hot(gt, 2).float() * 2 - 1
+    x += sign[:, None, :, None] * direction
+    return x, gt
+
+
+def test_refit_reporter():
+    x, gt = synthetic_data()
+    cfg = EigenFitterConfig()
+    reporter, stats = fit_with_stats(x, gt, cfg)
+
+    # Same hyperparameters should give the same reporter, with similar calibration
+    refit = refit_reporter(cfg, stats)
+    torch.testing.assert_close(refit.weight, reporter.weight)
+    torch.testing.assert_close(refit(x), reporter(x), atol=0.1, rtol=0.1)
+
+    # Different hyperparameters should match a reporter fit from scratch
+    new_cfg = EigenFitterConfig(var_weight=0.5, neg_cov_weight=0.2)
+    expected, _ = fit_with_stats(x, gt, new_cfg)
+    refit = refit_reporter(new_cfg, stats)
+    torch.testing.assert_close(refit.weight, expected.weight)
+
+
+def test_refit_command(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("ELK_DIR", str(tmp_path))
+
+    x, gt = synthetic_data()
+    reporter_dir = tmp_path / "run" / "reporters"
+    reporter_dir.mkdir(parents=True)
+    save(EigenFitterConfig(), reporter_dir / "cfg.yaml", save_dc_types=True)
+
+    with pytest.raises(ValueError, match="No reporter statistics"):
+        Refit(Path("run")).execute()
+
+    for layer in (0, 1):
+        _, stats = fit_with_stats(x, gt, EigenFitterConfig())
+        save_file(stats, reporter_dir / f"layer_{layer}.safetensors")
+
+    Refit(Path("run"), var_weight=0.5).execute()
+    (out_dir,) = (tmp_path / "run" / "refits").iterdir()
+    assert sorted(p.name for p in (out_dir / "reporters").iterdir()) == [
+        "cfg.yaml",
+        "layer_0.pt",
+        "layer_1.pt",
+    ]
+    assert EigenFitterConfig.load(out_dir / "reporters" / "cfg.yaml").var_weight == 0.5
@@ -0,0 +1,67 @@
+import torch
+
+from elk.training import EigenFitter, EigenFitterConfig, SketchedEigenFitter
+from elk.training.sketch import FrequentDirections
+
+
+def test_frequent_directions():
+    torch.manual_seed(0)
+    x = torch.randn(1000, 50, dtype=torch.float64) @ torch.randn(50, 50).double()
+
+    sketch = FrequentDirections(50, 10, dtype=torch.float64)
+    for chunk in x.split(37):
+        sketch.update(chunk)
+
+    B = sketch.sketch
+    assert len(B) <= 20
+
+    # 0 <= X^T X - B^T B <= ||X||_F^2 / rank
+    err = torch.linalg.eigvalsh(x.mT @ x - B.mT @ B)
+    assert err.min() > -1e-8
+    assert err.max() <= x.square().sum() / 10
+    torch.testing.assert_close(sketch.total, x.square().sum())
+
+
+def test_sketched_eigen_fitter():
+    torch.manual_seed(0)
+    hidden_size = 256
+
+    # Low-rank hidden states plus noise, with an offset mean and a direction whose
+    # sign flips between the two halves of each contrast pair
+    basis = torch.randn(20, hidden_size, dtype=torch.float64)
+    z = torch.randn(2000, 1, 1, 20, dtype=torch.float64)
+    x = (z + 0.3 * torch.randn(2000, 4, 2, 20, dtype=torch.float64)) @ basis
+    x += 0.05 * torch.randn(2000, 4, 2, hidden_size, dtype=torch.float64) + 3.0
+
+    truth = torch.randn(2000, 1, 1, dtype=torch.float64) * basis[0]
+    x[:, :, 0] += truth
+    x[:, :, 1] -= truth
+
+    dense = EigenFitter(
+        EigenFitterConfig(), hidden_size, dtype=torch.float64, num_variants=4
+    )
+    sketched = SketchedEigenFitter(
+        EigenFitterConfig(sketch_rank=32),
+        hidden_size,
+        dtype=torch.float64,
+        num_variants=4,
+    )
+    for chunk in x.chunk(4):
+        dense.update(chunk)
+        sketched.update(chunk)
+
+    # The sketch should find the same reporter direction as the dense statistics
+    expected = dense.fit_streaming().weight
+    reporter = sketched.fit_streaming()
+    assert (reporter.weight @ expected.mT).abs() > 0.999
+
+    # The sketched eraser should still make the class means indistinguishable
+    erased = reporter.eraser(x)
+    torch.testing.assert_close(
+        erased[:, :, 0].mean((0, 1)), erased[:, :, 1].mean((0, 1))
+    )
+
+    # Matrix-vector products should agree with the materialized VINC matrix
+    op = sketched.vinc_operator()
+    v = torch.randn(3, hidden_size, dtype=torch.float64)
+    torch.testing.assert_close(op.matvec(v), v @ op.to_dense().mT)
@@ -0,0 +1,64 @@
+from pathlib import Path
+
+import pytest
+import torch
+from simple_parsing.helpers.serialization import save
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from elk.evaluation import Eval
+from elk.extraction import Extract
+from elk.extraction.extraction import _packed_forward
+from elk.training.train import Elicit
+
+
+@torch.inference_mode()
+def test_packed_forward_multiple_token_locs():
+    torch.manual_seed(0)
+    config = GPT2Config(n_embd=32, n_layer=3, n_head=4, n_positions=64, vocab_size=100)
+    model = GPT2LMHeadModel(config).eval()
+    layer_indices = (1, 3)
+
+    sequences = []
+    for length in [5, 9, 7]:
+        ids = torch.randint(0, config.vocab_size, (1, length))
+        labels = ids.clone()
+        labels[:, :-2] = -100
+        sequences.append((ids, labels))
+
+    kwargs = dict(layer_indices=layer_indices, max_length=32)
+    locs = ("last", "first", "mean")
+    combined = _packed_forward(model, sequences, token_locs=locs, **kwargs)
+    separate = [
+        _packed_forward(model, sequences, token_locs=(loc,), **kwargs) for loc in locs
+    ]
+
+    # One forward pass should give every location, ordered by location then by layer
+    for k, (hiddens, lm_logit) in enumerate(combined):
+        assert hiddens.shape == (len(locs) * len(layer_indices), config.n_embd)
+
+        expected = torch.cat([results[k][0] for results in separate])
+        torch.testing.assert_close(hiddens, expected)
+        torch.testing.assert_close(lm_logit, separate[0][k][1])
+
+
+def test_layer_column():
+    data = Extract(model="gpt2", datasets=("imdb",), extra_token_locs=("mean",))
+    assert Elicit(data=data).layer_column(3) == "hidden_3"
+    assert Elicit(data=data, use_token_loc="last").layer_column(3) == "hidden_3"
+    assert Elicit(data=data, use_token_loc="mean").layer_column(3) == "hidden_3_mean"
+
+    with pytest.raises(ValueError, match="was not extracted"):
+        Elicit(data=data, use_token_loc="first").layer_column(3)
+
+
+def test_eval_uses_source_token_loc(tmp_path: Path):
+    data = Extract(model="gpt2", datasets=("imdb",), extra_token_locs=("mean",))
+    save(Elicit(data=data, use_token_loc="mean"), tmp_path / "cfg.yaml")
+
+    # Transfer eval data with the same extra location should use it by default
+    eval_data = Extract(model="gpt2", datasets=("sst2",), extra_token_locs=("mean",))
+    run = Eval(data=eval_data, source=tmp_path)
+    assert run.layer_column(3) == "hidden_3_mean"
+
+    with pytest.raises(ValueError, match="trained on the 'mean' token location"):
+        Eval(data=eval_data, source=tmp_path, use_token_loc="last")